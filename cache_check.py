@@ -0,0 +1,82 @@
+import logging
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+logging.basicConfig(
+    format='%(asctime)s.%(msecs)03d - %(name)s:%(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S',
+    level=logging.INFO
+)
+
+logger = logging.getLogger(__name__)
+
+"""
+checks that the run cache serves a run again when only the way it is drawn changes - fish_schooling.py is copied,
+    its settings edited between two runs as a user would, and the second run must be drawn from the first's cached
+    trajectory rather than simulated
+
+    python cache_check.py
+"""
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+# a small seeded run, so that it is cached
+SETTINGS = dict(SEED=1, PERIODS=6, FISH_TO_SPAWN=12, SHARKS_TO_SPAWN=1, RENDER_EVERY=1)
+RENDER_EVERY = 2  # the only setting changed before the second run
+SERVED = 'served from the cache'
+
+
+def set_constants(path: str, constants: dict):
+    """rewrite module level constants of a script in place, keeping their comments"""
+    with open(path) as f:
+        source = f.read()
+    for name, value in constants.items():
+        source, found = re.subn(rf'^{name} = .*?(\s+#.*)?$', lambda m: f'{name} = {value!r}{m.group(1) or ""}',
+                                source, count=1, flags=re.MULTILINE)
+        if not found:
+            raise KeyError(f'{name} is not set in {path}')
+    with open(path, 'w') as f:
+        f.write(source)
+
+
+def run(directory: str) -> str:
+    """run the copied fish_schooling.py, :return: its log"""
+    result = subprocess.run([sys.executable, 'fish_schooling.py'], cwd=directory, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f'fish_schooling.py failed:\n{result.stderr[-2000:]}')
+    return result.stderr
+
+
+def main() -> int:
+    with tempfile.TemporaryDirectory() as directory:
+        shutil.copy2(os.path.join(ROOT, 'fish_schooling.py'), directory)
+        shutil.copytree(os.path.join(ROOT, 'utils'), os.path.join(directory, 'utils'),
+                        ignore=shutil.ignore_patterns('__pycache__'))
+        script = os.path.join(directory, 'fish_schooling.py')
+        set_constants(script, SETTINGS)
+
+        if SERVED in run(directory):
+            logger.error('the first run was served from an empty cache')
+            return 1
+        set_constants(script, dict(RENDER_EVERY=RENDER_EVERY))
+        if SERVED not in run(directory):
+            logger.error(f'changing RENDER_EVERY to {RENDER_EVERY} simulated the run again')
+            return 1
+
+        # one run, its trajectory and a video for each RENDER_EVERY
+        cache_directory = os.path.join(directory, 'cache')
+        runs = [x for x in os.listdir(cache_directory) if os.path.isdir(os.path.join(cache_directory, x))]
+        videos = [x for x in os.listdir(os.path.join(cache_directory, runs[0]))
+                  if x.startswith('movements-') and not x.endswith('_frames.txt')]
+        if len(runs) != 1 or len(videos) != 2:
+            logger.error(f'expected one cached run with two videos, found {len(runs)} runs and videos {videos}')
+            return 1
+    logger.info('changing RENDER_EVERY drew the cached trajectory again instead of simulating')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
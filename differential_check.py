@@ -0,0 +1,71 @@
+import logging
+import random
+import sys
+
+import numpy as np
+
+from fish_schooling import FISH_NAMES, OCEAN_BOUNDS, OCEAN_SCALE
+from utils.differential import ENGINES, compare_distributions, compare_lockstep
+from utils.environ import OceanEnvironment, FishMongers
+from utils.fishies import Snapper, Shark
+
+logger = logging.getLogger(__name__)
+
+"""
+checks every faster engine against the reference model (see utils.differential) and fails if any has drifted
+
+    python differential_check.py [engine name ...]
+"""
+
+FISH_TO_SPAWN = 60
+SHARKS_TO_SPAWN = 2
+TICKS = 30
+SEEDS = (0, 1, 2)  # distribution checks only, lockstep checks use the first
+
+
+def make_ocean(seed: int) -> OceanEnvironment:
+    random.seed(seed)
+    np.random.seed(seed)
+    bounds_scaled = tuple((x[0] * OCEAN_SCALE, x[1] * OCEAN_SCALE) for x in OCEAN_BOUNDS)
+    ocean = OceanEnvironment(bounding_coordinates=bounds_scaled, minimum_shoal_size=3, predation=True)
+    graveyard = FishMongers()
+    for _ in range(SHARKS_TO_SPAWN):
+        Shark(FISH_NAMES).make_it_rain(ocean, graveyard, place_attempts=10)
+    for _ in range(FISH_TO_SPAWN):
+        Snapper(FISH_NAMES).make_it_rain(ocean, graveyard, place_attempts=10)
+    return ocean
+
+
+def main(engine_names: list) -> int:
+    failures = 0
+    for name in engine_names or ENGINES:
+        engine = ENGINES[name]
+        if engine.lockstep:
+            divergence = compare_lockstep(make_ocean, engine(), ticks=TICKS, seed=SEEDS[0])
+            if divergence is None:
+                logger.info(f'{name}: identical to the reference for {TICKS} ticks')
+            else:
+                failures += 1
+                logger.error(f'{name}: first diverged at tick {divergence.tick}, fish {divergence.unique_id} '
+                             f'({divergence.check}) \n reference: {divergence.reference} \n'
+                             f' {name}: {divergence.candidate}')
+        else:
+            for statistic, (difference, passed, divergence) in compare_distributions(
+                    make_ocean, engine, ticks=TICKS, seeds=SEEDS).items():
+                if engine.statistics is not None and statistic not in engine.statistics:
+                    continue
+                failures += not passed
+                log = logger.info if passed else logger.error
+                log(f'{name}: {statistic} differs from the reference by {difference:.3f}')
+                if divergence is not None:
+                    logger.error(f'{name}: first diverged at tick {divergence.tick}, fish {divergence.unique_id} '
+                                 f'({divergence.check}) \n reference: {divergence.reference} \n'
+                                 f' {name}: {divergence.candidate}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    # fish_schooling configures logging for the simulation - only the results are wanted here
+    logging.getLogger().setLevel(logging.INFO)
+    logging.getLogger('utils').setLevel(logging.WARNING)
+    sys.exit(main(sys.argv[1:]))
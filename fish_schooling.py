@@ -1,4 +1,7 @@
 import logging
+import os
+import random
+import shutil
 
 import numpy as np
 
@@ -23,7 +26,6 @@ TODO
    * NEXT - when fish have fish to follow, they just chill if their range is too far - this indicates something wrong with the random.choice of moves
    * NEXT UPDATE - finish on creating fish memory. Maybe add previous_rotation for consistency with previous_position
    * DBSCAN should happen according to follow distance - for this to work the clustering needs to happen for each species separately
-   * Enter fish brains into postgres database
    * update DBSCAN to be class with .fit() a la sklearn. THINK border points should only be used to connect to other points if they have len(neighbours) > min_points. https://github.com/rugbyprof/4553-Spatial-DS/wiki/Dbscan
    * sure there is something up with the available options generated
    * the fish don't really need to know what moves are available - instead choose a move and check whether it available
@@ -48,23 +50,178 @@ FISH_NAMES = ['Alex', 'Andy', 'Ben', 'Clemente', 'Desi', 'Ela', 'Eleanor', 'Jame
 FISH_TO_SPAWN = 31
 SHARKS_TO_SPAWN = 2
 OCEAN_SCALE = 7  # to make ocean larger or smaller - integer
-MOVES_PER_PERIOD = 1
+CONTINUOUS_MOVEMENT = False  # fish glide to float coordinates instead of searching the integer lattice
+SHARED_NEIGHBOUR_TABLE = False  # measure distances and angles between nearby fish once per tick
+TOPOLOGICAL_NEIGHBOURS = None  # e.g. 7 - fish only react to this many of their nearest fish, None for all in sight
+AGGREGATE_RADIUS = None  # e.g. 150 - shoals with no shark this close move as one body, None to move fish by fish
+SPATIAL_REORDER_EVERY = None  # e.g. 10 - periods between sorting fish along a Z-order curve, None for spawn order
+PREDATION = False  # if True sharks eat the snappers that come within their repel distance
+MOVES_PER_PERIOD = 1  # fish move this many times between frames, only the last move is clustered and drawn
 PERIODS = 250
+PARALLEL_WORKERS = 0  # > 0 to decide fish moves in parallel worker processes
+PIPELINE_DEPTH = 0  # > 0 to simulate ahead of the renderer, queueing up to this many frames
+RENDER_EVERY = 1  # every period is simulated, every RENDER_EVERY-th period is drawn
+INTERPOLATED_FRAMES = 0  # e.g. 5 - in-between frames drawn between simulated ones, for a smoother video
+RENDER_BUDGET = None  # seconds - if set, RENDER_EVERY is chosen so that rendering fits this budget
+METRICS_DIRECTORY = None  # e.g. 'output/metrics' - per period shoal metrics, None to skip
+BRAIN_DATABASE = None  # e.g. 'output/brains.sqlite' - every fish's state and neighbours each period, None to skip
+MEMORY_PROFILE_EVERY = None  # e.g. 100 - periods between heap snapshots, reported next to the video. None to skip
+TRACK_SHOALS = False  # keep shoal ids stable between periods, logging splits and merges next to the metrics
+LAZY_PERCEPTION = False  # only rebuild a fish's surroundings when something could have come into view
+RENDERER = 'matplotlib'  # 'raster' draws frames directly with numpy, for populations too large for matplotlib
+MOVEMENT_MODEL = 'lattice'  # 'boids' for the much cheaper vectorised force based model (utils.boids), 'batch' for
+# many replicate lattice oceans stepped together (utils.batch), summarised per period rather than drawn
+BOIDS_TOROIDAL = False  # boids only - wrap around the ocean's bounding box rather than stopping at the coast
+BATCH_WORLDS = 100  # batch only - replicate oceans, each seeded from SEED (or at random) and spawned as one ocean
+BATCH_DIRECTORY = 'output/batch'  # batch only - every world's shoal summary each period
+SEED = None  # e.g. 1 - seeds the random numbers, so that a run can be repeated (and served from the run cache)
+RUN_CACHE_DIRECTORY = 'cache'  # seeded runs, their outputs and videos are kept here and reused. None to always simulate
+RUN_CACHE_MAX_BYTES = 2 * 1024 ** 3  # least recently used entries are evicted once the cache is larger than this
+VIDEO_FILENAME = 'output/movements.mp4'
+TRAJECTORY_DIRECTORY = 'output/trajectory'  # every period's snapshot, recorded when the run will be cached
 
 # unscaled coordinate bounds of ocean edge
 OCEAN_BOUNDS = ((0, 10), (20, -10), (35, -15), (40, -5), (50, 5), (60, 10), (80, 0), (90, 30), (70, 60),
                 (35, 70), (25, 70), (5, 60), (-10, 30), (0, 10))
 
 
+def simulation_settings() -> dict:
+    """
+    every setting that changes what is simulated, the run cache's key. The key also covers the code in utils and the
+        code of this script, though not its settings (see utils.cache.code_version)
+    """
+    species = {profile.name: {x: getattr(profile, x) for x in profile.__slots__ if x != '_markers'}
+               for profile in (Snapper.species, Shark.species)}
+    return dict(seed=SEED, movement_model=MOVEMENT_MODEL, ocean_bounds=OCEAN_BOUNDS, ocean_scale=OCEAN_SCALE,
+                fish_to_spawn=FISH_TO_SPAWN, sharks_to_spawn=SHARKS_TO_SPAWN, fish_names=FISH_NAMES, species=species,
+                periods=PERIODS, moves_per_period=MOVES_PER_PERIOD, continuous_movement=CONTINUOUS_MOVEMENT,
+                shared_neighbour_table=SHARED_NEIGHBOUR_TABLE, topological_neighbours=TOPOLOGICAL_NEIGHBOURS,
+                aggregate_radius=AGGREGATE_RADIUS, predation=PREDATION, parallel_workers=PARALLEL_WORKERS,
+                lazy_perception=LAZY_PERCEPTION, spatial_reorder_every=SPATIAL_REORDER_EVERY,
+                track_shoals=TRACK_SHOALS, boids_toroidal=BOIDS_TOROIDAL)
+
+
+def video_entry() -> str:
+    """cache entry name of the video, one per way of drawing a run"""
+    from utils.cache import scenario_key
+    settings = dict(renderer=RENDERER, render_every=RENDER_EVERY, render_budget=RENDER_BUDGET,
+                    interpolated_frames=INTERPOLATED_FRAMES)
+    return f'movements-{scenario_key(settings, include_code=False)[:16]}{os.path.splitext(VIDEO_FILENAME)[1]}'
+
+
+def frames_filename() -> str:
+    """where the period shown by each frame of the video is written (see utils.pipeline.RenderSchedule.write_frames)"""
+    return f'{os.path.splitext(VIDEO_FILENAME)[0]}_frames.txt'
+
+
+def cache_video(cache, run_key: str):
+    """keep the video just drawn in the run cache, with the periods its frames show"""
+    cache.put(run_key, video_entry(), VIDEO_FILENAME)
+    if os.path.exists(frames_filename()):
+        cache.put(run_key, f'{os.path.splitext(video_entry())[0]}_frames.txt', frames_filename())
+
+
+def run_outputs() -> dict:
+    """outputs of a simulation that are kept in the run cache, entry name -> path"""
+    outputs = {}
+    if METRICS_DIRECTORY is not None:
+        outputs['metrics'] = METRICS_DIRECTORY
+    if BRAIN_DATABASE is not None and MOVEMENT_MODEL == 'lattice':
+        outputs['brains.sqlite'] = BRAIN_DATABASE
+    return outputs
+
+
+def serve_from_cache(cache, run_key: str, bounds_scaled: tuple) -> bool:
+    """
+    copy a cached run's outputs into place, drawing its video from the cached trajectory if it has not been drawn
+        this way before
+    :return: False if the run, or one of the outputs asked for, is not cached - so has to be simulated
+    """
+    cached = {name: cache.get(run_key, name) for name in run_outputs()}
+    video = cache.get(run_key, video_entry())
+    trajectory = cache.get(run_key, 'trajectory') if video is None else None
+    if None in cached.values() or (video is None and trajectory is None):
+        return False
+
+    for name, path in cached.items():
+        if os.path.isdir(path):
+            shutil.copytree(path, run_outputs()[name])
+        else:
+            shutil.copy2(path, run_outputs()[name])
+    if video is not None:
+        shutil.copy2(video, VIDEO_FILENAME)
+        frames = cache.get(run_key, f'{os.path.splitext(video_entry())[0]}_frames.txt')
+        if frames is not None:
+            shutil.copy2(frames, frames_filename())
+        return True
+
+    from utils.trajectory import render_trajectory
+    if MOVEMENT_MODEL == 'boids':
+        from utils.boids import BoidsOcean
+        ocean = BoidsOcean(bounding_coordinates=bounds_scaled, minimum_shoal_size=3, toroidal=BOIDS_TOROIDAL)
+    else:
+        ocean = OceanEnvironment(bounding_coordinates=bounds_scaled, minimum_shoal_size=3)
+    render_trajectory(ocean, trajectory, species=[Snapper.species, Shark.species], save_filename=VIDEO_FILENAME,
+                      render_every=RENDER_EVERY, render_budget=RENDER_BUDGET, renderer=RENDERER,
+                      interpolated_frames=INTERPOLATED_FRAMES)
+    cache_video(cache, run_key)
+    return True
+
+
 def main():
     bounds_scaled = tuple((x[0] * OCEAN_SCALE, x[1] * OCEAN_SCALE) for x in OCEAN_BOUNDS)  # scale ocean
 
     # create directories
     delete_and_rebuild_directory(directory_paths=REBUILD_DIRECTORIES)
 
+    cache = None
+    if SEED is not None:
+        random.seed(SEED)
+        np.random.seed(SEED)
+    # a batch is summarised rather than drawn, so there is no video or trajectory to cache
+    if MOVEMENT_MODEL == 'batch':
+        simulate_batch(bounds_scaled)
+        return
+    # a profiled run has to actually run
+    if SEED is not None and RUN_CACHE_DIRECTORY is not None and MEMORY_PROFILE_EVERY is None:
+        from utils.cache import RunCache, scenario_key
+        cache = RunCache(RUN_CACHE_DIRECTORY, max_bytes=RUN_CACHE_MAX_BYTES)
+        run_key = scenario_key(simulation_settings())
+        if serve_from_cache(cache, run_key, bounds_scaled):
+            logger.info(f'run {run_key[:16]} served from the cache at {RUN_CACHE_DIRECTORY}')
+            return
+    trajectory_directory = TRAJECTORY_DIRECTORY if cache is not None else None
+
+    if MOVEMENT_MODEL == 'boids':
+        from utils.boids import BoidsOcean
+        boids = BoidsOcean(bounding_coordinates=bounds_scaled, minimum_shoal_size=3, toroidal=BOIDS_TOROIDAL,
+                           track_shoals=TRACK_SHOALS, reorder_every=SPATIAL_REORDER_EVERY)
+        boids.spawn(Shark.species, SHARKS_TO_SPAWN)
+        boids.spawn(Snapper.species, FISH_TO_SPAWN)
+        boids.passage_of_time(PERIODS, save_filename=VIDEO_FILENAME, pipeline_depth=PIPELINE_DEPTH,
+                              render_every=RENDER_EVERY, render_budget=RENDER_BUDGET,
+                              metrics_directory=METRICS_DIRECTORY, renderer=RENDERER,
+                              interpolated_frames=INTERPOLATED_FRAMES, trajectory_directory=trajectory_directory)
+    else:
+        simulate_lattice(bounds_scaled, trajectory_directory=trajectory_directory)
+
+    if cache is not None:
+        cache.put(run_key, 'trajectory', TRAJECTORY_DIRECTORY)
+        for name, path in run_outputs().items():
+            cache.put(run_key, name, path)
+        cache_video(cache, run_key)
+
+
+def simulate_lattice(bounds_scaled: tuple, trajectory_directory: str=None):
+    """populate the lattice ocean and run it, drawing VIDEO_FILENAME"""
     # create ocean
-    the_sea = OceanEnvironment(bounding_coordinates=bounds_scaled, minimum_shoal_size=3)
     old_johns_fish_mongers = FishMongers()
+    the_sea = OceanEnvironment(bounding_coordinates=bounds_scaled, minimum_shoal_size=3,
+                               continuous_movement=CONTINUOUS_MOVEMENT,
+                               shared_neighbour_table=SHARED_NEIGHBOUR_TABLE, predation=PREDATION,
+                               graveyard=old_johns_fish_mongers, topological_neighbours=TOPOLOGICAL_NEIGHBOURS,
+                               aggregate_radius=AGGREGATE_RADIUS, track_shoals=TRACK_SHOALS,
+                               spatial_reorder_every=SPATIAL_REORDER_EVERY)
 
     fish_names = FISH_NAMES
     for i in range(SHARKS_TO_SPAWN):
@@ -79,7 +236,25 @@ def main():
         fsh = Snapper([name])
         fsh.make_it_rain(the_sea, old_johns_fish_mongers, place_attempts=10)
 
-    the_sea.passage_of_time(PERIODS, save_filename='output/movements.mp4')
+    the_sea.passage_of_time(PERIODS, save_filename=VIDEO_FILENAME, parallel_workers=PARALLEL_WORKERS,
+                           pipeline_depth=PIPELINE_DEPTH, render_every=RENDER_EVERY, render_budget=RENDER_BUDGET,
+                           lazy_perception=LAZY_PERCEPTION, moves_per_period=MOVES_PER_PERIOD,
+                           metrics_directory=METRICS_DIRECTORY, renderer=RENDERER, brain_database=BRAIN_DATABASE,
+                           memory_profile_every=MEMORY_PROFILE_EVERY, interpolated_frames=INTERPOLATED_FRAMES,
+                           trajectory_directory=trajectory_directory)
+
+
+def simulate_batch(bounds_scaled: tuple):
+    """run BATCH_WORLDS replicate oceans together, writing every world's summary each period to BATCH_DIRECTORY"""
+    from utils.batch import OceanBatch
+    batch = OceanBatch(bounding_coordinates=bounds_scaled, predation=PREDATION)
+    first_seed = SEED if SEED is not None else np.random.randint(2 ** 31)
+    for world in range(BATCH_WORLDS):
+        batch.add_world([(Shark.species, SHARKS_TO_SPAWN), (Snapper.species, FISH_TO_SPAWN)], seed=first_seed + world,
+                        minimum_shoal_size=3)
+    summary = batch.run(PERIODS, directory=BATCH_DIRECTORY)
+    logger.info(f'{BATCH_WORLDS} worlds after {PERIODS} periods: {np.mean(summary["shoal_count"]):.2f} shoals and '
+                f'{np.mean(summary["fish_count"]):.1f} fish per world, summaries written to {BATCH_DIRECTORY}')
 
 
 if __name__ == '__main__':
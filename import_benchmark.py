@@ -0,0 +1,62 @@
+import logging
+import statistics
+import subprocess
+import sys
+
+logging.basicConfig(
+    format='%(asctime)s.%(msecs)03d - %(name)s:%(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S',
+    level=logging.INFO
+)
+
+logger = logging.getLogger(__name__)
+
+"""
+cold start import benchmark for the simulation core - each run imports the core in a fresh interpreter (as a batch
+    worker or process pool child would) and fails if a display or plotting module comes with it
+
+    python import_benchmark.py
+"""
+
+CORE_MODULES = ['utils.environ', 'utils.fishies', 'utils.positioning', 'utils.spatial_utils', 'utils.dbscan']
+# none of these should be imported just to simulate
+FORBIDDEN_MODULES = ['matplotlib', 'tkinter', 'PIL']
+RUNS = 5
+MAX_SECONDS = 1.0  # median cold start import time allowed
+
+PROBE = f'''
+import sys, time
+start = time.perf_counter()
+import {', '.join(CORE_MODULES)}
+seconds = time.perf_counter() - start
+loaded = sorted({{m.split('.')[0] for m in sys.modules}} & set({FORBIDDEN_MODULES!r}))
+print(seconds, ','.join(loaded))
+'''
+
+
+def cold_import() -> tuple:
+    """
+    import the core in a new interpreter
+    :return: seconds taken, forbidden top level modules that were imported
+    """
+    result = subprocess.run([sys.executable, '-c', PROBE], capture_output=True, text=True, check=True)
+    seconds, _, loaded = result.stdout.strip().partition(' ')
+    return float(seconds), [x for x in loaded.split(',') if x]
+
+
+def main() -> int:
+    timings = []
+    for run in range(RUNS):
+        seconds, loaded = cold_import()
+        if loaded:
+            logger.error(f'importing the simulation core also imported: {loaded}')
+            return 1
+        timings.append(seconds)
+        logger.info(f'run {run + 1}: {seconds:.3f}s')
+    median = statistics.median(timings)
+    logger.info(f'median cold start import: {median:.3f}s (limit {MAX_SECONDS}s)')
+    return 0 if median <= MAX_SECONDS else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
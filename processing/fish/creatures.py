@@ -1,128 +1,141 @@
 import math
 import random
 
-from spatial_utils import SpatialUtils
+
+# the same steering forces as utils/boids.py, fish by fish in plain python - Processing's python mode is Jython,
+# which cannot load numpy
+
+
+def _unit(x, y):
+    length = math.hypot(x, y)
+    if length == 0:
+        return 0, 0
+    return x / length, y / length
 
 
 class Fish:
     def __init__(self, colour, ocean, separation_distance, x=None, y=None,
                      velocity=1, separation_weighting=2, radius=5,
-                         cohesion_weighting=1.5, alignment_weighting=1):
+                         cohesion_weighting=1.5, alignment_weighting=1, perception_distance=None,
+                             obstacle_weighting=3, seek_weighting=1, max_steering=0.25):
         self.colour = colour
         self.radius = radius
-        self.x = x if x is not None else random.choice(range(width))
-        self.y = y if y is not None else random.choice(range(height))
+        self.x = x if x is not None else random.choice(range(ocean.width))
+        self.y = y if y is not None else random.choice(range(ocean.height))
         self.separation_distance = separation_distance
+        # fish further away than this are not seen at all, for cohesion and alignment
+        self.perception_distance = perception_distance if perception_distance is not None else \
+            3 * separation_distance
         self.velocity = velocity
+        heading = random.uniform(0, 2 * math.pi)
+        self.vx, self.vy = math.cos(heading) * velocity, math.sin(heading) * velocity
         ocean.population.append(self)
         self.environment = ocean
-        self.rotation = 0
-        
+        self.rotation = math.degrees(heading)
+
         self.separation_weighting = separation_weighting
         self.cohesion_weighting = cohesion_weighting
         self.alignment_weighting = alignment_weighting
-        # self.create_shape()
-        
-    # def create_shape(self):
-    #     s = createShape()
-    #     # shapeMode(CENTER)
-    #     s.beginShape(TRIANGLE_STRIP)
-    #     s.vertex(30, 75)
-    #     s.vertex(40, 20)
-    #     s.vertex(50, 75)
-    #     s.vertex(60, 20)
-    #     s.vertex(70, 75)
-    #     s.vertex(80, 20)
-    #     s.vertex(90, 75)
-    #     s.endShape()
-                
+        self.obstacle_weighting = obstacle_weighting
+        self.seek_weighting = seek_weighting
+        self.max_steering = max_steering
+
     def move(self):
-        chosen_dir = self.assess_enviromment()
-        if chosen_dir != 0:
-            new_x, new_y = SpatialUtils.new_position_angle_length(chosen_dir, self.velocity, [self.x, self.y])
-        else:
-            new_x, new_y = self.x, self.y
-            x_change = random.choice(range(-self.velocity, self.velocity + 1, 1))
-            y_change = random.choice(range(-self.velocity, self.velocity + 1, 1))
-            new_x += x_change
-            new_y += y_change
-        self.x, self.y = new_x, new_y
-        self.rotation = chosen_dir
-        
-        self.x = 0 if self.x > width else self.x
-        self.y = 0 if self.y > height else self.y
-    
-    def separation(self):
-        dirs = []
-        weighted_dists = []
-        for other_fish in self.environment.population:
-            distance = SpatialUtils.calc_distance([self.x, self.y], [other_fish.x, other_fish.y])
-            if 0 < distance < self.separation_distance:
-                # create weights for distances such that closer fish are proportionately more influential on decision
-                distance_weighted = 1 / distance
-                weighted_dists.append(distance_weighted)
-                dir_to_fish = SpatialUtils.calc_angle([self.x, self.y], [other_fish.x, other_fish.y])
-                dir_away_from_fish = dir_to_fish - 180
-                dirs.append(dir_away_from_fish)
-        weighted_dirs = []
-        for dir, distance in zip(dirs, weighted_dists):
-            weight_adj = distance / sum(weighted_dists)
-            weighted_dirs.append(weight_adj * dir)
-        desired_dir = sum(weighted_dirs)
-        return desired_dir
-    
-    def cohesion(self):
-        return 0
-    
-    def alignment(self):
-        return 0 
-    
+        fx, fy = self.assess_enviromment()
+        # limit how sharply the fish can turn
+        limit = self.max_steering * self.velocity
+        strength = math.hypot(fx, fy)
+        if strength > limit:
+            fx, fy = fx * limit / strength, fy * limit / strength
+        dx, dy = _unit(self.vx + fx, self.vy + fy)
+        if dx == 0 and dy == 0:
+            dx, dy = _unit(self.vx, self.vy)
+        self.vx, self.vy = dx * self.velocity, dy * self.velocity
+        self.x += self.vx
+        self.y += self.vy
+        self.rotation = math.degrees(math.atan2(self.vy, self.vx))
+
+        # the sketch's ocean wraps around
+        self.x %= self.environment.width
+        self.y %= self.environment.height
+
+    def steer(self, x, y):
+        """change of velocity that would have the fish swimming at full speed in direction (x, y)"""
+        x, y = _unit(x, y)
+        if x == 0 and y == 0:
+            return 0, 0
+        return x * self.velocity - self.vx, y * self.velocity - self.vy
+
+    def neighbours(self):
+        """(fish, dx, dy, distance) for every other fish within perception distance, measured the short way round"""
+        found = []
+        for other_fish in self.environment.nearby(self, self.perception_distance):
+            dx, dy = self.environment.offset(self.x, self.y, other_fish.x, other_fish.y)
+            distance = math.hypot(dx, dy)
+            if 0 < distance < self.perception_distance:
+                found.append((other_fish, dx, dy, distance))
+        return found
+
+    def separation(self, neighbours):
+        # create weights for distances such that closer fish are proportionately more influential on decision
+        x, y = 0, 0
+        for other_fish, dx, dy, distance in neighbours:
+            if distance < self.separation_distance:
+                x -= dx / distance ** 2
+                y -= dy / distance ** 2
+        return self.steer(x, y)
+
+    def cohesion(self, neighbours):
+        # towards the centre of the fish in sight
+        x, y = 0, 0
+        for other_fish, dx, dy, distance in neighbours:
+            x += dx
+            y += dy
+        return self.steer(x, y)
+
+    def alignment(self, neighbours):
+        # the way the fish in sight are heading
+        x, y = 0, 0
+        for other_fish, dx, dy, distance in neighbours:
+            x += other_fish.vx
+            y += other_fish.vy
+        return self.steer(x, y)
+
     def obstacle_avoidance(self):
-        return 0
-        
+        # away from every obstacle whose edge is within perception distance, closer ones pushing harder
+        x, y = 0, 0
+        for ox, oy, obstacle_radius in self.environment.obstacles:
+            dx, dy = self.environment.offset(self.x, self.y, ox, oy)
+            gap = math.hypot(dx, dy) - obstacle_radius - self.radius
+            if gap < self.perception_distance:
+                ux, uy = _unit(dx, dy)
+                x -= ux / max(gap, 1)
+                y -= uy / max(gap, 1)
+        return self.steer(x, y)
+
     def seek(self):
-        return 0
-        
-                
+        # towards the ocean's food, if there is any
+        if self.environment.food is None:
+            return 0, 0
+        return self.steer(*self.environment.offset(self.x, self.y, *self.environment.food))
+
     def assess_enviromment(self):
-        sep_angle = self.separation()
-        coh_angle = self.cohesion()
-        align_angle = self.alignment()
-        # TODO add self.random move()
-        
-        # calculated weighted average of desired angle
-        # only consider weight if it has a non-zero effect
-        adj_weights_angles = [[x, y] for x, y in zip([sep_angle, coh_angle, align_angle], [self.separation_weighting, self.cohesion_weighting, self.alignment_weighting]) if x != 0]
-        weighted_angles = []
-        for angle, weight in adj_weights_angles:
-            weight_adj = weight / sum(j for i, j in adj_weights_angles)
-            weighted_angles.append(weight_adj * angle)
-        chosen_dir = sum(weighted_angles)
-        return chosen_dir
-            
-    
-    def create_creature_shape(self):
-        x1, y1 = self.x - self.radius / 2, self.y - self.radius
-        x2, y2 = self.x, self.y + self.radius
-        x3, y3 = self.x + self.radius / 2, self.y - self.radius
-        # x1, y1 = self.x - self.radius / 2, self.y - self.radius
-        # x2, y2 = self.x - self.radius * 2 , self.y - self.radius * 2
-        # x3, y3 = self.x + self.radius / 2, self.y - self.radius
-        return x1, y1, x2, y2, x3, y3
-    
+        """weighted sum of the steering forces, forces with nothing to react to are zero"""
+        neighbours = self.neighbours()
+        forces = [(self.separation(neighbours), self.separation_weighting),
+                  (self.cohesion(neighbours), self.cohesion_weighting),
+                  (self.alignment(neighbours), self.alignment_weighting),
+                  (self.obstacle_avoidance(), self.obstacle_weighting),
+                  (self.seek(), self.seek_weighting)]
+        fx = sum(force[0] * weight for force, weight in forces)
+        fy = sum(force[1] * weight for force, weight in forces)
+        return fx, fy
+
     def display(self):
         fill(self.colour)
-        # self.create_shape()
-        # stroke(255)
-        # pushMatrix()
-        # translate(self.x, self.y)
-        # rotate(self.rotation)
-        # beginShape(TRIANGLES)
-        # vertex(0, -self.radius*2)
-        # vertex(-self.radius, -self.radius*2)
-        # vertex(self.radius, self.radius*2)
-        # endShape()
-        # popMatrix()
-        # x1, y1, x2, y2, x3, y3 = self.create_creature_shape()
-        # triangle(x1, y1, x2, y2, x3, y3)
-        rect(self.x, self.y, 30, 10)
+        pushMatrix()
+        translate(self.x, self.y)
+        rotate(radians(self.rotation))
+        # a triangle pointing the way the fish swims
+        triangle(self.radius * 2, 0, -self.radius, -self.radius, -self.radius, self.radius)
+        popMatrix()
@@ -1,18 +1,53 @@
 
+# interactive sketch of the boids model, the vectorised version for large populations is utils/boids.py
 class Ocean:
-    def __init__(self):
+    def __init__(self, width=640, height=360, cell_size=90):
         self.land_colour = 255
         self.sea_colour = '#006994'
         self.population = []
+        self.width = width
+        self.height = height
+        self.obstacles = []  # (x, y, radius) of each rock the fish swim around
+        self.food = None  # (x, y) the fish seek, None if there is nothing to eat
+        # fish are looked up in a grid of cells rather than each fish checking every other fish
+        self.cell_size = cell_size
+        self.grid = {}
         # self.create_ocean()
-        
-        
+
     def create_ocean(self):
         background(self.sea_colour)
-   
-        
+        fill(self.land_colour)
+        for x, y, radius in self.obstacles:
+            ellipse(x, y, radius * 2, radius * 2)
+        if self.food is not None:
+            ellipse(self.food[0], self.food[1], 6, 6)
+
+    def offset(self, x1, y1, x2, y2):
+        """(dx, dy) from the first point to the second, the short way around the wrapping ocean"""
+        dx = (x2 - x1 + self.width / 2.0) % self.width - self.width / 2.0
+        dy = (y2 - y1 + self.height / 2.0) % self.height - self.height / 2.0
+        return dx, dy
+
+    def _cell(self, x, y):
+        return int(x // self.cell_size), int(y // self.cell_size)
+
+    def index_fish(self):
+        self.grid = {}
+        for fsh in self.population:
+            self.grid.setdefault(self._cell(fsh.x, fsh.y), []).append(fsh)
+
+    def nearby(self, fish, distance):
+        """fish in the cells within distance of fish (the grid is that of the start of the frame)"""
+        columns = int(-(-self.width // self.cell_size))
+        rows = int(-(-self.height // self.cell_size))
+        reach = int(-(-distance // self.cell_size))
+        column, row = self._cell(fish.x, fish.y)
+        cells = set(((column + i) % columns, (row + j) % rows)
+                    for i in range(-reach, reach + 1) for j in range(-reach, reach + 1))
+        return [other for cell in cells for other in self.grid.get(cell, []) if other is not fish]
+
     def swim(self):
+        self.index_fish()
         for fsh in self.population:
             fsh.move()
             fsh.display()
-    
@@ -0,0 +1,27 @@
+import random
+
+import numpy as np
+
+from utils.environ import OceanEnvironment, FishMongers
+from utils.fishies import Snapper, Shark
+
+"""
+small seeded oceans shared by the tests
+"""
+
+# counterclockwise, closed
+SQUARE = ((0, 0), (300, 0), (300, 300), (0, 300), (0, 0))
+NAMES = ['Alex', 'Andy', 'Ben', 'Desi', 'Ela', 'Jamie', 'Mike', 'Oli', 'Pete', 'Will']
+
+
+def make_ocean(seed: int=0, snappers: int=30, sharks: int=2, bounds: tuple=SQUARE, **settings) -> OceanEnvironment:
+    """an ocean of fish placed at random, the same every time for a seed"""
+    random.seed(seed)
+    np.random.seed(seed)
+    graveyard = FishMongers()
+    ocean = OceanEnvironment(bounding_coordinates=bounds, minimum_shoal_size=3, graveyard=graveyard, **settings)
+    for _ in range(sharks):
+        Shark(NAMES).make_it_rain(ocean, graveyard, place_attempts=10)
+    for _ in range(snappers):
+        Snapper(NAMES).make_it_rain(ocean, graveyard, place_attempts=10)
+    return ocean
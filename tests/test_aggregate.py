@@ -0,0 +1,59 @@
+from utils.aggregate import ShoalAggregator
+from utils.environ import FishMongers
+from utils.fishies import Snapper
+from utils.spatial_utils import SpatialUtils
+
+from tests.oceans import NAMES, make_ocean
+
+
+def _quiet_shoal(ocean, front: int, y: int=100) -> list:
+    """five snappers in a row heading east (0 degrees), the front one at (front, y)"""
+    graveyard = FishMongers()
+    members = []
+    for x in range(front - 16, front + 1, 4):
+        fsh = Snapper(NAMES)
+        fsh.make_it_rain(ocean, graveyard, initial_position=[x, y])
+        fsh.shoal_id = 0
+        fsh.rotation = 0
+        fsh.memory = [{'move_distance': 10}]
+        members.append(fsh)
+    return members
+
+
+def _loner(ocean, position: list):
+    fsh = Snapper(NAMES)
+    fsh.make_it_rain(ocean, FishMongers(), initial_position=position)
+    return fsh
+
+
+def test_a_quiet_shoal_moves_as_one_body():
+    ocean = make_ocean(snappers=0, sharks=0)
+    members = _quiet_shoal(ocean, front=100)
+    starts = [list(fsh.position) for fsh in members]
+    moved = ShoalAggregator(ocean, predator_radius=50).advance()
+    assert moved == {fsh.unique_id for fsh in members}
+    assert [fsh.position for fsh in members] == [[x + 10, y] for x, y in starts]
+    assert all(fsh.memory[-1]['move_descr'] == 'shoal' for fsh in members)
+
+
+def test_the_move_is_cut_short_before_landing_on_another_fish():
+    ocean = make_ocean(snappers=0, sharks=0)
+    members = _quiet_shoal(ocean, front=100)
+    # out of the members' reach, but the front fish would land within 5 (half a snapper) of it
+    loner = _loner(ocean, [114, 100])
+    aggregator = ShoalAggregator(ocean, predator_radius=50)
+    aggregator.advance()
+    assert aggregator.last[0].displacement == (9, 0)
+    assert all(SpatialUtils.calc_distance(fsh.position, loner.position) >= loner.size / 2 for fsh in members)
+
+
+def test_a_shoal_at_the_coast_swims_fish_by_fish():
+    ocean = make_ocean(snappers=0, sharks=0)
+    _quiet_shoal(ocean, front=295)
+    assert ShoalAggregator(ocean, predator_radius=50).advance() == set()
+
+
+def test_small_shoals_swim_fish_by_fish():
+    ocean = make_ocean(snappers=0, sharks=0)
+    _quiet_shoal(ocean, front=100)
+    assert ShoalAggregator(ocean, predator_radius=50, min_members=6).advance() == set()
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from utils.batch import OceanBatch
+from utils.fishies import Shark, Snapper
+from utils.metrics import load_columns
+
+from tests.oceans import SQUARE
+
+SPECIES = [(Shark.species, 2), (Snapper.species, 25)]
+
+
+def _run(seeds: list, ticks: int=5, predation: bool=False) -> OceanBatch:
+    batch = OceanBatch(bounding_coordinates=SQUARE, predation=predation)
+    for seed in seeds:
+        batch.add_world(SPECIES, seed=seed)
+    batch.run(ticks)
+    return batch
+
+
+def test_a_world_depends_only_on_its_seed():
+    alone = _run([7])
+    together = _run([3, 7, 11])
+    fish = alone.alive[0].sum()
+    assert np.array_equal(alone.position[0, :fish], together.position[1, :fish])
+    assert np.array_equal(alone.rotation[0, :fish], together.rotation[1, :fish])
+    assert not np.array_equal(together.position[0], together.position[1])
+
+
+def test_fish_stay_in_the_sea_and_apart():
+    batch = _run([0, 1], ticks=10)
+    for w in range(len(batch)):
+        positions = batch.position[w, batch.alive[w]]
+        assert ((positions >= 0) & (positions <= 300)).all()
+        # no two fish on the same coordinate
+        assert len({tuple(x) for x in positions.tolist()}) == len(positions)
+
+
+def test_worlds_cannot_be_added_once_started():
+    batch = _run([0], ticks=1)
+    with pytest.raises(ValueError):
+        batch.add_world(SPECIES, seed=1)
+
+
+def test_predators_eat_only_with_predation():
+    assert _run([0, 1], ticks=30).summary()['fish_count'].tolist() == [27, 27]
+    assert (_run([0, 1], ticks=30, predation=True).summary()['fish_count'] < 27).all()
+
+
+def test_summaries_are_written_per_world_and_tick(tmp_path):
+    batch = OceanBatch(bounding_coordinates=SQUARE)
+    for seed in range(3):
+        batch.add_world(SPECIES, seed=seed)
+    summary = batch.run(4, directory=str(tmp_path))
+    columns = load_columns(str(tmp_path))
+    assert columns['tick'].tolist() == [0] * 3 + [1] * 3 + [2] * 3 + [3] * 3
+    assert columns['world'].tolist() == [0, 1, 2] * 4
+    assert columns['shoal_count'][-3:].tolist() == summary['shoal_count'].tolist()
+    assert (summary['fish_in_shoals'] >= summary['largest_shoal']).all()
@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+
+import utils.environ
+import utils.pipeline
+from utils.boids import BoidsOcean, grid_pairs
+from utils.fishies import Shark, Snapper
+
+from tests.oceans import SQUARE
+
+
+def _brute_force_pairs(positions: np.ndarray, reach: float, extent: np.ndarray=None) -> set:
+    deltas = positions[None, :, :] - positions[:, None, :]
+    if extent is not None:
+        deltas -= extent * np.round(deltas / extent)
+    distances = np.hypot(deltas[..., 0], deltas[..., 1])
+    i, j = np.nonzero((distances < reach) & ~np.eye(len(positions), dtype=bool))
+    return set(zip(i.tolist(), j.tolist()))
+
+
+@pytest.mark.parametrize('toroidal', [False, True])
+def test_grid_pairs_finds_every_pair_in_reach(toroidal):
+    rng = np.random.default_rng(0)
+    origin, extent = np.zeros(2), np.array([100.0, 60.0])
+    positions = rng.random((200, 2)) * extent
+    i, j, delta, distance = grid_pairs(positions, cell_size=12, origin=origin, extent=extent, toroidal=toroidal)
+    assert set(zip(i.tolist(), j.tolist())) == _brute_force_pairs(positions, 12, extent if toroidal else None)
+    assert len(set(zip(i.tolist(), j.tolist()))) == len(i)
+    assert np.allclose(np.hypot(delta[:, 0], delta[:, 1]), distance)
+
+
+def _boids(seed: int=0, toroidal: bool=False) -> BoidsOcean:
+    np.random.seed(seed)
+    boids = BoidsOcean(bounding_coordinates=SQUARE, minimum_shoal_size=3, toroidal=toroidal)
+    boids.spawn(Shark.species, 3)
+    boids.spawn(Snapper.species, 60)
+    return boids
+
+
+@pytest.mark.parametrize('toroidal', [False, True])
+def test_fish_stay_in_the_ocean_at_no_more_than_top_speed(toroidal):
+    boids = _boids(toroidal=toroidal)
+    assert len(boids) == 63
+    for _ in range(20):
+        boids.time_step()
+    assert (boids.position >= 0).all() and (boids.position <= 300).all()
+    speed = np.hypot(boids.velocity[:, 0], boids.velocity[:, 1])
+    assert (speed <= boids.top_speed[boids.code] + 1e-9).all()
+
+
+def test_runs_are_reproducible_for_a_seed():
+    runs = []
+    for _ in range(2):
+        boids = _boids(seed=3)
+        for _ in range(10):
+            boids.time_step()
+        runs.append(boids.position.copy())
+    assert np.array_equal(*runs)
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def perf_counter(self) -> float:
+        return self.now
+
+
+class _SlowRenderer:
+    """draws nothing, but each frame takes seconds_per_frame on the clock"""
+    def __init__(self, clock: _Clock, seconds_per_frame: float):
+        self.clock = clock
+        self.seconds_per_frame = seconds_per_frame
+        self.ticks = []
+
+    def frame_seconds(self, snapshot) -> float:
+        return self.seconds_per_frame
+
+    def save(self, snapshots, frames: int, save_filename: str, fps: int=5, metadata: dict=None):
+        for snapshot in snapshots:
+            self.ticks.append(snapshot.tick)
+            self.clock.now += self.seconds_per_frame * 4  # four times slower than estimated
+
+    def close(self):
+        pass
+
+
+def test_render_budget_widens_render_every(tmp_path, monkeypatch):
+    clock = _Clock()
+    renderer = _SlowRenderer(clock, seconds_per_frame=0.125)
+    monkeypatch.setattr(utils.pipeline, 'time', clock)
+    monkeypatch.setattr(utils.environ, 'make_renderer', lambda ocean, name, labelled_fish=(): renderer)
+    boids = _boids()
+    boids.passage_of_time(100, save_filename=str(tmp_path / 'movements.mp4'), render_budget=2.5)
+    # 20 frames fit to start with, but the first costs four times that - four more fit in the 95 periods left
+    assert renderer.ticks == [4, 28, 52, 76, 99]
+    header, *ticks = (tmp_path / 'movements_frames.txt').read_text().splitlines()
+    assert [int(x) for x in ticks] == renderer.ticks
@@ -0,0 +1,55 @@
+import pytest
+
+from utils.brains import FishBrainDatabase, _query, neighbours_of
+from utils.parallel import ParallelDecisionPool
+from utils.positioning import NearbyWaters
+
+from tests.oceans import make_ocean
+
+CROWDED = ((0, 0), (120, 0), (120, 120), (0, 120), (0, 0))
+
+
+def _seen_before_moving(ocean) -> dict:
+    """unique id -> (predator count, ids of the repel, align and follow fish) as NearbyWaters sees them now"""
+    seen = {}
+    for fsh in ocean.population:
+        sub_env = NearbyWaters(fish=fsh, ocean=ocean)
+        seen[fsh.unique_id] = (sub_env.predator_count, sorted(x.unique_id for x in sub_env.all_nearby_fish))
+    return seen
+
+
+def _recorded(path: str, ocean) -> dict:
+    predators = dict(_query(path, 'SELECT fish_id, predators_seen FROM fish_states WHERE tick = 0'))
+    return {fsh.unique_id: (predators[fsh.unique_id], sorted(x[0] for x in neighbours_of(path, fsh.unique_id, 0)))
+            for fsh in ocean.population}
+
+
+@pytest.mark.parametrize('parallel', [False, True])
+def test_fish_states_hold_what_each_fish_saw(tmp_path, parallel):
+    # the fish swim in turn sequentially, so only the first to swim saw the ocean as it is now
+    ocean = make_ocean(seed=3, snappers=60, sharks=6, bounds=CROWDED)
+    seen = _seen_before_moving(ocean)
+    assert any(predators for predators, _ in seen.values())
+    if parallel:
+        # every neighbour is recorded, rather than the first 16
+        with ParallelDecisionPool(ocean, workers=2, max_recorded_neighbours=64) as pool:
+            pool.step()
+        expected = seen
+    else:
+        expected = {}
+        for fsh in list(ocean.population):
+            expected[fsh.unique_id] = _seen_before_moving(ocean)[fsh.unique_id]
+            fsh.swim(sub_env=NearbyWaters(fish=fsh, ocean=ocean), verbose=False)
+    path = str(tmp_path / 'brains.sqlite')
+    with FishBrainDatabase(path) as brains:
+        brains.record(0, ocean.population)
+    assert _recorded(path, ocean) == expected
+
+
+def test_fish_that_have_not_moved_saw_nothing_yet(tmp_path):
+    ocean = make_ocean(seed=0, snappers=5, sharks=1)
+    path = str(tmp_path / 'brains.sqlite')
+    with FishBrainDatabase(path) as brains:
+        brains.record(0, ocean.population)
+    assert _query(path, 'SELECT COUNT(*) FROM fish_states WHERE predators_seen IS NULL') == [(6, )]
+    assert _query(path, 'SELECT COUNT(*) FROM neighbours') == [(0, )]
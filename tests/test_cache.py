@@ -0,0 +1,97 @@
+import os
+import shutil
+
+import pytest
+
+import utils.cache
+from utils.cache import RunCache, code_version, scenario_key
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def tree(tmp_path):
+    """a copy of the script and model code, to be edited"""
+    shutil.copy2(os.path.join(ROOT, 'fish_schooling.py'), tmp_path)
+    shutil.copytree(os.path.join(ROOT, 'utils'), tmp_path / 'utils', ignore=shutil.ignore_patterns('__pycache__'))
+    return tmp_path
+
+
+def _edit(path, old: str, new: str):
+    source = path.read_text()
+    assert old in source
+    path.write_text(source.replace(old, new, 1))
+
+
+def test_the_code_version_ignores_the_scripts_settings_and_comments(tree):
+    before = code_version(str(tree))
+    _edit(tree / 'fish_schooling.py', 'RENDER_EVERY = 1 ', 'RENDER_EVERY = 3 ')
+    _edit(tree / 'fish_schooling.py', '# create ocean', '# create the ocean')
+    assert code_version(str(tree)) == before
+
+
+def test_changing_how_fish_are_spawned_changes_the_code_version(tree):
+    before = code_version(str(tree))
+    _edit(tree / 'fish_schooling.py', 'place_attempts=10)', 'place_attempts=3)')
+    assert code_version(str(tree)) != before
+
+
+def test_changing_the_model_changes_the_code_version(tree):
+    before = code_version(str(tree))
+    with open(tree / 'utils' / 'fishies.py', 'a') as f:
+        f.write('\n# a comment is enough, the model is hashed as written\n')
+    assert code_version(str(tree)) != before
+
+
+def test_scenario_keys():
+    settings = dict(seed=1, periods=10, bounds=((0, 0), (1, 0)))
+    assert scenario_key(settings) == scenario_key(dict(reversed(list(settings.items()))))
+    assert scenario_key(settings) != scenario_key(dict(settings, seed=2))
+    assert scenario_key(settings, include_code=False) != scenario_key(settings)
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0
+
+    def time(self) -> float:
+        self.now += 1
+        return self.now
+
+
+def _file(tmp_path, name: str, size: int) -> str:
+    path = tmp_path / name
+    path.write_bytes(b'x' * size)
+    return str(path)
+
+
+def test_entries_are_kept_and_found_again(tmp_path):
+    cache = RunCache(str(tmp_path / 'cache'))
+    (tmp_path / 'metrics').mkdir()
+    _file(tmp_path / 'metrics', 'ticks.bin', 8)
+    cache.put('run', 'video.mp4', _file(tmp_path, 'video.mp4', 10))
+    cache.put('run', 'metrics', str(tmp_path / 'metrics'))
+    assert cache.get('run', 'other.mp4') is None and cache.get('other run', 'video.mp4') is None
+    # a new RunCache reads the index back
+    reopened = RunCache(str(tmp_path / 'cache'))
+    assert open(reopened.get('run', 'video.mp4'), 'rb').read() == b'x' * 10
+    assert os.listdir(reopened.get('run', 'metrics')) == ['ticks.bin']
+    assert reopened.total_bytes == 18
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils.cache, 'time', _Clock())
+    cache = RunCache(str(tmp_path / 'cache'), max_bytes=25)
+    cache.put('a', 'video', _file(tmp_path, 'a', 10))
+    cache.put('b', 'video', _file(tmp_path, 'b', 10))
+    cache.get('a', 'video')
+    cache.put('c', 'video', _file(tmp_path, 'c', 10))
+    assert cache.get('b', 'video') is None
+    assert cache.get('a', 'video') is not None and cache.get('c', 'video') is not None
+    assert not os.path.exists(tmp_path / 'cache' / 'b')
+
+
+def test_entries_larger_than_the_cache_are_not_kept(tmp_path):
+    cache = RunCache(str(tmp_path / 'cache'), max_bytes=5)
+    assert cache.put('a', 'video', _file(tmp_path, 'a', 10)) is None
+    assert cache.get('a', 'video') is None and cache.total_bytes == 0
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from utils.fishies import Snapper
+from utils.interpolation import interpolate_snapshots, interpolated_frame_count, shortest_arc, tween
+from utils.pipeline import FishSnapshot, OceanSnapshot
+
+
+def _fish(unique_id: int, position: tuple, rotation: float) -> FishSnapshot:
+    return FishSnapshot(unique_id=unique_id, name=str(unique_id), previous_position=position, position=position,
+                        rotation=rotation, size=10, colour='#fcba76', species=Snapper.species, shoal_id=None)
+
+
+@pytest.mark.parametrize('start, end, fraction, expected', [
+    (0, 90, 0.5, 45),
+    (350, 10, 0.5, 360),  # through north, not back round the long way
+    (10, 350, 0.5, 0),
+    (-170, 170, 0.25, -175),
+    (30, 30, 0.7, 30),
+])
+def test_shortest_arc(start, end, fraction, expected):
+    assert np.isclose(shortest_arc(start, end, fraction), expected)
+
+
+def test_shortest_arc_of_arrays():
+    assert np.allclose(shortest_arc(np.array([0.0, 350.0]), np.array([180.0, 20.0]), 0.5), [-90, 365])
+
+
+def test_tween_moves_fish_part_of_the_way():
+    first = OceanSnapshot(tick=4, fish=(_fish(0, (0, 0), 0), _fish(1, (10, 10), 90)))
+    second = OceanSnapshot(tick=6, fish=(_fish(0, (8, 4), 90), _fish(2, (50, 50), 0)))
+    between = tween(first, second, 0.25, previous_fraction=0)
+    assert between.tick == 4.5
+    moved, died = between.fish
+    assert moved.position == (2, 1) and moved.previous_position == (0, 0) and moved.rotation == 22.5
+    # died in between, so stays put - the fish only in second appears with it
+    assert died.position == (10, 10)
+    assert [fsh.unique_id for fsh in between.fish] == [0, 1]
+
+
+def test_tween_goes_the_short_way_around_a_wrapping_world():
+    first = OceanSnapshot(tick=0, fish=(_fish(0, (95, 50), 0), ))
+    second = OceanSnapshot(tick=1, fish=(_fish(0, (5, 50), 0), ))
+    between = tween(first, second, 0.25, wrap=((0, 0), (100, 100)))
+    assert np.allclose(between.fish[0].position, (97.5, 50))
+    between = tween(first, second, 0.75, wrap=((0, 0), (100, 100)))
+    assert np.allclose(between.fish[0].position, (2.5, 50))
+
+
+def test_every_snapshot_is_kept_with_frames_between():
+    snapshots = [OceanSnapshot(tick=t, fish=(_fish(0, (t * 4, 0), 0), )) for t in range(3)]
+    frames = list(interpolate_snapshots(iter(snapshots), between=3))
+    assert len(frames) == interpolated_frame_count(3, 3) == 9
+    assert [x.tick for x in frames] == [0, 0.25, 0.5, 0.75, 1, 1.25, 1.5, 1.75, 2]
+    assert [x.fish[0].position[0] for x in frames] == [0, 1, 2, 3, 4, 5, 6, 7, 8]
+    # each in-between frame's previous position is the frame before's
+    assert [x.fish[0].previous_position[0] for x in frames[1:4]] == [0, 1, 2]
+
+
+def test_no_frames_between():
+    snapshots = [OceanSnapshot(tick=t, fish=()) for t in range(3)]
+    assert list(interpolate_snapshots(snapshots, between=0)) == snapshots
+    assert interpolated_frame_count(0, 5) == 0
@@ -0,0 +1,59 @@
+import math
+import random
+
+import numpy as np
+
+from utils.kernels import classify_neighbours, disc_offsets, nearest_valid_cell, ring_offsets
+
+
+def test_rings_hold_every_offset_once_nearest_first():
+    rings = ring_offsets(3)
+    distances = [distance for distance, _ in rings]
+    assert distances == sorted(distances) and distances[0] == 0
+    offsets = [offset for _, ring in rings for offset in ring]
+    assert len(offsets) == len(set(offsets)) == len(disc_offsets(3.0))
+    for distance, ring in rings:
+        assert all(math.isclose(math.hypot(*offset), distance) for offset in ring)
+
+
+def test_the_preferred_cell_wins_if_it_is_valid():
+    assert nearest_valid_cell((5, 5), lambda cell: True, max_distance=3) == ((5, 5), 1)
+
+
+def test_the_nearest_valid_cell_is_found():
+    valid = {(7, 5), (5, 8)}
+    cell, lookups = nearest_valid_cell((5, 5), valid.__contains__, max_distance=3, rng=random.Random(0))
+    assert cell == (7, 5)
+    # the centre, the rings at 1 and sqrt(2), then no more than the ring at 2
+    assert 10 <= lookups <= 13
+
+
+def test_ties_are_broken_by_rng():
+    valid = {(6, 5), (4, 5), (5, 6), (5, 4)}
+    found = {nearest_valid_cell((5, 5), valid.__contains__, max_distance=2, rng=random.Random(seed))[0]
+             for seed in range(20)}
+    assert found == valid
+
+
+def test_nothing_valid_in_reach():
+    cell, lookups = nearest_valid_cell((0, 0), lambda cell: False, max_distance=2)
+    assert cell is None and lookups == len(disc_offsets(2.0))
+
+
+def test_rings_nearer_than_min_distance_are_skipped():
+    cell, _ = nearest_valid_cell((0, 0), lambda cell: True, max_distance=3, min_distance=2, rng=random.Random(0))
+    assert math.hypot(*cell) == 2
+
+
+def test_neighbours_are_classified_as_nearby_waters_would():
+    # fish 0 is focal: fish 1 is too close, 2 and 3 are the same species further out, 4 is another species
+    distances = np.array([2.0, 6.0, 20.0, 6.0])
+    others = np.array([1, 2, 3, 4])
+    size = np.ones(5)
+    repel, align, follow = (np.full(5, x) for x in (3.0, 8.0, 30.0))
+    species = np.array([0, 0, 0, 0, 1])
+    repel_fish, align_fish, follow_fish = classify_neighbours(0, others, distances, size, repel, align, follow,
+                                                              species)
+    assert repel_fish.tolist() == [1]
+    assert align_fish.tolist() == [2]
+    assert follow_fish.tolist() == [3]
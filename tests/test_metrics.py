@@ -0,0 +1,55 @@
+import numpy as np
+
+from utils.metrics import ColumnarWriter, ShoalMetrics, load_columns, polarisation
+
+SCHEMA = {'tick': 'int64', 'value': 'float64', 'flag': 'bool'}
+
+
+def test_columns_round_trip_across_batches(tmp_path):
+    writer = ColumnarWriter(str(tmp_path), SCHEMA, batch_size=3)
+    writer.append(tick=0, value=0.5, flag=True)
+    writer.append(tick=[1, 1], value=[1.5, 2.5], flag=[False, True])
+    writer.append(tick=2, value=np.nan, flag=False)
+    writer.close()
+    columns = load_columns(str(tmp_path))
+    assert columns['tick'].tolist() == [0, 1, 1, 2]
+    assert columns['value'][:3].tolist() == [0.5, 1.5, 2.5] and np.isnan(columns['value'][3])
+    assert columns['flag'].tolist() == [True, False, True, False]
+    assert {x: str(y.dtype) for x, y in columns.items()} == SCHEMA
+
+
+def test_one_column_can_be_read_alone(tmp_path):
+    writer = ColumnarWriter(str(tmp_path), SCHEMA)
+    writer.append(tick=[3, 4], value=[0.0, 1.0], flag=[True, True])
+    writer.close()
+    assert list(load_columns(str(tmp_path), columns=['tick'])) == ['tick']
+
+
+def test_existing_columns_are_appended_to(tmp_path):
+    for tick in range(2):
+        writer = ColumnarWriter(str(tmp_path), SCHEMA)
+        writer.append(tick=tick, value=0.0, flag=False)
+        writer.close()
+    assert load_columns(str(tmp_path))['tick'].tolist() == [0, 1]
+
+
+def test_polarisation():
+    assert np.isclose(polarisation(np.array([10.0, 10.0, 10.0])), 1)
+    assert np.isclose(polarisation(np.array([0.0, 90.0, 180.0, 270.0])), 0)
+    assert np.isnan(polarisation(np.array([])))
+
+
+def test_shoal_metrics_per_tick_and_per_shoal(tmp_path):
+    metrics = ShoalMetrics(str(tmp_path))
+    positions = np.array([[0, 0], [1, 0], [10, 10], [11, 10], [50, 50]], dtype=float)
+    metrics.record_arrays(7, positions=positions, rotations=np.zeros(5), shoal_ids=np.array([0, 0, 1, 1, -1]),
+                          stuck=np.array([False, False, False, False, True]))
+    metrics.close()
+    ticks = load_columns(str(tmp_path / 'ticks'))
+    assert ticks['tick'].tolist() == [7]
+    assert ticks['shoal_count'].tolist() == [2]
+    assert ticks['fish_in_shoals'].tolist() == [4]
+    assert np.isclose(ticks['stuck_fraction'][0], 0.2)
+    shoals = load_columns(str(tmp_path / 'shoals'))
+    assert shoals['centroid_x'].tolist() == [0.5, 10.5]
+    assert shoals['size'].tolist() == [2, 2]
@@ -0,0 +1,53 @@
+from utils.neighbours import NeighbourTable
+from utils.positioning import NearbyWaters
+from utils.spatial_utils import SpatialUtils
+
+from tests.oceans import make_ocean
+
+CROWDED = ((0, 0), (120, 0), (120, 120), (0, 120), (0, 0))
+
+
+def _ids(fish_list: list) -> list:
+    return sorted(fsh.unique_id for fsh in fish_list)
+
+
+def _assert_same_as_nearby_waters(table, ocean):
+    for fsh in ocean.population:
+        sub_env = NearbyWaters(fish=fsh, ocean=ocean)
+        repel_fish, align_fish, follow_fish, predator_count = table.classify(fsh)
+        assert _ids(repel_fish) == _ids(sub_env.repel_fish)
+        assert _ids(align_fish) == _ids(sub_env.align_fish)
+        assert _ids(follow_fish) == _ids(sub_env.follow_fish)
+        assert predator_count == sub_env.predator_count
+
+
+def test_classify_agrees_with_nearby_waters():
+    ocean = make_ocean(seed=2, snappers=50, sharks=5, bounds=CROWDED)
+    table = NeighbourTable(ocean.population)
+    assert any(table.classify(fsh)[3] for fsh in ocean.population)
+    _assert_same_as_nearby_waters(table, ocean)
+
+
+def test_classify_agrees_after_fish_move_and_die():
+    ocean = make_ocean(seed=4, snappers=40, sharks=4, bounds=CROWDED)
+    table = NeighbourTable(ocean.population)
+    fish = list(ocean.population)
+    for fsh in fish[:10]:
+        fsh.previous_position = fsh.position
+        fsh.position = (fsh.position[0] + 3, fsh.position[1] - 2)
+        table.move(fsh)
+    table.remove(fish[-1])
+    ocean.population.remove(fish[-1])
+    _assert_same_as_nearby_waters(table, ocean)
+
+
+def test_relation_is_measured_as_spatial_utils_does():
+    ocean = make_ocean(seed=0, snappers=20, sharks=0, bounds=CROWDED)
+    table = NeighbourTable(ocean.population)
+    fish = list(ocean.population)
+    for fsh in fish:
+        for other in fish:
+            relation = table.relation(fsh, other)
+            if relation is not None:
+                assert relation[0] == SpatialUtils.calc_distance(fsh.position, other.position)
+                assert relation[1] == SpatialUtils.calc_angle(fsh.position, other.position)
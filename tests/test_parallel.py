@@ -0,0 +1,48 @@
+from utils.parallel import OccupancyGrid, ParallelDecisionPool
+from utils.positioning import NearbyWaters
+
+from tests.oceans import make_ocean
+
+
+def test_occupancy_grid_moves_and_removes_fish():
+    grid = OccupancyGrid([(0, 0), (10, 0)], cell_size=5)
+    assert not grid.is_clear((1, 0), clearance=5, ignore=1)
+    assert grid.is_clear((1, 0), clearance=5, ignore=0)
+    grid.move(0, (50, 50))
+    assert grid.is_clear((1, 0), clearance=5, ignore=1)
+    assert not grid.is_clear((52, 50), clearance=5, ignore=1)
+    grid.remove(0)
+    assert grid.is_clear((52, 50), clearance=5, ignore=1)
+
+
+def test_fish_see_the_predators_the_sequential_model_sees():
+    # crowded, so that sharks are within reach of snappers
+    ocean = make_ocean(seed=3, snappers=60, sharks=6, bounds=((0, 0), (120, 0), (120, 120), (0, 120), (0, 0)))
+    expected = {fsh.unique_id: NearbyWaters(fish=fsh, ocean=ocean).count_predators() for fsh in ocean.population}
+    assert any(expected.values())
+    with ParallelDecisionPool(ocean, workers=2) as pool:
+        pool.step()
+    for fsh in ocean.population:
+        assert fsh.memory[-1]['predators_seen'] == expected[fsh.unique_id]
+        assert fsh.incentive_to_move == expected[fsh.unique_id]
+        # no NearbyWaters is built in parallel, an old one would be out of date
+        assert fsh.sub_env is None
+
+
+def test_species_codes_are_known_before_the_pool_starts():
+    ocean = make_ocean(seed=0, snappers=5, sharks=1)
+    pool = ParallelDecisionPool(ocean, workers=1)
+    assert sorted(x.__name__ for x in pool.species_codes) == ['Shark', 'Snapper']
+    shark, snapper = (pool.species_codes[x] for x in sorted(pool.species_codes, key=lambda x: x.__name__))
+    assert pool.eats[shark, snapper] and not pool.eats[snapper, shark]
+
+
+def test_runs_are_reproducible_for_a_seed():
+    positions = []
+    for _ in range(2):
+        ocean = make_ocean(seed=1, snappers=20)
+        with ParallelDecisionPool(ocean, workers=2) as pool:
+            for _ in range(3):
+                pool.step()
+        positions.append([list(fsh.position) for fsh in ocean.population])
+    assert positions[0] == positions[1]
@@ -0,0 +1,53 @@
+from utils.pipeline import RenderSchedule
+
+
+def test_every_render_every_th_period_is_a_frame():
+    schedule = RenderSchedule(10, render_every=3)
+    assert schedule.frames == 4
+    assert list(schedule.frame_ticks()) == [2, 5, 8, 9]
+    assert schedule.ticks == [2, 5, 8, 9]
+
+
+def test_budget_sets_the_starting_render_every():
+    schedule = RenderSchedule(100, render_budget=10, seconds_per_frame=0.5)
+    # 20 frames fit in the budget
+    assert schedule.render_every == 5
+    assert schedule.frames == 20
+
+
+def test_slow_frames_widen_render_every_for_the_periods_left():
+    schedule = RenderSchedule(100, render_budget=10, seconds_per_frame=0.5)
+    schedule.next_frame()
+    # the first frame took a quarter of the budget, three more fit in the 95 periods left
+    schedule.drawn(2.5)
+    assert schedule.render_every == 32
+    assert list(schedule.frame_ticks()) == [36, 68, 99]
+    assert schedule.ticks == [4, 36, 68, 99]
+
+
+def test_fast_frames_never_narrow_render_every():
+    schedule = RenderSchedule(100, render_budget=10, seconds_per_frame=0.5)
+    schedule.next_frame()
+    schedule.drawn(0.01)
+    assert schedule.render_every == 5
+
+
+def test_timed_records_each_snapshot_drawn():
+    schedule = RenderSchedule(4)
+    assert list(schedule.timed(iter('abc'))) == ['a', 'b', 'c']
+    assert schedule.frames_drawn == 3
+
+
+def test_write_frames_records_the_frames_actually_drawn(tmp_path):
+    schedule = RenderSchedule(100, render_budget=10, seconds_per_frame=0.5)
+    schedule.next_frame()
+    schedule.drawn(5)
+    list(schedule.frame_ticks())
+    path = tmp_path / 'movements_frames.txt'
+    schedule.write_frames(str(path), interpolated_frames=2)
+    header, *ticks = path.read_text().splitlines()
+    assert f'render_every={schedule.render_every}' in header
+    assert f'frames={len(ticks)}' in header
+    assert f'video_frames={len(ticks) + (len(ticks) - 1) * 2}' in header
+    assert ticks[0] == '4' and ticks[-1] == '99'
+    assert 'render_every>=5' in RenderSchedule(100, render_budget=10, seconds_per_frame=0.5).describe()
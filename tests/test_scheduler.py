@@ -0,0 +1,45 @@
+from utils.differential import LazyPerceptionEngine, compare_lockstep
+from utils.scheduler import PerceptionScheduler
+
+from tests.oceans import make_ocean
+
+
+def test_fish_swim_highest_incentive_first():
+    ocean = make_ocean(seed=0, snappers=6, sharks=0)
+    for incentive, fsh in enumerate(ocean.population):
+        fsh.incentive_to_move = incentive % 3
+    scheduler = PerceptionScheduler(ocean)
+    incentives = [fsh.incentive_to_move for fsh in scheduler.order()]
+    assert incentives == sorted(incentives, reverse=True)
+    assert set(scheduler.buckets) == {0, 1, 2}
+
+
+def test_eaten_fish_are_forgotten():
+    ocean = make_ocean(seed=0, snappers=6, sharks=0)
+    scheduler = PerceptionScheduler(ocean)
+    eaten = next(iter(ocean.population))
+    ocean.population.remove(eaten)
+    assert not eaten.alive
+    assert eaten not in scheduler.order()
+    assert eaten.unique_id not in scheduler.incentive
+
+
+def test_a_lone_fish_reuses_its_perception_until_others_could_reach_it():
+    ocean = make_ocean(seed=0, snappers=2, sharks=0)
+    lone, other = list(ocean.population)
+    lone.position, lone.previous_position = (50, 50), (50, 50)
+    other.position, other.previous_position = (250, 250), (250, 250)
+    scheduler = PerceptionScheduler(ocean)
+    scheduler.perceive(lone)
+    scheduler.perceive(lone)
+    assert (scheduler.rebuilt, scheduler.reused) == (1, 1)
+
+    # the other fish swims most of the way over, so could now be in view
+    other.previous_position, other.position = other.position, (60, 60)
+    scheduler.moved(other)
+    scheduler.perceive(lone)
+    assert scheduler.rebuilt == 2
+
+
+def test_lazy_perception_makes_the_same_decisions_as_rebuilding_every_tick():
+    assert compare_lockstep(lambda seed: make_ocean(seed=seed), LazyPerceptionEngine(), ticks=5) is None
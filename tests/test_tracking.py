@@ -0,0 +1,45 @@
+from utils.metrics import load_columns
+from utils.tracking import BIRTH, DEATH, MERGE, SPLIT, ShoalTracker, shoal_lifetimes
+
+
+def _events(tracker: ShoalTracker) -> list:
+    return list(zip(tracker.events['tick'], tracker.events['event'], tracker.events['shoal_id'],
+                    tracker.events['other_id']))
+
+
+def test_shoals_keep_their_id_whatever_dbscan_calls_them():
+    tracker = ShoalTracker()
+    first = tracker.update([1, 2, 3, 4, 5, 6], [1, 1, 1, 2, 2, 2])
+    # DBSCAN numbers the same two shoals the other way round
+    second = tracker.update([1, 2, 3, 4, 5, 6], [2, 2, 2, 1, 1, -1])
+    assert first == [1, 1, 1, 2, 2, 2]
+    assert second == [1, 1, 1, 2, 2, -1]
+    assert _events(tracker) == [(0, BIRTH, 1, -1), (0, BIRTH, 2, -1)]
+
+
+def test_splits_and_merges_are_logged():
+    tracker = ShoalTracker()
+    tracker.update([1, 2, 3, 4, 5, 6], [1, 1, 1, 1, 1, 1])
+    # fish 5 and 6 split off, the larger part keeps the id
+    assert tracker.update([1, 2, 3, 4, 5, 6], [1, 1, 1, 1, 2, 2]) == [1, 1, 1, 1, 2, 2]
+    # and join up again
+    assert tracker.update([1, 2, 3, 4, 5, 6], [1, 1, 1, 1, 1, 1]) == [1] * 6
+    assert _events(tracker)[1:] == [(1, SPLIT, 2, 1), (2, MERGE, 2, 1)]
+
+
+def test_deaths_are_logged():
+    tracker = ShoalTracker()
+    tracker.update([1, 2, 3], [1, 1, 1])
+    tracker.update([1, 2, 3], [-1, -1, -1])
+    assert _events(tracker)[-1] == (1, DEATH, 1, -1)
+
+
+def test_lifetimes_from_the_written_log(tmp_path):
+    tracker = ShoalTracker()
+    tracker.update([1, 2, 3, 4, 5, 6], [1, 1, 1, 1, 1, 1])
+    tracker.update([1, 2, 3, 4, 5, 6], [1, 1, 1, 1, 2, 2])
+    tracker.update([1, 2, 3, 4, 5, 6], [1, 1, 1, 1, 1, 1])
+    tracker.write(str(tmp_path))
+    lifetimes = shoal_lifetimes(load_columns(str(tmp_path)))
+    assert lifetimes[1].origin == 'birth' and lifetimes[1].ended is None
+    assert lifetimes[2]._replace(shoal_id=None) == (None, 1, 'split', 1, 2, 'merge', 1)
@@ -0,0 +1,150 @@
+import logging
+import math
+import random
+from collections import namedtuple
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from utils.spatial_utils import SpatialUtils
+
+logger = logging.getLogger(__name__)
+
+# a shoal moved as one body in a tick
+AggregateShoal = namedtuple('AggregateShoal', ['shoal_id', 'members', 'centroid', 'heading', 'spread', 'displacement'])
+
+
+class ShoalAggregator:
+    def __init__(self, ocean, predator_radius: float, min_members: int=5, heading_jitter: float=0):
+        """
+        level of detail for quiet shoals: a shoal (as last clustered by OceanEnvironment.update_shoals) with no
+            predator within predator_radius and no other fish close enough for its members to swim away from is
+            moved as one rigid body along the mean heading of its members, at their mean speed, instead of every
+            member swimming. The move is cut short if the full move would put any member on another fish, with fish
+            kept as far apart as in Fish.swim (see NearbyWaters.find_empty_coordinates)
+        a shoal goes back to per fish swimming as soon as it stops being quiet, if moving it would put any member on
+            or over the coastline, or if it cannot move at all without landing on another fish. Quietness is checked
+            every tick, so predator_radius should be more than a predator can close in one tick
+        :param ocean: the OceanEnvironment whose shoals are aggregated
+        :param predator_radius: a shoal with any predator this close to any member swims fish by fish
+        :param min_members: smaller shoals always swim fish by fish
+        :param heading_jitter: degrees - the shoal's heading is turned by up to this much at random each tick
+        """
+        self.ocean = ocean
+        self.predator_radius = predator_radius
+        self.min_members = min_members
+        self.heading_jitter = heading_jitter
+        self.last = []  # shoals aggregated in the last tick
+
+    def _quiet_shoals(self) -> dict:
+        """shoal id -> members, for the shoals that can be moved as a body this tick"""
+        population = list(self.ocean.population)
+        shoals = {}
+        for i, fsh in enumerate(population):
+            if fsh.shoal_id is not None:
+                shoals.setdefault(fsh.shoal_id, []).append(i)
+        shoals = {k: v for k, v in shoals.items() if len(v) >= self.min_members}
+        if not shoals:
+            return {}
+
+        positions = np.array([fsh.position for fsh in population], dtype=float)
+        labels = np.array([-1 if fsh.shoal_id is None else fsh.shoal_id for fsh in population])
+        tree = cKDTree(positions)
+        predator_trees = {}  # species -> tree of the fish that eat it (None if there are none)
+        quiet = {}
+        for shoal_id, members in shoals.items():
+            members = np.array(members)
+            # no fish outside the shoal within any member's repel distance - a rigid move could run into it
+            reach = max(population[i].repel_distance + population[i].size for i in members)
+            too_close = tree.query_ball_point(positions[members], r=reach)
+            if len(too_close) and (labels[np.concatenate(too_close).astype(int)] != shoal_id).any():
+                continue
+
+            disturbed = False
+            for species in {type(population[i]) for i in members}:
+                if species not in predator_trees:
+                    predators = [fsh.position for fsh in population if species in fsh.eats_fish]
+                    predator_trees[species] = cKDTree(predators) if predators else None
+                if predator_trees[species] is not None:
+                    distances, _ = predator_trees[species].query(positions[members],
+                                                                 distance_upper_bound=self.predator_radius)
+                    disturbed = disturbed or bool(np.isfinite(distances).any())
+            if not disturbed:
+                quiet[shoal_id] = [population[i] for i in members]
+        return quiet
+
+    def _heading_and_speed(self, members: list) -> tuple:
+        radians = [math.radians(fsh.rotation) for fsh in members]
+        heading = math.degrees(math.atan2(sum(math.sin(x) for x in radians), sum(math.cos(x) for x in radians)))
+        if self.heading_jitter:
+            heading += random.uniform(-self.heading_jitter, self.heading_jitter)
+        speed = np.mean([fsh.memory[-1]['move_distance'] if fsh.memory else 0 for fsh in members])
+        speed = min(speed, min(fsh.max_movement_radius for fsh in members))
+        return heading, float(speed)
+
+    def _clear_move(self, members: list, positions: np.ndarray, dx: float, dy: float) -> tuple:
+        """
+        the longest part of the move (dx, dy), in unit steps back from all of it, that keeps every member clear of
+            the fish outside the shoal
+        :return: (dx, dy), (0, 0) if no part of the move is clear
+        """
+        member_ids = {fsh.unique_id for fsh in members}
+        others = [fsh.position for fsh in self.ocean.population if fsh.unique_id not in member_ids]
+        if not others:
+            return dx, dy
+        tree = cKDTree(np.array(others, dtype=float))
+        space_necessary = np.array([fsh.size / 2 for fsh in members])
+        steps = math.ceil(math.hypot(dx, dy))
+        for step in range(steps, 0, -1):
+            step_dx, step_dy = dx * step / steps, dy * step / steps
+            if not self.ocean.continuous_movement:
+                step_dx, step_dy = int(round(step_dx)), int(round(step_dy))
+            gaps, _ = tree.query(positions + [step_dx, step_dy])
+            if (np.round(gaps, 4) >= space_necessary).all():
+                return step_dx, step_dy
+        return 0, 0
+
+    def advance(self) -> set:
+        """
+        move every quiet shoal one tick
+        :return: unique ids of the fish moved, these should not also swim this tick
+        """
+        self.last = []
+        moved = set()
+        for shoal_id, members in self._quiet_shoals().items():
+            heading, speed = self._heading_and_speed(members)
+            dx = math.cos(math.radians(heading)) * speed
+            dy = math.sin(math.radians(heading)) * speed
+            if not self.ocean.continuous_movement:
+                dx, dy = int(round(dx)), int(round(dy))
+            positions = np.array([fsh.position for fsh in members], dtype=float)
+            if dx or dy:
+                dx, dy = self._clear_move(members, positions, dx, dy)
+                # every part of the move lands on another fish - let the fish find their own way around it
+                if not (dx or dy):
+                    continue
+            new_positions = positions + [dx, dy]
+            # shoal has reached the coast - let the fish find their own way along it
+            if not SpatialUtils.poly_contains_points(new_positions, self.ocean.boundary).all():
+                continue
+
+            centroid = positions.mean(axis=0)
+            spread = float(np.sqrt(np.mean(np.sum((positions - centroid) ** 2, axis=1))))
+            for fsh in members:
+                fsh.previous_position = fsh.position
+                fsh.position = [fsh.position[0] + dx, fsh.position[1] + dy]
+                if dx or dy:
+                    fsh.age += 1
+                fsh.create_memory(move_description='shoal', new_rotation=heading,
+                                  move_distance=SpatialUtils.calc_distance(fsh.position, fsh.previous_position),
+                                  repel_fish=[], align_fish=[], follow_fish=[], predators_seen=0)
+                fsh.rotation = fsh._update_rotation(heading)
+                if self.ocean.neighbour_table is not None:
+                    self.ocean.neighbour_table.move(fsh)
+                moved.add(fsh.unique_id)
+            self.last.append(AggregateShoal(shoal_id=shoal_id, members=tuple(x.unique_id for x in members),
+                                            centroid=(float(centroid[0]), float(centroid[1])), heading=heading,
+                                            spread=spread, displacement=(dx, dy)))
+        if self.last:
+            logger.debug(f'{len(self.last)} quiet shoals ({len(moved)} fish) moved as aggregates')
+        return moved
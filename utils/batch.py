@@ -0,0 +1,423 @@
+import functools
+import logging
+
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from utils import kernels
+from utils.environ import OceanEnvironment
+from utils.metrics import ColumnarWriter
+from utils.pipeline import FishSnapshot, OceanSnapshot
+from utils.spatial_utils import SpatialUtils
+
+logger = logging.getLogger(__name__)
+
+"""
+many small, independent oceans sharing a coastline, stepped together. Population state is held as arrays with a
+    leading world dimension, (worlds, fish) or (worlds, fish, fish) for pairs, so that a tick of thousands of
+    replicate oceans is a handful of array operations rather than thousands of python loops over ~30 fish
+"""
+
+MOVE_BLOCKED = len(kernels.MOVE_DESCRIPTIONS)
+MOVE_DESCRIPTIONS = kernels.MOVE_DESCRIPTIONS + ('moves available but stuck', )
+
+# one row per world per tick
+WORLD_SCHEMA = {
+    'tick': 'int64',
+    'world': 'int64',
+    'fish_count': 'int64',
+    'shoal_count': 'int64',
+    'fish_in_shoals': 'int64',
+    'largest_shoal': 'int64',
+    'polarisation': 'float64',
+    'stuck_fraction': 'float64',
+}
+
+_CELL_DRAWS = 8  # random cells tried for a random move before listing every empty cell within range
+_WINDOW = 32  # cells checked at once for each fish that cannot take its preferred move
+
+
+@functools.lru_cache(maxsize=None)
+def _flat_rings(max_distance: int) -> tuple:
+    """
+    kernels.ring_offsets as flat arrays
+    :return: offsets (k, 2) nearest ring first, distance of each offset, first index and length of its ring
+    """
+    rings = kernels.ring_offsets(max_distance)
+    offsets = np.concatenate([np.array(ring) for _, ring in rings])
+    distances = np.concatenate([np.full(len(ring), distance) for distance, ring in rings])
+    lengths = np.array([len(ring) for _, ring in rings])
+    starts = np.cumsum(lengths) - lengths
+    return offsets, distances, np.repeat(starts, lengths), np.repeat(lengths, lengths)
+
+
+class OceanBatch:
+    def __init__(self, bounding_coordinates: tuple, predation: bool=False, max_move_attempts: int=30,
+                 shoal_distance: float=30):
+        """
+        independent oceans with the same coastline, each with its own fish, species parameters and random seed,
+            stepped together. Moves follow utils.parallel.ParallelDecisionPool: every fish decides from the same
+            snapshot of its ocean, then fish are placed one after another in order of the predators they can see,
+            each taking the nearest free coordinate to its preferred move
+        each world draws its random numbers from its own generator, so a world's run depends only on its seed and
+            fish, not on the other worlds in the batch
+        memory is O(worlds x fish x fish), meant for many oceans of tens of fish rather than large ones
+        :param bounding_coordinates: should be tuple of tuples (x, y) listed in counterclockwise direction
+            ending with the first coordinate to close path
+        :param predation: if True predators eat the prey in their repel zone once they have been placed
+        :param max_move_attempts: as in Fish.swim, how far from the preferred move to look for a free coordinate
+        :param shoal_distance: eps used to cluster shoals, as in OceanEnvironment.update_shoals
+        """
+        self.boundary = bounding_coordinates
+        self.sea_colour = '#006994'
+        self.predation = predation
+        self.max_move_attempts = max_move_attempts
+        self.shoal_distance = shoal_distance
+        self.worlds = []  # (species of each fish, placed positions, rotations, minimum shoal size)
+        self.generators = []
+        self.species = []  # SpeciesProfile for each species code
+        self.tick = 0
+        self.position = None
+
+    def __len__(self) -> int:
+        return len(self.worlds)
+
+    # the batch is drawn like an ocean, one world at a time (see snapshot)
+    _get_axes_limits = OceanEnvironment._get_axes_limits
+
+    def add_world(self, species_counts: list, seed: int, minimum_shoal_size: int=3, place_attempts: int=10) -> int:
+        """
+        add an ocean to the batch, placing its fish as Fish.make_it_rain does
+        :param species_counts: (SpeciesProfile, number of fish) pairs - worlds with different parameters use
+            different profiles
+        :param seed: seed of this world's random numbers
+        :param minimum_shoal_size: minimum number of fish required to be considered a shoal
+        :param place_attempts: random positions tried for each fish, fish that do not land in the sea are not added
+        :return: index of the world
+        """
+        if self.position is not None:
+            raise ValueError('worlds cannot be added once the batch has started')
+        generator = np.random.default_rng(seed)
+        bbox = SpatialUtils.extract_bounding_box(self.boundary)
+        species, positions = [], []
+        for profile, count in species_counts:
+            if profile not in self.species:
+                self.species.append(profile)
+            for _ in range(count):
+                proposed = generator.integers([bbox[0], bbox[1]], [bbox[2], bbox[3]], endpoint=True, size=(
+                    place_attempts, 2))
+                inside = SpatialUtils.poly_contains_points(proposed, self.boundary)
+                if inside.any():
+                    species.append(self.species.index(profile))
+                    positions.append(proposed[np.argmax(inside)])
+        rotations = generator.choice(np.arange(0, 360, 45), size=len(positions)).astype(float)
+        self.worlds.append((species, positions, rotations, minimum_shoal_size))
+        self.generators.append(generator)
+        return len(self.worlds) - 1
+
+    def _start(self):
+        """pack the worlds into arrays, padded to the largest world"""
+        worlds = len(self.worlds)
+        capacity = max((len(x[0]) for x in self.worlds), default=0)
+        self.alive = np.zeros((worlds, capacity), dtype=bool)
+        self.position = np.zeros((worlds, capacity, 2))
+        self.rotation = np.zeros((worlds, capacity))
+        self.species_code = np.zeros((worlds, capacity), dtype=int)
+        for w, (species, positions, rotations, _) in enumerate(self.worlds):
+            self.alive[w, :len(species)] = True
+            self.position[w, :len(species)] = np.reshape(positions, (-1, 2))
+            self.rotation[w, :len(species)] = rotations
+            self.species_code[w, :len(species)] = species
+        self.previous_position = self.position.copy()
+        self.age = np.zeros((worlds, capacity), dtype=int)
+        self.move = np.full((worlds, capacity), kernels.MOVE_RANDOM, dtype=np.int8)
+        self.shoal_id = np.full((worlds, capacity), -1)
+        self.min_points = np.array([x[3] for x in self.worlds])
+
+        profiles = self.species
+        for field, values in (('size', [x.size for x in profiles]), ('repel', [x.repel_distance for x in profiles]),
+                              ('align', [x.align_distance for x in profiles]),
+                              ('follow', [x.follow_distance for x in profiles]),
+                              ('radius', [x.max_movement_radius for x in profiles])):
+            setattr(self, field, np.array(values, dtype=float)[self.species_code])
+        # eats[a, b] is True if species a eats species b. eats_fish lists fish classes, whose profiles are matched by
+        # name so that a world's own profile of a species is eaten like the class default
+        self.eats = np.array([[prey.name in {x.species.name for x in predator.eats_fish} for prey in profiles]
+                              for predator in profiles], dtype=bool).reshape(len(profiles), len(profiles))
+        logger.info(f'{worlds} worlds of up to {capacity} fish, {int(self.alive.sum())} fish in all')
+
+    def _pairs(self) -> tuple:
+        """delta [w, i, j] from fish i to fish j of the same world, distance rounded as SpatialUtils.calc_distance,
+            and which pairs are two different living fish"""
+        delta = self.position[:, None, :, :] - self.position[:, :, None, :]
+        distance = np.round(np.hypot(delta[..., 0], delta[..., 1]), 4)
+        capacity = self.alive.shape[1]
+        pair = self.alive[:, :, None] & self.alive[:, None, :] & ~np.eye(capacity, dtype=bool)[None]
+        return delta, distance, pair
+
+    def time_step(self):
+        """move every fish of every world once"""
+        if self.position is None:
+            self._start()
+        worlds, capacity = self.alive.shape
+        delta, distance, pair = self._pairs()
+
+        # neighbour classes, as kernels.classify_neighbours, for every fish of every world at once
+        size = self.size[:, :, None]
+        in_sight = pair & (distance <= self.follow[:, :, None] + size)
+        adjusted = distance - size
+        same_species = self.species_code[:, :, None] == self.species_code[:, None, :]
+        repel = in_sight & (adjusted <= self.repel[:, :, None])
+        align = in_sight & ~repel & same_species & (adjusted <= self.align[:, :, None])
+        follow = in_sight & ~repel & ~align & same_species & (adjusted <= self.follow[:, :, None])
+        # predators in sight, fish that see more of them are placed first
+        hunted = in_sight & self.eats[self.species_code[:, None, :], self.species_code[:, :, None]]
+
+        # each world's random numbers for the tick: a move distance choice, a tie break and random cells
+        draws = np.stack([x.random((capacity, 2 + _CELL_DRAWS)) for x in self.generators]).reshape(
+            worlds, capacity, 2 + _CELL_DRAWS)
+        preferred, move = self._decide(delta, distance, repel, align, follow, draws)
+        self._place_all(preferred, move, repel, hunted.sum(axis=2), draws[:, :, 1])
+        self.tick += 1
+
+    def _decide(self, delta, distance, repel, align, follow, draws) -> tuple:
+        """preferred move of every fish, as kernels.decide_move (repel, then align, then follow, otherwise random)"""
+        angle = np.degrees(np.arctan2(delta[..., 1], delta[..., 0]))
+
+        def mean_over(values, mask):
+            count = mask.sum(axis=2)
+            return np.where(mask, values, 0).sum(axis=2) / np.maximum(count, 1), count > 0
+
+        def move_distance(mask, pad):
+            # random choice from 4 unit intervals between the repel and align distance from the nearest fish
+            closest = np.where(mask, distance, np.inf).min(axis=2)
+            options = np.ceil((self.align - self.repel + pad) / 4)
+            return closest - self.align + 4 * np.floor(draws[:, :, 0] * options)
+
+        repel_angle, repels = mean_over(angle, repel)
+        align_rotation, aligns = mean_over(np.broadcast_to(self.rotation[:, None, :], angle.shape), align)
+        follow_angle, follows = mean_over(angle, follow)
+        heading = np.where(repels, repel_angle - 180, np.where(aligns, align_rotation, follow_angle))
+        length = np.where(repels, self.radius, np.where(aligns, move_distance(align, 1),
+                                                        np.where(follows, move_distance(follow, 0.0001), 0)))
+        move = np.select([repels, aligns, follows], [kernels.MOVE_REPEL, kernels.MOVE_ALIGN, kernels.MOVE_FOLLOW],
+                         default=kernels.MOVE_RANDOM).astype(np.int8)
+        radians = np.radians(heading)
+        preferred = self.position + np.stack([np.cos(radians), np.sin(radians)], axis=-1) * length[..., None]
+
+        wanders = np.argwhere(self.alive & (move == kernels.MOVE_RANDOM))
+        cells, stuck = self._random_cells(wanders, draws)
+        preferred[wanders[:, 0], wanders[:, 1]] = cells
+        move[wanders[stuck, 0], wanders[stuck, 1]] = kernels.MOVE_STUCK
+        # rounded towards zero, as kernels.decide_move
+        return np.trunc(preferred), move
+
+    def _random_cells(self, wanders: np.ndarray, draws: np.ndarray) -> tuple:
+        """
+        a random lattice point in the sea within range of each wandering fish: a few random points are drawn first,
+            fish whose draws all landed on land choose from every point in range instead
+        :param wanders: (world, fish) rows
+        :return: cells, and True for the fish with no point in range at all
+        """
+        cells = np.zeros((len(wanders), 2))
+        found = np.zeros(len(wanders), dtype=bool)
+        here = self.position[wanders[:, 0], wanders[:, 1]]
+        radius = self.radius[wanders[:, 0], wanders[:, 1]]
+        for r in np.unique(radius):
+            offsets = kernels.disc_offsets(float(r))
+            rows = np.flatnonzero(radius == r)
+            picks = np.floor(draws[wanders[rows, 0], wanders[rows, 1], 2:] * len(offsets)).astype(int)
+            candidates = here[rows, None, :] + offsets[picks]
+            inside = SpatialUtils.poly_contains_points(candidates.reshape(-1, 2), self.boundary).reshape(picks.shape)
+            hit = inside.any(axis=1)
+            cells[rows[hit]] = candidates[hit, np.argmax(inside[hit], axis=1)]
+            found[rows[hit]] = True
+
+        for k in np.flatnonzero(~found):
+            in_range = kernels.disc_offsets(float(radius[k])) + here[k]
+            in_sea = in_range[SpatialUtils.poly_contains_points(in_range, self.boundary)]
+            if len(in_sea):
+                w, f = wanders[k]
+                cells[k] = in_sea[int(draws[w, f, 0] * len(in_sea))]
+                found[k] = True
+        return cells, ~found
+
+    def _place_all(self, preferred: np.ndarray, move: np.ndarray, repel: np.ndarray, predators: np.ndarray,
+                   tie_breaks: np.ndarray):
+        """place the fish of every world one at a time, the k-th fish to be placed in every world together"""
+        worlds, capacity = self.alive.shape
+        self.previous_position = self.position.copy()
+        order = np.argsort(-predators, axis=1, kind='stable')
+        every_world = np.arange(worlds)
+        for k in range(capacity):
+            fish = order[:, k]
+            swimming = self.alive[every_world, fish]
+            moving = swimming & (move[every_world, fish] != kernels.MOVE_STUCK)
+            w, f = every_world[moving], fish[moving]
+            cells, placed = self._nearest_free_cells(w, f, preferred[w, f], tie_breaks[w, f])
+
+            move[w[~placed], f[~placed]] = MOVE_BLOCKED
+            w, f, cells = w[placed], f[placed], cells[placed]
+            step = cells - self.position[w, f]
+            # a fish that stays where it is keeps facing the same way, as in Fish.swim
+            self.rotation[w, f] = np.where(np.any(step != 0, axis=1), np.degrees(np.arctan2(step[:, 1], step[:, 0])),
+                                           self.rotation[w, f])
+            self.position[w, f] = cells
+            self.age[w, f] += 1
+
+            if self.predation:
+                w, f = every_world[swimming], fish[swimming]
+                eaten = repel[w, f] & self.alive[w] & self.eats[self.species_code[w, f][:, None], self.species_code[w]]
+                predator_row, prey = np.nonzero(eaten)
+                self.alive[w[predator_row], prey] = False
+        self.move = move
+
+    def _nearest_free_cells(self, w: np.ndarray, f: np.ndarray, preferred: np.ndarray,
+                            tie_breaks: np.ndarray) -> tuple:
+        """
+        nearest coordinate to each preferred one that is in range, in the sea and clear of the other fish of its
+            world, as kernels.nearest_valid_cell - except that ties within a ring are broken by starting the ring
+            at a random cell rather than shuffling it
+        :return: cells, and True where one was found
+        """
+        here = self.position[w, f]
+        radius = self.radius[w, f]
+        clearance = self.size[w, f] / 2
+        # other living fish of the same world
+        others = self.alive[w].copy()
+        others[np.arange(len(w)), f] = False
+        out_of_range = np.round(np.hypot(*(preferred - here).T), 4) - radius
+        # rings further out than this only hold cells out of the fish's range
+        furthest = out_of_range + 2 * radius
+
+        def is_valid(rows, candidates):
+            in_range = np.round(np.hypot(*(candidates - here[rows, None, :]).transpose(2, 0, 1)), 4) <= \
+                radius[rows, None]
+            gaps = candidates[:, :, None, :] - self.position[w[rows]][:, None, :, :]
+            gaps = np.round(np.hypot(gaps[..., 0], gaps[..., 1]), 4)
+            clear = ~((gaps < clearance[rows, None, None]) & others[rows, None, :]).any(axis=2)
+            in_sea = SpatialUtils.poly_contains_points(candidates.reshape(-1, 2), self.boundary).reshape(
+                candidates.shape[:2])
+            return in_range & clear & in_sea
+
+        offsets, distances, ring_start, ring_length = _flat_rings(self.max_move_attempts)
+        cells = np.zeros_like(preferred)
+        found = np.zeros(len(w), dtype=bool)
+        # each fish works through the rings in order from the first one in its range, window by window. The first
+        # window is just the nearest cell, which most fish can take
+        next_cell = np.searchsorted(distances, out_of_range, side='left')
+        window = 1
+        rows = np.flatnonzero(next_cell < len(offsets))
+        while len(rows):
+            index = next_cell[rows, None] + np.arange(window)[None, :]
+            in_rings = index < len(offsets)
+            index = np.minimum(index, len(offsets) - 1)
+            # ties broken by starting each ring at a random cell
+            ring_first, length = ring_start[index], ring_length[index]
+            shift = np.floor(tie_breaks[rows, None] * length).astype(int)
+            rotated = ring_first + (index - ring_first + shift) % length
+            candidates = preferred[rows, None, :] + offsets[rotated]
+            valid = is_valid(rows, candidates) & in_rings & (distances[index] <= furthest[rows, None])
+            hit = valid.any(axis=1)
+            cells[rows[hit]] = candidates[hit, np.argmax(valid[hit], axis=1)]
+            found[rows[hit]] = True
+            next_cell[rows] += window
+            # stop looking once a fish is past the last ring that could hold a cell in its range
+            rows = rows[~hit]
+            rows = rows[(next_cell[rows] < len(offsets)) &
+                        (distances[np.minimum(next_cell[rows], len(offsets) - 1)] <= furthest[rows])]
+            window = _WINDOW
+        return cells, found
+
+    def update_shoals(self):
+        """
+        cluster every world into shoals at once: core fish (with at least the world's minimum shoal size of fish
+            within shoal_distance, counting themselves) connected through other core fish form a shoal, and other
+            fish join the shoal of their lowest numbered core neighbour. This is DBSCAN with only core points
+            extending a shoal (utils.dbscan also grows shoals through border points)
+        """
+        worlds, capacity = self.alive.shape
+        _, distance, pair = self._pairs()
+        near = pair & (distance <= self.shoal_distance)
+        core = self.alive & (near.sum(axis=2) + 1 >= self.min_points[:, None])
+        linked = near & core[:, :, None] & core[:, None, :]
+
+        # worlds never share a component, as fish of different worlds are never linked
+        w, i, j = np.nonzero(linked)
+        nodes = worlds * capacity
+        graph = coo_matrix((np.ones(len(w), dtype=bool), (w * capacity + i, w * capacity + j)), shape=(nodes, nodes))
+        _, component = connected_components(graph, directed=False)
+        component = np.where(core, component.reshape(worlds, capacity), -1)
+
+        border = self.alive & ~core & (near & core[:, None, :]).any(axis=2)
+        first_core = np.argmax(near & core[:, None, :], axis=2)
+        component = np.where(border, np.take_along_axis(component, first_core, axis=1), component)
+
+        # number each world's shoals 1 upwards, in order of their lowest numbered fish
+        flat = component.ravel()
+        members = np.flatnonzero(flat >= 0)
+        labels, first = np.unique(flat[members], return_index=True)
+        first = members[first]
+        order = np.argsort(first)
+        labels, world_of = labels[order], first[order] // capacity
+        renumbered = np.zeros(nodes, dtype=int)
+        renumbered[labels] = np.arange(len(labels)) - np.searchsorted(world_of, world_of) + 1
+        self.shoal_id = np.where(component >= 0, renumbered[np.maximum(component, 0)], -1)
+
+    def summary(self) -> dict:
+        """
+        per world measures of the batch as it is now (WORLD_SCHEMA without tick and world)
+        :return: column -> array with one value per world
+        """
+        worlds, capacity = self.alive.shape
+        counts = np.zeros((worlds, capacity + 2), dtype=int)
+        np.add.at(counts, (np.repeat(np.arange(worlds), capacity), self.shoal_id.ravel() + 1), 1)
+        radians = np.radians(self.rotation)
+        fish = self.alive.sum(axis=1)
+        polarisation = np.hypot(np.where(self.alive, np.cos(radians), 0).sum(axis=1),
+                                np.where(self.alive, np.sin(radians), 0).sum(axis=1)) / np.maximum(fish, 1)
+        stuck = self.alive & np.isin(self.move, (kernels.MOVE_STUCK, MOVE_BLOCKED))
+        return {
+            'fish_count': fish,
+            'shoal_count': np.maximum(self.shoal_id.max(axis=1), 0) if capacity else np.zeros(worlds, dtype=int),
+            'fish_in_shoals': (self.shoal_id >= 0).sum(axis=1),
+            'largest_shoal': counts[:, 1:].max(axis=1),
+            'polarisation': np.where(fish > 0, polarisation, np.nan),
+            'stuck_fraction': stuck.sum(axis=1) / np.maximum(fish, 1),
+        }
+
+    def run(self, ticks: int, directory: str=None) -> dict:
+        """
+        step every world for a number of ticks, clustering shoals after each
+        :param directory: if given, the summary of every world after every tick is written here (see
+            utils.metrics.load_columns to read it back)
+        :return: summary of every world after the last tick
+        """
+        writer = ColumnarWriter(directory, WORLD_SCHEMA) if directory is not None else None
+        try:
+            for _ in range(ticks):
+                self.time_step()
+                self.update_shoals()
+                if writer is not None:
+                    writer.append(tick=np.full(len(self), self.tick - 1), world=np.arange(len(self)),
+                                  **self.summary())
+                logger.debug(f'time: {self.tick - 1}')
+        finally:
+            if writer is not None:
+                writer.close()
+        return self.summary()
+
+    def snapshot(self, world: int) -> OceanSnapshot:
+        """one world drawn like an OceanEnvironment, e.g. to render a single replicate"""
+        fish = []
+        for i in np.flatnonzero(self.alive[world]):
+            species = self.species[self.species_code[world, i]]
+            shoal_id = int(self.shoal_id[world, i])
+            fish.append(FishSnapshot(
+                unique_id=int(i), name=f'{species.name} {i}',
+                previous_position=tuple(self.previous_position[world, i].tolist()),
+                position=tuple(self.position[world, i].tolist()), rotation=float(self.rotation[world, i]),
+                size=species.size, colour=species.colour if shoal_id == -1 else species.cluster_colour,
+                species=species, shoal_id=None if shoal_id == -1 else shoal_id))
+        return OceanSnapshot(tick=self.tick, fish=tuple(fish))
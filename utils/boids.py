@@ -0,0 +1,467 @@
+import logging
+import math
+import os
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from utils.spatial_utils import SpatialUtils
+from utils.dbscan import DBSCAN
+from utils.pipeline import FishSnapshot, OceanSnapshot, RenderSchedule, SimulationPipeline
+
+logger = logging.getLogger(__name__)
+
+"""
+a second, much cheaper movement model: force based boids in continuous space. Every fish is a row of a few arrays
+    (position, velocity, species) and every tick is a handful of vectorised passes over the pairs of fish that can
+    see each other, found with a uniform grid, rather than each fish searching for a free coordinate in turn
+snapshots, shoals, metrics and renderers are the same as for OceanEnvironment, so the two models can be run and
+    compared side by side
+"""
+
+
+def grid_pairs(positions: np.ndarray, cell_size: float, origin: np.ndarray, extent: np.ndarray,
+               toroidal: bool=False) -> tuple:
+    """
+    every ordered pair of points within cell_size of each other, found by only comparing points in the same or
+        adjacent cells of a uniform grid
+    :param positions: array of shape (n, 2)
+    :param cell_size: smallest grid cell width, the largest distance of interest
+    :param origin: lower left corner of the world
+    :param extent: width and height of the world
+    :param toroidal: if True the grid wraps around, and deltas are measured the short way around the world
+    :return: arrays i, j, delta (positions[j] - positions[i]) and distance, one entry per pair with i != j
+    """
+    n = len(positions)
+    if toroidal:
+        shape = np.maximum((extent // cell_size).astype(int), 1)
+    else:
+        shape = (extent // cell_size).astype(int) + 1
+    cells = np.floor((positions - origin) / extent * shape).astype(int) if toroidal else \
+        np.floor((positions - origin) / cell_size).astype(int)
+    cells = np.clip(cells, 0, shape - 1)
+    keys = cells[:, 0] * shape[1] + cells[:, 1]
+
+    # fish sorted by cell, each cell's fish are then a contiguous run of order
+    order = np.argsort(keys, kind='stable')
+    counts = np.bincount(keys, minlength=shape[0] * shape[1])
+    starts = np.cumsum(counts) - counts
+
+    # a narrow wrapping grid reaches the same cell from both sides, each neighbouring cell is only visited once
+    x_offsets = sorted({d % shape[0] for d in (-1, 0, 1)}) if toroidal else (-1, 0, 1)
+    y_offsets = sorted({d % shape[1] for d in (-1, 0, 1)}) if toroidal else (-1, 0, 1)
+    xs, ys = positions[:, 0], positions[:, 1]
+    pairs = []
+    for dx in x_offsets:
+        for dy in y_offsets:
+            neighbour_cells = cells + [dx, dy]
+            if toroidal:
+                neighbour_cells %= shape
+                valid = np.ones(n, dtype=bool)
+            else:
+                valid = ((neighbour_cells >= 0) & (neighbour_cells < shape)).all(axis=1)
+            neighbour_keys = neighbour_cells[valid, 0] * shape[1] + neighbour_cells[valid, 1]
+            run_lengths = counts[neighbour_keys]
+            total = int(run_lengths.sum())
+            if total == 0:
+                continue
+            # position within its cell's run of each candidate
+            within = np.arange(total) - np.repeat(np.cumsum(run_lengths) - run_lengths, run_lengths)
+            i = np.repeat(np.flatnonzero(valid), run_lengths)
+            j = order[np.repeat(starts[neighbour_keys], run_lengths) + within]
+            delta_x, delta_y = xs[j] - xs[i], ys[j] - ys[i]
+            if toroidal:
+                delta_x -= extent[0] * np.round(delta_x / extent[0])
+                delta_y -= extent[1] * np.round(delta_y / extent[1])
+            distance = np.hypot(delta_x, delta_y)
+            # most candidates in the corners of the 3 x 3 block of cells are out of reach
+            keep = (distance < cell_size) & (i != j)
+            pairs.append((i[keep], j[keep], delta_x[keep], delta_y[keep], distance[keep]))
+
+    if not pairs:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int), np.empty((0, 2)), np.empty(0)
+    i, j, delta_x, delta_y, distance = (np.concatenate(x) for x in zip(*pairs))
+    return i, j, np.column_stack([delta_x, delta_y]), distance
+
+
+def _unit(vectors: np.ndarray) -> np.ndarray:
+    lengths = np.hypot(vectors[:, 0], vectors[:, 1])[:, None]
+    return np.divide(vectors, lengths, out=np.zeros_like(vectors), where=lengths > 0)
+
+
+def _sum_by(index: np.ndarray, values: np.ndarray, n: int) -> np.ndarray:
+    """sum of the (m, 2) values for each index, as an (n, 2) array"""
+    # bincount gives ints when there is nothing to sum
+    return np.column_stack([np.bincount(index, weights=values[:, 0], minlength=n),
+                            np.bincount(index, weights=values[:, 1], minlength=n)]).astype(float)
+
+
+class BoidsOcean:
+    def __init__(self, bounding_coordinates: tuple, minimum_shoal_size: int, toroidal: bool=False,
+                 separation_weight: float=2, cohesion_weight: float=1.5, alignment_weight: float=1,
+                 flee_weight: float=3, seek_weight: float=1, coast_weight: float=3, max_steering: float=0.25,
+                 min_speed: float=0.5, wander: float=0, track_shoals: bool=False, reorder_every: int=None):
+        """
+        boids over array state. Each tick every fish steers towards a weighted sum of
+            separation - away from every fish within its repel distance, closer fish weighted more heavily
+            alignment - towards the mean velocity of its own species within its align distance
+            cohesion - towards the centre of its own species within its follow distance
+            flee / seek - away from predators / towards prey within its follow distance
+            coast - away from the coastline within its follow distance (polygon bounded worlds only)
+        distances are measured from the fish's centre so, like OceanEnvironment, each is the species' distance plus
+            its size. A fish's top speed is its species' max_movement_radius per tick
+        :param bounding_coordinates: should be tuple of tuples (x, y) listed in counterclockwise direction
+            ending with the first coordinate to close path
+        :param minimum_shoal_size: minimum number of fish required to be considered a shoal (used during clustering)
+        :param toroidal: if True the world is the bounding box of bounding_coordinates with opposite edges joined,
+            otherwise fish are kept inside the polygon
+        :param max_steering: largest change of velocity in a tick, as a fraction of the fish's top speed
+        :param min_speed: slowest a fish swims, as a fraction of its top speed
+        :param wander: degrees - each fish's heading is turned by up to this much at random each tick
+        :param track_shoals: if True shoals keep the same id from tick to tick (see utils.tracking.ShoalTracker)
+        :param reorder_every: if given, the fish arrays are sorted along a Z-order curve every this many ticks
+            (see reorder)
+        """
+        self.min_shoal_size = minimum_shoal_size
+        self.sea_colour = '#006994'
+        self.toroidal = toroidal
+        self.weights = dict(separation=separation_weight, cohesion=cohesion_weight, alignment=alignment_weight,
+                            flee=flee_weight, seek=seek_weight, coast=coast_weight)
+        self.max_steering = max_steering
+        self.min_speed = min_speed
+        self.wander = wander
+        self.reorder_every = reorder_every
+        self.shoal_tracker = None
+        if track_shoals:
+            from utils.tracking import ShoalTracker
+            self.shoal_tracker = ShoalTracker()
+
+        bbox = SpatialUtils.extract_bounding_box(bounding_coordinates)
+        self.origin = np.array(bbox[:2], dtype=float)
+        self.extent = np.array([bbox[2] - bbox[0], bbox[3] - bbox[1]], dtype=float)
+        if toroidal:
+            # the whole box is sea
+            bounding_coordinates = ((bbox[0], bbox[1]), (bbox[2], bbox[1]), (bbox[2], bbox[3]), (bbox[0], bbox[3]),
+                                    (bbox[0], bbox[1]))
+        self.boundary = bounding_coordinates
+        polygon = np.asarray(bounding_coordinates, dtype=float)
+        self._edge_starts = polygon[:-1]
+        self._edges = polygon[1:] - polygon[:-1]
+
+        self.species = []  # SpeciesProfile for each species code
+        self.position = np.empty((0, 2))
+        self.velocity = np.empty((0, 2))
+        self.code = np.empty(0, dtype=int)
+        self.unique_id = np.empty(0, dtype=int)
+        self.shoal_id = np.empty(0, dtype=int)  # -1 when not in a shoal
+        self.next_id = 0
+
+    def __len__(self) -> int:
+        return len(self.position)
+
+    def reorder(self):
+        """
+        sort the fish arrays along a Z-order curve of their positions (see SpatialUtils.morton_order), so that the
+            pairs found by grid_pairs mostly gather from nearby memory. A fish is identified by its unique_id, which
+            moves with it, never by its index
+        """
+        order = SpatialUtils.morton_order(self.position, origin=self.origin, extent=self.extent)
+        for attribute in ('position', 'velocity', 'code', 'unique_id', 'shoal_id'):
+            setattr(self, attribute, getattr(self, attribute)[order])
+
+    def _species_code(self, species) -> int:
+        if species not in self.species:
+            self.species.append(species)
+            self._refresh_species()
+        return self.species.index(species)
+
+    def _refresh_species(self):
+        profiles = self.species
+        self.separation_radius = np.array([x.repel_distance + x.size for x in profiles], dtype=float)
+        self.alignment_radius = np.array([x.align_distance + x.size for x in profiles], dtype=float)
+        self.cohesion_radius = np.array([x.follow_distance + x.size for x in profiles], dtype=float)
+        self.top_speed = np.array([x.max_movement_radius for x in profiles], dtype=float)
+        # eats[a, b] is True if species a eats species b. eats_fish lists fish classes, whose profiles are matched by
+        # name so that a spawned profile of a species is eaten like the class default
+        self.eats = np.array([[prey.name in {x.species.name for x in predator.eats_fish} for prey in profiles]
+                              for predator in profiles], dtype=bool)
+        # the grid must be coarse enough for every distance a fish reacts to
+        self.cell_size = max(float(np.max(self.cohesion_radius)), float(np.max(self.separation_radius)), 1e-9)
+
+    def spawn(self, species, count: int, place_attempts: int=10):
+        """
+        add count fish of a species at random positions in the ocean, swimming in random directions at top speed
+        :param species: SpeciesProfile of the fish, e.g. Snapper.species
+        :param place_attempts: rounds of random positions tried before giving up on the fish still unplaced
+        """
+        code = self._species_code(species)
+        positions = np.empty((0, 2))
+        for _ in range(place_attempts):
+            candidates = self.origin + np.random.random_sample((count - len(positions), 2)) * self.extent
+            if not self.toroidal:
+                candidates = candidates[SpatialUtils.poly_contains_points(candidates, self.boundary)]
+            positions = np.concatenate([positions, candidates])
+            if len(positions) == count:
+                break
+        if len(positions) < count:
+            logger.warning(f'only {len(positions)} of {count} {species.name} fit in the ocean')
+
+        headings = np.random.uniform(0, 2 * math.pi, len(positions))
+        velocity = np.column_stack([np.cos(headings), np.sin(headings)]) * species.max_movement_radius
+        self.position = np.concatenate([self.position, positions])
+        self.velocity = np.concatenate([self.velocity, velocity])
+        self.code = np.concatenate([self.code, np.full(len(positions), code)])
+        self.unique_id = np.concatenate([self.unique_id, np.arange(self.next_id, self.next_id + len(positions))])
+        self.shoal_id = np.concatenate([self.shoal_id, np.full(len(positions), -1)])
+        self.next_id += len(positions)
+        logger.info(f'{len(positions)} {species.name} spawned, {len(self)} fish in the ocean')
+
+    @property
+    def rotation(self) -> np.ndarray:
+        """heading of each fish in degrees, 0 along +x as in OceanEnvironment"""
+        return np.degrees(np.arctan2(self.velocity[:, 1], self.velocity[:, 0]))
+
+    def _steer(self, desired: np.ndarray, active: np.ndarray) -> np.ndarray:
+        """change of velocity that would have each active fish swimming at top speed in the desired direction"""
+        top_speed = self.top_speed[self.code][:, None]
+        steering = _unit(desired) * top_speed - self.velocity
+        steering[~active] = 0
+        return steering
+
+    def _coast(self) -> tuple:
+        """nearest point of the coastline to each fish, and how far away it is"""
+        # where along each edge the perpendicular from each fish lands, kept within the edge
+        offsets = self.position[:, None, :] - self._edge_starts[None, :, :]
+        lengths_sq = np.maximum(np.sum(self._edges ** 2, axis=1), 1e-12)
+        along = np.clip(np.sum(offsets * self._edges[None, :, :], axis=2) / lengths_sq, 0, 1)
+        closest = self._edge_starts[None, :, :] + along[:, :, None] * self._edges[None, :, :]
+        distances = np.hypot(*(self.position[:, None, :] - closest).transpose(2, 0, 1))
+        nearest = np.argmin(distances, axis=1)
+        rows = np.arange(len(self.position))
+        return closest[rows, nearest], distances[rows, nearest]
+
+    def forces(self) -> np.ndarray:
+        """steering force on each fish this tick, before it is limited to max_steering"""
+        n = len(self)
+        i, j, delta, distance = grid_pairs(self.position, self.cell_size, self.origin, self.extent,
+                                           toroidal=self.toroidal)
+        code_i, code_j = self.code[i], self.code[j]
+        same_species = code_i == code_j
+        weights = self.weights
+        force = np.zeros((n, 2))
+
+        # closer fish push harder - each unit vector away is weighted by 1 / distance
+        near = (distance < self.separation_radius[code_i]) & (distance > 0)
+        away = -delta[near] / distance[near, None] ** 2
+        force += weights['separation'] * self._steer(_sum_by(i[near], away, n), np.bincount(i[near], minlength=n) > 0)
+
+        aligned = same_species & (distance < self.alignment_radius[code_i])
+        heading = _sum_by(i[aligned], self.velocity[j[aligned]], n)
+        force += weights['alignment'] * self._steer(heading, np.bincount(i[aligned], minlength=n) > 0)
+
+        in_sight = distance < self.cohesion_radius[code_i]
+        followed = same_species & in_sight
+        towards_centre = _sum_by(i[followed], delta[followed], n)
+        force += weights['cohesion'] * self._steer(towards_centre, np.bincount(i[followed], minlength=n) > 0)
+
+        if self.eats.any():
+            hunted = in_sight & self.eats[code_j, code_i]
+            escape = -delta[hunted] / np.maximum(distance[hunted, None], 1e-9)
+            force += weights['flee'] * self._steer(_sum_by(i[hunted], escape, n),
+                                                   np.bincount(i[hunted], minlength=n) > 0)
+            hunting = in_sight & self.eats[code_i, code_j]
+            force += weights['seek'] * self._steer(_sum_by(i[hunting], delta[hunting], n),
+                                                   np.bincount(i[hunting], minlength=n) > 0)
+
+        if not self.toroidal:
+            closest, coast_distance = self._coast()
+            near_coast = coast_distance < self.cohesion_radius[self.code]
+            force += weights['coast'] * self._steer(self.position - closest, near_coast)
+        return force
+
+    def time_step(self):
+        """move every fish once, all fish decide from where every fish was at the start of the tick"""
+        if not len(self):
+            return
+        top_speed = self.top_speed[self.code][:, None]
+        force = self.forces()
+        # limit how sharply a fish can turn or change speed
+        magnitude = np.hypot(force[:, 0], force[:, 1])[:, None]
+        limit = self.max_steering * top_speed
+        force = np.where(magnitude > limit, force * limit / np.maximum(magnitude, 1e-12), force)
+        velocity = self.velocity + force
+        if self.wander:
+            turn = np.radians(np.random.uniform(-self.wander, self.wander, len(self)))
+            velocity = np.column_stack([velocity[:, 0] * np.cos(turn) - velocity[:, 1] * np.sin(turn),
+                                        velocity[:, 0] * np.sin(turn) + velocity[:, 1] * np.cos(turn)])
+        speed = np.hypot(velocity[:, 0], velocity[:, 1])[:, None]
+        # a fish with no velocity at all keeps the direction it had
+        direction = np.where(speed > 0, velocity / np.maximum(speed, 1e-12), _unit(self.velocity))
+        self.velocity = direction * np.clip(speed, self.min_speed * top_speed, top_speed)
+        self.position = self.position + self.velocity
+
+        if self.toroidal:
+            self.position = self.origin + np.mod(self.position - self.origin, self.extent)
+        else:
+            self._return_to_sea()
+
+    def _return_to_sea(self):
+        """put fish that swam over the coastline back just inside it, bounced off the coast"""
+        beached = np.flatnonzero(~SpatialUtils.poly_contains_points(self.position, self.boundary))
+        for k in beached:
+            projected = np.array(SpatialUtils.project_inside_polygon(self.position[k], self.boundary))
+            normal = _unit((projected - self.position[k])[None, :])[0]
+            towards_coast = float(self.velocity[k] @ normal)
+            if towards_coast < 0:
+                self.velocity[k] -= 2 * towards_coast * normal
+            self.position[k] = projected
+
+    def update_shoals(self, eps: float=30, tick: int=None):
+        """cluster the fish into shoals (DBSCAN, as OceanEnvironment.update_shoals) and update shoal_id"""
+        if not len(self):
+            return
+        if self.toroidal:
+            tree = cKDTree(self.position - self.origin, boxsize=self.extent)
+        else:
+            tree = cKDTree(self.position)
+        within = tree.query_ball_point(tree.data, r=eps)
+        labels = DBSCAN(points=self.position, eps=eps, min_points=self.min_shoal_size,
+                        neighbours=lambda k: sorted(within[k]))
+        if self.shoal_tracker is not None:
+            labels = self.shoal_tracker.update(self.unique_id.tolist(), labels, tick=tick)
+        self.shoal_id = np.array(labels, dtype=int)
+
+    def snapshot(self, tick: int, previous_position: np.ndarray=None) -> OceanSnapshot:
+        """immutable copy of the state needed to draw the ocean at this tick"""
+        previous_position = self.position if previous_position is None else previous_position
+        rotation = self.rotation
+        fish = []
+        for k in range(len(self)):
+            species = self.species[self.code[k]]
+            in_shoal = self.shoal_id[k] != -1
+            fish.append(FishSnapshot(
+                unique_id=int(self.unique_id[k]), name=f'{species.name} {self.unique_id[k]}',
+                previous_position=tuple(previous_position[k].tolist()), position=tuple(self.position[k].tolist()),
+                rotation=float(rotation[k]), size=species.size,
+                colour=species.cluster_colour if in_shoal else species.colour, species=species,
+                shoal_id=int(self.shoal_id[k]) if in_shoal else None))
+        return OceanSnapshot(tick=tick, fish=tuple(fish))
+
+    def advance(self, tick: int, periods: int=1, metrics=None, trajectory=None) -> OceanSnapshot:
+        """
+        simulate one or more periods
+        :param tick: the first period to simulate
+        :param periods: number of periods to simulate
+        :param metrics: optional ShoalMetrics, recorded after each period's shoals are assigned. Without metrics
+            shoals are only clustered for the last period
+        :param trajectory: optional utils.trajectory.TrajectoryRecorder, given every period's snapshot
+        :return: snapshot of the fish after the last period, coloured by the shoals they were in before it
+        """
+        snapshot = None
+        for t in range(tick, tick + periods):
+            if self.reorder_every is not None and t % self.reorder_every == 0:
+                self.reorder()
+            previous_position = self.position
+            self.time_step()
+            last = t == tick + periods - 1
+            if last or trajectory is not None:
+                snapshot = self.snapshot(t, previous_position=previous_position)
+            if trajectory is not None:
+                trajectory.record(snapshot)
+            if last or metrics is not None:
+                self.update_shoals(tick=t)
+            if metrics is not None:
+                metrics.record_arrays(t, positions=self.position, rotations=self.rotation, shoal_ids=self.shoal_id,
+                                      stuck=np.zeros(len(self), dtype=bool))
+        logger.info(f'time: {tick + periods - 1}, {len(self)} fish in {len(set(self.shoal_id.tolist()) - {-1})} '
+                    f'shoals')
+        return snapshot
+
+    def passage_of_time(self, time_periods: int, save_filename: str, pipeline_depth: int=0, render_every: int=1,
+                        render_budget: float=None, fps: int=5, metrics_directory: str=None, renderer: str='raster',
+                        labelled_fish: tuple=(), interpolated_frames: int=0, trajectory_directory: str=None):
+        """
+        simulate and animate the ocean, see OceanEnvironment.passage_of_time for the parameters
+        :param renderer: 'raster' (the default, boids are meant for populations too large for matplotlib) or
+            'matplotlib'
+        :param interpolated_frames: in-between frames drawn between each pair of simulated frames, fish in a
+            toroidal world move the short way around it
+        """
+        from utils.environ import make_renderer
+
+        def advance_frame(frame: int) -> OceanSnapshot:
+            # frames are simulated in order, the schedule says which periods come next
+            planned = schedule.next_frame()
+            if planned is None:
+                return None
+            first_tick, periods = planned
+            return self.advance(first_tick, periods=periods, metrics=metrics, trajectory=trajectory)
+
+        def simulate_frames():
+            for frame in range(frames):
+                snapshot = advance_frame(frame)
+                if snapshot is None:
+                    return
+                yield snapshot
+
+        renderer = make_renderer(self, renderer, labelled_fish=labelled_fish)
+        seconds_per_frame = None
+        if render_budget is not None:
+            # in-between frames cost as much to draw as simulated ones
+            seconds_per_frame = renderer.frame_seconds(self.snapshot(0)) * (interpolated_frames + 1)
+        schedule = RenderSchedule(time_periods, render_every=render_every, render_budget=render_budget,
+                                  seconds_per_frame=seconds_per_frame)
+        frames = schedule.frames
+        metadata = dict(artist='Jamie Edgecombe',
+                        comment=f'boids periods={time_periods} {schedule.describe()} '
+                                f'render_budget={render_budget} interpolated_frames={interpolated_frames}')
+        metrics = None
+        if metrics_directory is not None:
+            from utils.metrics import ShoalMetrics
+            metrics = ShoalMetrics(metrics_directory)
+        trajectory = None
+        if trajectory_directory is not None:
+            from utils.trajectory import TrajectoryRecorder
+            trajectory = TrajectoryRecorder(trajectory_directory)
+        pipeline = None
+        if pipeline_depth > 0:
+            pipeline = SimulationPipeline(advance_frame, frames=frames, max_queued_frames=pipeline_depth)
+            snapshots = schedule.timed(pipeline)
+        else:
+            snapshots = schedule.timed(simulate_frames())
+        # frames is the most there will be, a budget can leave fewer
+        video_frames = frames
+        if interpolated_frames > 0:
+            from utils.interpolation import interpolate_snapshots, interpolated_frame_count
+            snapshots = interpolate_snapshots(snapshots, between=interpolated_frames,
+                                              wrap=(self.origin, self.extent) if self.toroidal else None)
+            video_frames = interpolated_frame_count(frames, interpolated_frames)
+
+        try:
+            if pipeline is not None:
+                pipeline.start()
+            renderer.save(snapshots, frames=video_frames, save_filename=save_filename,
+                          fps=fps * (interpolated_frames + 1), metadata=metadata)
+            schedule.write_frames(f'{os.path.splitext(save_filename)[0]}_frames.txt',
+                                  interpolated_frames=interpolated_frames)
+        finally:
+            if pipeline is not None:
+                pipeline.close()
+            if metrics is not None:
+                metrics.close()
+                if self.shoal_tracker is not None:
+                    self.shoal_tracker.write(os.path.join(metrics_directory, 'shoal_events'))
+            if trajectory is not None:
+                trajectory.close()
+            renderer.close()
+
+    def _get_axes_limits(self, buffer: float=0.1):
+        """
+        axes limits for drawing the ocean, a toroidal world is drawn without a margin as fish leaving one edge
+            reappear at the other
+        :return: lists: x axis limit, y axis limit
+        """
+        buffer = 0 if self.toroidal else buffer
+        x_buffer, y_buffer = self.extent * buffer
+        return [self.origin[0] - x_buffer, self.origin[0] + self.extent[0] + x_buffer], \
+            [self.origin[1] - y_buffer, self.origin[1] + self.extent[1] + y_buffer]
@@ -0,0 +1,201 @@
+import logging
+import queue
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+"""
+fish brains in a local SQLite database: what every fish was doing each tick and which fish it could see. Rows are
+    handed to a background thread that writes them in batched transactions, so the simulation never waits on disk
+"""
+
+REPEL, ALIGN, FOLLOW = 0, 1, 2
+RELATION_NAMES = ('repel', 'align', 'follow')
+
+_TABLES = (
+    """CREATE TABLE IF NOT EXISTS relations (
+        relation INTEGER PRIMARY KEY,
+        name TEXT NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS fish (
+        fish_id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        species TEXT NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS fish_states (
+        tick INTEGER NOT NULL,
+        fish_id INTEGER NOT NULL REFERENCES fish (fish_id),
+        shoal_id INTEGER,
+        predators_seen INTEGER,  -- predators among the fish seen for the fish's last move, NULL before it has moved
+        x REAL NOT NULL,
+        y REAL NOT NULL,
+        rotation REAL,
+        age INTEGER,
+        edge_distance REAL,
+        PRIMARY KEY (tick, fish_id)
+    ) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS neighbours (
+        tick INTEGER NOT NULL,
+        fish_id INTEGER NOT NULL REFERENCES fish (fish_id),
+        neighbour_id INTEGER NOT NULL REFERENCES fish (fish_id),
+        relation INTEGER NOT NULL REFERENCES relations (relation),
+        PRIMARY KEY (tick, fish_id, neighbour_id)
+    ) WITHOUT ROWID""",
+)
+# indexes are built once the run is written (see FishBrainDatabase.close), which is much quicker than keeping them
+# up to date row by row. The primary keys above already index (tick, fish_id)
+_INDEXES = (
+    'CREATE INDEX IF NOT EXISTS fish_states_by_fish ON fish_states (fish_id, tick)',
+    'CREATE INDEX IF NOT EXISTS fish_states_by_shoal ON fish_states (shoal_id, tick)',
+)
+
+_INSERTS = {
+    'fish': 'INSERT OR IGNORE INTO fish VALUES (?, ?, ?)',
+    'fish_states': 'INSERT OR REPLACE INTO fish_states VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+    'neighbours': 'INSERT OR REPLACE INTO neighbours VALUES (?, ?, ?, ?)',
+}
+
+
+class FishBrainDatabase:
+    _DONE = object()
+
+    def __init__(self, path: str, batch_size: int=50, max_queued_ticks: int=64):
+        """
+        records the state of every fish after each tick (see record), written by a background thread
+        :param path: SQLite database file, created if needed. Existing runs in it are added to, ticks recorded
+            again replace the old rows
+        :param batch_size: ticks written to the database in a single transaction
+        :param max_queued_ticks: ticks waiting to be written before record blocks the simulation
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.known_fish = set()
+        self.rows = queue.Queue(maxsize=max_queued_ticks)
+        self._error = None
+        self._thread = threading.Thread(target=self._write, name='fish brains', daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def record(self, tick: int, population: list):
+        """
+        queue the state of each fish and the fish it could see, should be called after the shoals have been assigned
+        :param tick: period being recorded
+        :param population: fish in the ocean
+        """
+        if self._error is not None:
+            raise self._error
+        fish, states, neighbours = [], [], []
+        for fsh in population:
+            if fsh.unique_id not in self.known_fish:
+                self.known_fish.add(fsh.unique_id)
+                fish.append((fsh.unique_id, fsh.name, fsh.species.name))
+            # what the fish saw is read from its memory of the move, however the move was decided - sub_env is not
+            # kept up to date when moves are decided elsewhere (e.g. by a ParallelDecisionPool)
+            memory = fsh.memory[-1] if fsh.memory else None
+            # numpy scalars (from clustering and the kernels) are converted, sqlite3 cannot store them
+            states.append((tick, fsh.unique_id, None if fsh.shoal_id is None else int(fsh.shoal_id),
+                           None if memory is None else int(memory['predators_seen']), float(fsh.position[0]),
+                           float(fsh.position[1]), float(fsh.rotation), int(fsh.age),
+                           float(fsh.dist_to_closest_edge)))
+            if memory is None:
+                continue
+            for relation, nearby in ((REPEL, memory['repel_fish']), (ALIGN, memory['align_fish']),
+                                     (FOLLOW, memory['follow_fish'])):
+                neighbours.extend((tick, fsh.unique_id, other.unique_id, relation) for other in nearby)
+        self.rows.put({'fish': fish, 'fish_states': states, 'neighbours': neighbours})
+
+    def _write(self):
+        connection = sqlite3.connect(self.path)
+        done = False
+        try:
+            # losing the last few ticks in a crash is fine, waiting on the disk after every transaction is not
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute('PRAGMA synchronous = NORMAL')
+            with connection:
+                for statement in _TABLES:
+                    connection.execute(statement)
+                connection.executemany('INSERT OR IGNORE INTO relations VALUES (?, ?)', enumerate(RELATION_NAMES))
+            while not done:
+                batch = [self.rows.get()]
+                # take whatever else is already waiting, up to a batch
+                while len(batch) < self.batch_size and batch[-1] is not self._DONE:
+                    try:
+                        batch.append(self.rows.get_nowait())
+                    except queue.Empty:
+                        break
+                if batch[-1] is self._DONE:
+                    batch.pop()
+                    done = True
+                with connection:
+                    for table, statement in _INSERTS.items():
+                        connection.executemany(statement, (row for tick in batch for row in tick[table]))
+            with connection:
+                for statement in _INDEXES:
+                    connection.execute(statement)
+        except BaseException as e:
+            logger.exception('fish brain writer failed')
+            self._error = e
+            # keep emptying the queue so that record does not block before it sees the error
+            while not done:
+                done = self.rows.get() is self._DONE
+        finally:
+            connection.close()
+
+    def close(self):
+        """write everything queued, index the tables and stop the writer thread"""
+        if self._thread.is_alive():
+            self.rows.put(self._DONE)
+            self._thread.join()
+        if self._error is not None:
+            raise self._error
+        logger.info(f'fish brains for {len(self.known_fish)} fish written to {self.path}')
+
+
+def _query(path: str, statement: str, parameters: tuple=()) -> list:
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute(statement, parameters).fetchall()
+    finally:
+        connection.close()
+
+
+def fish_position(path: str, fish_id: int, tick: int) -> tuple:
+    """
+    :return: (x, y) of a fish at a tick, or None if it was not in the ocean then
+    """
+    rows = _query(path, 'SELECT x, y FROM fish_states WHERE tick = ? AND fish_id = ?', (tick, fish_id))
+    return rows[0] if rows else None
+
+
+def fish_track(path: str, fish_id: int) -> list:
+    """
+    :return: (tick, x, y, shoal_id) for every tick a fish was recorded, in tick order
+    """
+    return _query(path, 'SELECT tick, x, y, shoal_id FROM fish_states WHERE fish_id = ? ORDER BY tick', (fish_id, ))
+
+
+def shoal_sizes(path: str, shoal_id: int=None) -> list:
+    """
+    :param shoal_id: a single shoal, or every shoal if None
+    :return: (tick, shoal_id, size) in tick order
+    """
+    if shoal_id is None:
+        return _query(path, 'SELECT tick, shoal_id, COUNT(*) FROM fish_states WHERE shoal_id IS NOT NULL '
+                            'GROUP BY tick, shoal_id ORDER BY tick, shoal_id')
+    return _query(path, 'SELECT tick, shoal_id, COUNT(*) FROM fish_states WHERE shoal_id = ? GROUP BY tick '
+                        'ORDER BY tick', (shoal_id, ))
+
+
+def neighbours_of(path: str, fish_id: int, tick: int) -> list:
+    """
+    :return: (neighbour id, neighbour name, relation name) for the fish a fish could see at a tick
+    """
+    return _query(path, 'SELECT n.neighbour_id, f.name, r.name FROM neighbours n '
+                        'JOIN fish f ON f.fish_id = n.neighbour_id JOIN relations r ON r.relation = n.relation '
+                        'WHERE n.tick = ? AND n.fish_id = ? ORDER BY n.relation, n.neighbour_id', (tick, fish_id))
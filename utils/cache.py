@@ -0,0 +1,180 @@
+import ast
+import glob
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+
+logger = logging.getLogger(__name__)
+
+"""
+a cache of simulation runs and what was drawn or exported from them, addressed by a hash of everything that decides
+    the result - the scenario's settings and the code that simulated it - so a repeated request is served from disk
+"""
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# scripts whose code simulates a run, alongside the settings they hold
+SCRIPTS = ('fish_schooling.py', )
+
+
+def _is_setting(node: ast.stmt) -> bool:
+    """True for a module level assignment to UPPER_CASE names, e.g. PERIODS = 250"""
+    if isinstance(node, ast.Assign):
+        targets = node.targets
+    elif isinstance(node, ast.AnnAssign):
+        targets = [node.target]
+    else:
+        return False
+    return all(isinstance(x, ast.Name) and x.id.isupper() for x in targets)
+
+
+def _code_without_settings(source: str) -> str:
+    """a script's code without its settings, as a dump of its syntax tree so that comments and layout don't count"""
+    tree = ast.parse(source)
+    tree.body = [node for node in tree.body if not _is_setting(node)]
+    return ast.dump(tree)
+
+
+def code_version(root: str=_ROOT) -> str:
+    """
+    hash of the model's source files (utils/*.py) and of the code in the scripts that run it (SCRIPTS, e.g. how
+        fish_schooling.py spawns fish), so that changing the code never serves a run simulated by older code. The
+        scripts' settings are left out: they reach the key through the settings given to scenario_key, and editing
+        how a run is drawn (e.g. RENDER_EVERY) should still find its trajectory
+    """
+    digest = hashlib.sha256()
+    paths = sorted(glob.glob(os.path.join(root, 'utils', '*.py')))
+    for path in paths:
+        digest.update(os.path.relpath(path, root).encode())
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    for script in SCRIPTS:
+        path = os.path.join(root, script)
+        if not os.path.exists(path):
+            continue
+        digest.update(script.encode())
+        with open(path) as f:
+            digest.update(_code_without_settings(f.read()).encode())
+    return digest.hexdigest()
+
+
+def scenario_key(settings: dict, include_code: bool=True) -> str:
+    """
+    address of a scenario
+    :param settings: everything that changes the result, JSON serialisable (anything else is written with repr)
+    :param include_code: if True the key also changes whenever the code does (see code_version)
+    :return: hex digest
+    """
+    content = {'settings': settings, 'code': code_version() if include_code else None}
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=repr).encode()).hexdigest()
+
+
+def _size(path: str) -> int:
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(directory, name))
+                   for directory, _, names in os.walk(path) for name in names)
+    return os.path.getsize(path)
+
+
+def _remove(path: str):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+class RunCache:
+    def __init__(self, directory: str, max_bytes: int=2 * 1024 ** 3):
+        """
+        files and directories stored under <directory>/<run key>/<name>, each a separate entry: a run's trajectory,
+            its metrics and every video drawn from it can be kept or evicted independently. When the cache grows past
+            max_bytes the least recently used entries are removed
+        :param directory: where the cache lives, created if needed - outside of anything that is wiped between runs
+        :param max_bytes: largest total size of the entries
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(directory, 'index.json')
+        os.makedirs(directory, exist_ok=True)
+        self.index = {}  # '<run key>/<name>' -> {'size': bytes, 'last_used': seconds since the epoch}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+
+    def _save_index(self):
+        # written then renamed, so that a crash never leaves half an index
+        temporary = f'{self.index_path}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(self.index, f, indent=1)
+        os.replace(temporary, self.index_path)
+
+    def _path(self, entry: str) -> str:
+        return os.path.join(self.directory, *entry.split('/'))
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(x['size'] for x in self.index.values())
+
+    def get(self, run_key: str, name: str) -> str:
+        """
+        :return: path of the cached entry (to be read, not changed), None if it is not cached
+        """
+        entry = f'{run_key}/{name}'
+        if entry not in self.index:
+            return None
+        path = self._path(entry)
+        if not os.path.exists(path):
+            logger.warning(f'cache entry {entry} has gone missing from disk')
+            del self.index[entry]
+            self._save_index()
+            return None
+        self.index[entry]['last_used'] = time.time()
+        self._save_index()
+        logger.info(f'cache hit: {entry}')
+        return path
+
+    def put(self, run_key: str, name: str, source: str) -> str:
+        """
+        copy a file or directory into the cache, replacing any entry of the same name, then evict down to max_bytes
+        :return: path of the new entry, None if it was too large to keep
+        """
+        entry = f'{run_key}/{name}'
+        path = self._path(entry)
+        _remove(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.isdir(source):
+            shutil.copytree(source, path)
+        else:
+            shutil.copy2(source, path)
+        size = _size(path)
+        if size > self.max_bytes:
+            # keeping it would mean evicting everything else, and then it
+            logger.warning(f'{entry} ({size} bytes) is larger than the whole cache, not cached')
+            self._discard(entry)
+            self._save_index()
+            return None
+        self.index[entry] = {'size': size, 'last_used': time.time()}
+        logger.info(f'cached {entry} ({size} bytes)')
+        self._evict()
+        return path
+
+    def _evict(self):
+        total = self.total_bytes
+        for entry in sorted(self.index, key=lambda x: self.index[x]['last_used']):
+            if total <= self.max_bytes:
+                break
+            total -= self.index[entry]['size']
+            logger.info(f'evicting {entry} from the cache ({self.index[entry]["size"]} bytes)')
+            self._discard(entry)
+        self._save_index()
+
+    def _discard(self, entry: str):
+        _remove(self._path(entry))
+        self.index.pop(entry, None)
+        run_directory = self._path(entry.split('/')[0])
+        if os.path.isdir(run_directory) and not os.listdir(run_directory):
+            os.rmdir(run_directory)
@@ -1,14 +1,19 @@
 from utils.spatial_utils import SpatialUtils
 
 
-def DBSCAN(points, eps, min_points):
+def DBSCAN(points, eps, min_points, neighbours=None):
     """
     cluster dataset of points according to DBSCAN methodology
     :param points: the list of vectors to cluster
     :param eps: threshold distance
     :param min_points: minimum number of points required in the cluster for it to be considered non-noise
+    :param neighbours: optional callable(index) returning the indices of all points within eps of points[index]
+        (including itself) in order, e.g. from a NeighbourTable. Saves measuring the distance between every pair
     :return: a list of labels. -1 for noise, other labels begin from one
     """
+    if neighbours is not None:
+        return indexed_DBSCAN(point_count=len(points), neighbours=neighbours, min_points=min_points)
+
     # initialise all labels as 0, before subsequently overwriting
     labels = [0] * len(points)
 
@@ -36,6 +41,39 @@ def DBSCAN(points, eps, min_points):
     return labels
 
 
+def indexed_DBSCAN(point_count, neighbours, min_points):
+    """
+    same as DBSCAN, but working on point indices with neighbours already known
+    :param point_count: number of points
+    :param neighbours: callable(index) returning the indices of all points within eps of that point, including itself
+    :param min_points: minimum number of points required in the cluster for it to be considered non-noise
+    :return: a list of labels. -1 for noise, other labels begin from one
+    """
+    labels = [0] * point_count
+    cluster_num = 0
+    for seed_num in range(point_count):
+        if labels[seed_num] != 0:
+            continue
+        seed_neighbours = neighbours(seed_num)
+        if len(seed_neighbours) < min_points:
+            labels[seed_num] = -1
+            continue
+        cluster_num += 1
+        labels[seed_num] = cluster_num
+        # FIFO queue of points to search, grows as branch points are found
+        queue = list(seed_neighbours)
+        i = 0
+        while i < len(queue):
+            ref_num = queue[i]
+            if labels[ref_num] == -1:
+                labels[ref_num] = cluster_num
+            elif labels[ref_num] == 0:
+                labels[ref_num] = cluster_num
+                queue = queue + neighbours(ref_num)
+            i += 1
+    return labels
+
+
 def grow_cluster(points, labels, seed_num, neighbours, cluster_label, eps, min_points):
     """
     Grow a new cluster with label `C` from the seed point `P`.
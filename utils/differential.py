@@ -0,0 +1,362 @@
+import logging
+import random
+from collections import Counter, namedtuple
+
+import numpy as np
+
+from utils.positioning import NearbyWaters
+
+logger = logging.getLogger(__name__)
+
+"""
+differential testing of the faster engines against the reference model (Fish.swim with a fresh NearbyWaters for
+    every fish, fish swimming in population order, DBSCAN over every pair of fish)
+
+engines that should make exactly the same decisions are run in lockstep with the reference: both oceans are built
+    from the same seed, each engine has its own copy of the random state, and fish swim in pairs so that
+    perception, moves and shoal labels can be compared fish by fish - see compare_lockstep
+engines that make different (but statistically equivalent) choices, such as deciding moves in parallel, are
+    compared on the distribution of what the fish do over several seeds - see compare_distributions. When they
+    differ, the seed is run again a tick at a time to find the first fish that diverged - see first_divergence
+"""
+
+# first point where a candidate engine stopped behaving like the reference
+Divergence = namedtuple('Divergence', ['tick', 'unique_id', 'check', 'reference', 'candidate'])
+
+
+class Engine:
+    """the reference engine, other engines override the parts they speed up"""
+    name = 'reference'
+    lockstep = True  # True if the engine should make exactly the reference's decisions
+    statistics = None  # distributions compared when not in lockstep (see compare_distributions), None for all
+
+    def start(self, ocean):
+        self.ocean = ocean
+
+    def begin_tick(self):
+        pass
+
+    def order(self) -> list:
+        """fish in the order they swim this tick"""
+        return list(self.ocean.population)
+
+    def perceive(self, fish) -> NearbyWaters:
+        return NearbyWaters(fish=fish, ocean=self.ocean)
+
+    def moved(self, fish):
+        pass
+
+    def end_tick(self):
+        pass
+
+    def step(self):
+        """one whole tick, as used when the engine is not run in lockstep"""
+        self.begin_tick()
+        for fsh in self.order():
+            if fsh.alive:
+                fsh.swim(sub_env=self.perceive(fsh), verbose=False)
+                self.moved(fsh)
+        self.end_tick()
+        self.ocean.update_shoals()
+
+    def close(self):
+        pass
+
+
+class NeighbourTableEngine(Engine):
+    name = 'neighbour_table'
+
+    def begin_tick(self):
+        from utils.neighbours import NeighbourTable
+        self.ocean.neighbour_table = NeighbourTable(self.ocean.population)
+
+
+class LazyPerceptionEngine(Engine):
+    name = 'lazy_perception'
+
+    def start(self, ocean):
+        from utils.scheduler import PerceptionScheduler
+        super().start(ocean)
+        self.scheduler = PerceptionScheduler(ocean)
+
+    def order(self) -> list:
+        return self.scheduler.order()
+
+    def perceive(self, fish) -> NearbyWaters:
+        return self.scheduler.perceive(fish)
+
+    def moved(self, fish):
+        self.scheduler.moved(fish)
+
+    def end_tick(self):
+        self.scheduler.end_tick()
+
+
+class TableAndLazyEngine(LazyPerceptionEngine, NeighbourTableEngine):
+    name = 'neighbour_table+lazy_perception'
+
+
+class ParallelEngine(Engine):
+    name = 'parallel'
+    lockstep = False
+
+    def __init__(self, workers: int=2):
+        self.workers = workers
+
+    def start(self, ocean):
+        from utils.parallel import ParallelDecisionPool
+        super().start(ocean)
+        self.pool = ParallelDecisionPool(ocean, workers=self.workers)
+        self.pool.start()
+
+    def step(self):
+        self.ocean.time_step(decision_pool=self.pool, verbose=False)
+        self.ocean.update_shoals()
+
+    def close(self):
+        self.pool.close()
+
+
+class AggregateEngine(Engine):
+    name = 'aggregate'
+    lockstep = False
+    # fish moved as part of a shoal are recorded as 'shoal', a motivation the reference does not have
+    statistics = ('move distance', 'shoal count')
+
+    def __init__(self, predator_radius: float=150):
+        self.predator_radius = predator_radius
+
+    def start(self, ocean):
+        from utils.aggregate import ShoalAggregator
+        super().start(ocean)
+        ocean.aggregator = ShoalAggregator(ocean, predator_radius=self.predator_radius)
+
+    def step(self):
+        self.ocean.time_step(verbose=False)
+        self.ocean.update_shoals()
+
+
+ENGINES = {engine.name: engine for engine in (NeighbourTableEngine, LazyPerceptionEngine, TableAndLazyEngine,
+                                              ParallelEngine, AggregateEngine)}
+
+
+def same_partition(labels_a: list, labels_b: list) -> bool:
+    """True if two clusterings group the points the same way, whatever the labels are called (-1 is noise)"""
+    if len(labels_a) != len(labels_b):
+        return False
+    forward = {}
+    backward = {}
+    for a, b in zip(labels_a, labels_b):
+        if (a == -1) != (b == -1):
+            return False
+        if forward.setdefault(a, b) != b or backward.setdefault(b, a) != a:
+            return False
+    return True
+
+
+def _perception(sub_env: NearbyWaters) -> dict:
+    return {
+        'neighbour classes': tuple(sorted(fsh.unique_id for fsh in x)
+                                   for x in (sub_env.repel_fish, sub_env.align_fish, sub_env.follow_fish)),
+        'available moves': sub_env.available_move_set,
+    }
+
+
+def _shoal_labels(ocean) -> list:
+    return [-1 if fsh.shoal_id is None else fsh.shoal_id for fsh in ocean.population]
+
+
+class _RandomState:
+    """a separate copy of python's and numpy's global random state, swapped in while an engine runs"""
+    def __init__(self):
+        self.python = random.getstate()
+        self.numpy = np.random.get_state()
+
+    def __enter__(self):
+        random.setstate(self.python)
+        np.random.set_state(self.numpy)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.python = random.getstate()
+        self.numpy = np.random.get_state()
+
+
+def compare_lockstep(make_ocean, candidate: Engine, ticks: int, seed: int=0):
+    """
+    run the reference and candidate engine side by side, fish by fish, and stop at the first difference
+    :param make_ocean: callable(seed) returning a populated OceanEnvironment, the same every time for a seed
+    :param candidate: engine expected to make exactly the reference's decisions
+    :param ticks: number of ticks to compare
+    :return: the first Divergence, or None if the engines agreed throughout
+    """
+    reference_ocean = make_ocean(seed)
+    candidate_ocean = make_ocean(seed)
+    reference = Engine()
+    reference.start(reference_ocean)
+    candidate.start(candidate_ocean)
+    # both oceans were built from the same seed, so each engine continues from the same random state
+    reference_random = _RandomState()
+    candidate_random = _RandomState()
+    try:
+        for tick in range(ticks):
+            reference.begin_tick()
+            candidate.begin_tick()
+            twins = {fsh.unique_id: fsh for fsh in reference_ocean.population}
+            survivors = sorted(fsh.unique_id for fsh in candidate_ocean.population)
+            if survivors != sorted(twins):
+                return Divergence(tick, None, 'population', sorted(twins), survivors)
+            # the reference swims in the candidate's order - the order is part of the schedule, not the model
+            for fsh in candidate.order():
+                twin = twins[fsh.unique_id]
+                if fsh.alive != twin.alive:
+                    return Divergence(tick, fsh.unique_id, 'alive', twin.alive, fsh.alive)
+                if not fsh.alive:
+                    continue
+                sub_env = candidate.perceive(fsh)
+                twin_sub_env = reference.perceive(twin)
+                seen, twin_seen = _perception(sub_env), _perception(twin_sub_env)
+                for check in seen:
+                    if seen[check] != twin_seen[check]:
+                        return Divergence(tick, fsh.unique_id, check, twin_seen[check], seen[check])
+
+                with reference_random:
+                    twin.swim(sub_env=twin_sub_env, verbose=False)
+                with candidate_random:
+                    fsh.swim(sub_env=sub_env, verbose=False)
+                candidate.moved(fsh)
+                outcome = (fsh.memory[-1]['move_descr'], list(fsh.position), fsh.rotation)
+                twin_outcome = (twin.memory[-1]['move_descr'], list(twin.position), twin.rotation)
+                if outcome != twin_outcome:
+                    return Divergence(tick, fsh.unique_id, 'move', twin_outcome, outcome)
+            reference.end_tick()
+            candidate.end_tick()
+
+            reference_ocean.update_shoals()
+            candidate_ocean.update_shoals()
+            labels, twin_labels = _shoal_labels(candidate_ocean), _shoal_labels(reference_ocean)
+            if not same_partition(labels, twin_labels):
+                return Divergence(tick, None, 'shoal labels', twin_labels, labels)
+    finally:
+        candidate.close()
+    return None
+
+
+def _summarise(ocean, counts: Counter, distances: list, shoals: list):
+    for fsh in ocean.population:
+        if fsh.memory:
+            counts[fsh.memory[-1]['move_descr']] += 1
+            distances.append(fsh.memory[-1]['move_distance'])
+    shoals.append(len({fsh.shoal_id for fsh in ocean.population if fsh.shoal_id is not None}))
+
+
+def ks_statistic(sample_a: list, sample_b: list) -> float:
+    """two sample Kolmogorov-Smirnov statistic - largest gap between the empirical distributions"""
+    a, b = np.sort(sample_a), np.sort(sample_b)
+    if len(a) == 0 or len(b) == 0:
+        return 0.0 if len(a) == len(b) else 1.0
+    values = np.concatenate([a, b])
+    return float(np.max(np.abs(np.searchsorted(a, values, side='right') / len(a) -
+                               np.searchsorted(b, values, side='right') / len(b))))
+
+
+def _statistics(reference: tuple, candidate: tuple) -> dict:
+    """statistic -> difference between (move motivation counts, move distances, shoal counts) samples"""
+    (reference_counts, reference_distances, reference_shoals), (counts, distances, shoals) = reference, candidate
+    motivations = set(reference_counts) | set(counts)
+    total_reference, total = max(sum(reference_counts.values()), 1), max(sum(counts.values()), 1)
+    motivation_gap = 0.5 * sum(abs(reference_counts[x] / total_reference - counts[x] / total) for x in motivations)
+    distance_gap = ks_statistic(reference_distances, distances)
+    shoal_gap = abs(np.mean(shoals) - np.mean(reference_shoals)) / max(np.mean(reference_shoals), 1)
+    return {'move motivation': motivation_gap, 'move distance': distance_gap, 'shoal count': float(shoal_gap)}
+
+
+def _pooled(samples: list) -> tuple:
+    counts, distances, shoals = Counter(), [], []
+    for seed_counts, seed_distances, seed_shoals in samples:
+        counts.update(seed_counts)
+        distances.extend(seed_distances)
+        shoals.extend(seed_shoals)
+    return counts, distances, shoals
+
+
+def _fish_state(ocean) -> dict:
+    return {fsh.unique_id: (fsh.memory[-1]['move_descr'] if fsh.memory else None, list(fsh.position), fsh.rotation)
+            for fsh in ocean.population}
+
+
+def first_divergence(make_ocean, candidate: Engine, ticks: int, seed: int=0):
+    """
+    run the reference and an engine that is not in lockstep a whole tick at a time from the same ocean, each with
+        its own copy of the random state, and compare every fish after each tick. Such an engine is expected to
+        diverge - this says where, to start looking for why it no longer behaves like the reference
+    :return: the first Divergence (the lowest fish id of the tick), or None if the engines agreed throughout
+    """
+    reference_ocean = make_ocean(seed)
+    candidate_ocean = make_ocean(seed)
+    reference = Engine()
+    reference.start(reference_ocean)
+    candidate.start(candidate_ocean)
+    reference_random = _RandomState()
+    candidate_random = _RandomState()
+    try:
+        for tick in range(ticks):
+            with reference_random:
+                reference.step()
+            with candidate_random:
+                candidate.step()
+            states, twin_states = _fish_state(candidate_ocean), _fish_state(reference_ocean)
+            if sorted(states) != sorted(twin_states):
+                return Divergence(tick, None, 'population', sorted(twin_states), sorted(states))
+            for unique_id in sorted(states):
+                if states[unique_id] != twin_states[unique_id]:
+                    return Divergence(tick, unique_id, 'move', twin_states[unique_id], states[unique_id])
+            labels, twin_labels = _shoal_labels(candidate_ocean), _shoal_labels(reference_ocean)
+            if not same_partition(labels, twin_labels):
+                return Divergence(tick, None, 'shoal labels', twin_labels, labels)
+    finally:
+        candidate.close()
+    return None
+
+
+def compare_distributions(make_ocean, candidate_factory, ticks: int, seeds: tuple=(0, 1, 2),
+                          tolerance: float=0.15) -> dict:
+    """
+    run the reference and a candidate engine from the same starting oceans and compare what the fish do
+    :param candidate_factory: callable() returning a new candidate Engine for each seed
+    :param tolerance: largest acceptable difference for each statistic
+    :return: statistic -> (difference, passed, divergence): total variation distance between the move motivations,
+        Kolmogorov-Smirnov statistic between the move distances and relative difference in mean shoal count. When a
+        statistic fails, divergence is the first Divergence (see first_divergence) on the seed where that statistic
+        differed most, otherwise None
+    """
+    samples = {}
+    for name, factory in (('reference', Engine), ('candidate', candidate_factory)):
+        samples[name] = []
+        for seed in seeds:
+            counts, distances, shoals = Counter(), [], []
+            ocean = make_ocean(seed)
+            engine = factory()
+            engine.start(ocean)
+            try:
+                for _ in range(ticks):
+                    engine.step()
+                    _summarise(ocean, counts, distances, shoals)
+            finally:
+                engine.close()
+            samples[name].append((counts, distances, shoals))
+
+    pooled = _statistics(_pooled(samples['reference']), _pooled(samples['candidate']))
+    per_seed = [_statistics(reference, candidate) for reference, candidate in zip(samples['reference'],
+                                                                                   samples['candidate'])]
+    divergences = {}  # seed -> Divergence, each seed is only run in lockstep once
+    results = {}
+    for statistic, difference in pooled.items():
+        passed = difference <= tolerance
+        divergence = None
+        if not passed:
+            seed = seeds[int(np.argmax([x[statistic] for x in per_seed]))]
+            if seed not in divergences:
+                divergences[seed] = first_divergence(make_ocean, candidate_factory(), ticks=ticks, seed=seed)
+            divergence = divergences[seed]
+        results[statistic] = (difference, passed, divergence)
+    return results
@@ -1,34 +1,70 @@
 import logging
 import os
 
-import matplotlib as mpl
-mpl.use('TkAgg')
-import matplotlib.animation as animation
-from matplotlib.collections import PatchCollection
-from matplotlib.patches import Polygon
-import matplotlib.pyplot as plt
-from matplotlib.lines import Line2D
-from matplotlib.text import Text
-
 from utils.spatial_utils import SpatialUtils
 from utils.dbscan import DBSCAN
+from utils.pipeline import FishSnapshot, OceanSnapshot, RenderSchedule, SimulationPipeline
+from utils.population import Population
 
 logger = logging.getLogger(__name__)
 
 
 class OceanEnvironment:
-    def __init__(self, bounding_coordinates: tuple, minimum_shoal_size: int):
+    def __init__(self, bounding_coordinates: tuple, minimum_shoal_size: int, continuous_movement: bool=False,
+                 shared_neighbour_table: bool=False, predation: bool=False, graveyard=None,
+                 topological_neighbours: int=None, aggregate_radius: float=None, track_shoals: bool=False,
+                 spatial_reorder_every: int=None):
         """
         :param bounding_coordinates: should be tuple of tuples (x, y) listed in counterclockwise direction
             ending with the first coordinate to close path
         :param minimum_shoal_size: minimum number of fish required to be considered a shoal (used during clustering)
+        :param continuous_movement: if True fish swim to float coordinates, moving as close to their preferred move
+            as the coast and other fish allow, rather than searching the integer lattice for a free coordinate
+        :param shared_neighbour_table: if True a NeighbourTable of distances and angles between nearby fish is built
+            once per tick and shared by perception, decisions, predator counts and shoal clustering
+        :param predation: if True predators eat the prey in their repel zone before they swim (see Fish.feed)
+        :param graveyard: FishMongers that dead fish are moved to, a new one if not given
+        :param topological_neighbours: if given, each fish only considers this many of its nearest fish (still split
+            into repel, align and follow fish by distance) rather than every fish within its follow distance
+        :param aggregate_radius: if given, shoals with no predator within this distance (and no other fish in
+            sight) move as one body rather than fish by fish (see utils.aggregate.ShoalAggregator)
+        :param track_shoals: if True shoals keep the same id from tick to tick, and their births, deaths, splits
+            and merges are logged (see utils.tracking.ShoalTracker)
+        :param spatial_reorder_every: if given, every this many periods the population is reordered along a
+            Z-order curve of the fish positions (see reorder_spatially). Fish then swim, and are clustered, in a
+            different (but still deterministic) order
         """
         self.boundary = bounding_coordinates
-        self.population = []
+        self.population = Population()
         self.populated_sorted = []
         self.min_shoal_size = minimum_shoal_size
         self.sea_colour = '#006994'
         self.move_metadata = []
+        self.continuous_movement = continuous_movement
+        self.shared_neighbour_table = shared_neighbour_table
+        self.neighbour_table = None
+        self.predation = predation
+        self.graveyard = graveyard if graveyard is not None else FishMongers()
+        self.topological_neighbours = topological_neighbours
+        self.nearest_neighbours = None
+        self.aggregator = None
+        if aggregate_radius is not None:
+            from utils.aggregate import ShoalAggregator
+            self.aggregator = ShoalAggregator(self, predator_radius=aggregate_radius)
+        self.shoal_tracker = None
+        if track_shoals:
+            from utils.tracking import ShoalTracker
+            self.shoal_tracker = ShoalTracker()
+        self.spatial_reorder_every = spatial_reorder_every
+
+    def kill(self, fish, cause: str='unknown'):
+        """remove fish from the ocean (and any neighbour table) and send it to the graveyard"""
+        self.population.remove(fish)
+        if self.neighbour_table is not None:
+            self.neighbour_table.remove(fish)
+        self.graveyard.population.append(fish)
+        fish.environment = self.graveyard
+        logger.info(f'{fish.name} ({fish.unique_id}) died: {cause}. {len(self.population)} fish left')
 
     def get_fish_metadata(self):
         """
@@ -66,9 +102,10 @@ class OceanEnvironment:
         cycle through population and see whether there is a predator in each fish's
             sub env - if there is they have an incentive to move update that fish's attribute
             then update self.populated_sorted
+            (PerceptionScheduler keeps the same order incrementally rather than re-sorting)
         """
         for fsh in self.population:
-            fsh.incentive_to_move = 1
+            fsh.incentive_to_move = fsh.sub_env.count_predators() if fsh.sub_env is not None else 0
         self.populated_sorted = self._sort_population_according_to_incentive()
 
     def _sort_population_according_to_incentive(self):
@@ -84,67 +121,245 @@ class OceanEnvironment:
                 'distance_to_closest_edge': fish.dist_to_closest_edge, 'repel_fish': repel_fish,
                 'align_fish': align_fish, 'follow_fish': follow_fish}
 
+    def reorder_spatially(self):
+        """
+        reorder the population along a Z-order curve over the ocean's bounding box, so that every array built from
+            it (neighbour tables, clustering, metrics, the parallel pool's shared memory) holds nearby fish close
+            together. Unique ids, and everything recorded against them, are unchanged
+        """
+        bbox = SpatialUtils.extract_bounding_box(self.boundary)
+        self.population.reorder_spatially(origin=bbox[:2], extent=(bbox[2] - bbox[0], bbox[3] - bbox[1]))
+
     def get_ocean_metadata(self):
         # TODO something to describe ocean - particularly size
         pass
 
-    def passage_of_time(self, time_periods: int, save_filename: str):
-        def animate(i):
-            logger.info(f'\n\n time: {i} \n\n')
-            ax.set_title(f'time {i}')
-            # remove previous fish - could change this by using set_colour argument
-            for x in ax.get_children():
-                if type(x) == Line2D or type(x) == Text:
-                    # try and except is necessary to avoid removing crucial Text objects
-                    try:
-                        x.remove()
-                    except NotImplementedError:
-                        continue
-            for fsh in self.population:
-                fsh.swim()
-                ln = Line2D([fsh.previous_position[0], fsh.position[0]], [fsh.previous_position[1], fsh.position[1]],
-                            marker=fsh.custom_marker, markersize=fsh.size,  c=fsh.current_colour, linestyle='none',
-                            markevery=[1])
-
-                ax.text(fsh.position[0], fsh.position[1], f'{fsh.name}', fontsize=8)
-                # ax.text(fsh.position[0], fsh.position[1], f'{fsh.name} ({fsh.unique_id})', fontsize=6)
-                ax.add_line(ln)
-
-            population_coords = self._extract_fish_positions()
-            cluster_labels = DBSCAN(points=population_coords, eps=30, min_points=self.min_shoal_size) # TODO update eps to close to follow_distance
-            self._assign_shoals(shoal_labels=cluster_labels)
-
-        fig, ax = plt.subplots(figsize=(9, 7))
-        self._add_ocean(ax)
-
-        x_limit, y_limit = self._get_axes_limits()
-        plt.xlim(x_limit)
-        plt.ylim(y_limit)
-        ax.set_yticks([])
-        ax.set_xticks([])
-        # to update speed on animation need to play with interval and fps
-        ani = animation.FuncAnimation(fig, animate, frames=time_periods, interval=50)
-        writer = animation.writers['ffmpeg']
-        ff_writer = writer(fps=5, metadata=dict(artist='Jamie Edgecombe'))
-        ani.save(os.path.join(save_filename), writer=ff_writer)
-
-    def _add_ocean(self, axis):
-        """
-        add ocean perimeter as patch
-        :param axis: chart axis to add to
-        :return: nothing
+    def time_step(self, decision_pool=None, scheduler=None, verbose: bool=True):
+        """
+        move every fish once
+        :param decision_pool: optional ParallelDecisionPool, if given fish decide their moves in parallel
+        :param scheduler: optional PerceptionScheduler, if given fish swim in order of incentive and only rebuild
+            their surroundings when something could have changed
+        :param verbose: if False fish do not log their moves
         """
+        if decision_pool is not None:
+            self.neighbour_table = None
+            self.nearest_neighbours = None
+            decision_pool.step()
+            return
+        if self.shared_neighbour_table:
+            from utils.neighbours import NeighbourTable
+            self.neighbour_table = NeighbourTable(self.population)
+        if self.topological_neighbours is not None:
+            from utils.neighbours import NearestNeighbours
+            self.nearest_neighbours = NearestNeighbours(self.population, k=self.topological_neighbours)
+        # quiet shoals move as a body first, the fish in them do not swim individually
+        aggregated = self.aggregator.advance() if self.aggregator is not None else set()
+        if scheduler is not None:
+            scheduler.swim(verbose=verbose, skip=aggregated)
+        else:
+            for fsh in list(self.population):
+                # fish eaten earlier in the tick do not swim
+                if fsh.alive and fsh.unique_id not in aggregated:
+                    fsh.swim(verbose=verbose)
 
-        patches = []
-        poly = Polygon(self.boundary, closed=True)
-        patches.append(poly)
-        p = PatchCollection(patches, alpha=0.3, facecolors=self.sea_colour)
-        axis.add_collection(p)
+    def update_shoals(self, tick: int=None):
+        """
+        cluster the population into shoals and update each fish's shoal membership
+        :param tick: the tick being clustered, for the shoal tracker's event log
+        """
+        eps = 30  # TODO update eps to close to follow_distance
+        population_coords = self._extract_fish_positions()
+        neighbours = None
+        table = self.neighbour_table
+        if table is not None and eps <= table.reach:
+            # the table indexes fish as they were at the start of the tick, fish may have died since
+            table_index = [table.slot[fsh.unique_id] for fsh in self.population]
+            position_of = {j: k for k, j in enumerate(table_index)}
+            neighbours = lambda k: sorted(position_of[j] for j in table.within(table_index[k], eps))
+        cluster_labels = DBSCAN(points=population_coords, eps=eps, min_points=self.min_shoal_size,
+                                neighbours=neighbours)
+        if self.shoal_tracker is not None:
+            cluster_labels = self.shoal_tracker.update([fsh.unique_id for fsh in self.population], cluster_labels,
+                                                       tick=tick)
+        self._assign_shoals(shoal_labels=cluster_labels)
 
-        x_limit, y_limit = self._get_axes_limits()
+    def snapshot(self, tick: int) -> OceanSnapshot:
+        """immutable copy of the state needed to draw the ocean at this tick"""
+        return OceanSnapshot(tick=tick, fish=tuple(
+            FishSnapshot(unique_id=fsh.unique_id, name=fsh.name, previous_position=tuple(fsh.previous_position),
+                         position=tuple(fsh.position), rotation=fsh.rotation, size=fsh.size,
+                         colour=fsh.current_colour, species=fsh.species, shoal_id=fsh.shoal_id)
+            for fsh in self.population))
 
-        plt.xlim(x_limit)
-        plt.ylim(y_limit)
+    def advance(self, tick: int, decision_pool=None, periods: int=1, scheduler=None,
+                moves_per_period: int=1, metrics=None, brains=None, profiler=None, trajectory=None) -> OceanSnapshot:
+        """
+        simulate one or more periods
+        :param tick: the first period to simulate
+        :param periods: number of periods to simulate
+        :param moves_per_period: number of times every fish moves in each period. Only the last move of a period is
+            logged, clustered into shoals and made available to draw
+        :param metrics: optional ShoalMetrics, recorded after each period's shoals are assigned
+        :param brains: optional utils.brains.FishBrainDatabase, also recorded after the shoals are assigned
+        :param profiler: optional utils.memory.MemoryProfiler, given the chance to snapshot the heap after each period
+        :param trajectory: optional utils.trajectory.TrajectoryRecorder, given every period's snapshot
+        :return: snapshot of the fish after the last move, coloured by the shoals they were in before that move
+        """
+        for t in range(tick, tick + periods):
+            logger.info(f'\n\n time: {t} \n\n')
+            if self.spatial_reorder_every is not None and t % self.spatial_reorder_every == 0:
+                self.reorder_spatially()
+            # cheap inner loop - no clustering, logging or snapshots between sub-steps
+            for _ in range(moves_per_period - 1):
+                self.time_step(decision_pool=decision_pool, scheduler=scheduler, verbose=False)
+            self.time_step(decision_pool=decision_pool, scheduler=scheduler)
+            snapshot = self.snapshot(t) if t == tick + periods - 1 or trajectory is not None else None
+            if trajectory is not None:
+                trajectory.record(snapshot)
+            self.update_shoals(tick=t)
+            if metrics is not None:
+                metrics.record(t, self.population)
+            if brains is not None:
+                brains.record(t, self.population)
+            if profiler is not None:
+                profiler.record(t)
+        return snapshot
+
+    def passage_of_time(self, time_periods: int, save_filename: str, parallel_workers: int=0,
+                        pipeline_depth: int=0, render_every: int=1, render_budget: float=None, fps: int=5,
+                        lazy_perception: bool=False, moves_per_period: int=1, metrics_directory: str=None,
+                        renderer: str='matplotlib', labelled_fish: tuple=(), brain_database: str=None,
+                        memory_profile_every: int=None, interpolated_frames: int=0, trajectory_directory: str=None):
+        """
+        simulate and animate the ocean
+        :param time_periods: number of periods to simulate
+        :param save_filename: where to save the animation
+        :param parallel_workers: if > 0, fish decide their moves in this many worker processes
+            (see utils.parallel.ParallelDecisionPool) instead of swimming one after another
+        :param pipeline_depth: if > 0, the simulation runs ahead on a background thread and up to this many
+            snapshots are queued for the renderer (see utils.pipeline.SimulationPipeline), otherwise each frame is
+            simulated then drawn in turn
+        :param render_every: every period is simulated but only every render_every-th period becomes a frame
+        :param render_budget: target wall clock seconds for rendering the video. If given, render_every is
+            ignored: it is first estimated from the cost of drawing the starting ocean, then widened as the video is
+            drawn whenever the frames drawn so far say rendering would overrun the budget (see
+            utils.pipeline.RenderSchedule). Either way, the period shown by each frame drawn is written to
+            <save_filename without extension>_frames.txt
+        :param fps: frames per second of the saved video
+        :param lazy_perception: if True, fish swim through a PerceptionScheduler (see utils.scheduler) which skips
+            rebuilding the surroundings of fish that cannot have seen anything change
+        :param moves_per_period: number of times every fish moves between periods (see advance)
+        :param metrics_directory: if given, shoal metrics for every period are streamed to this directory
+            (see utils.metrics.ShoalMetrics), along with the shoal tracker's events if shoals are tracked
+        :param renderer: 'matplotlib' (utils.render.MatplotlibRenderer, every fish labelled) or 'raster'
+            (utils.raster.RasterRenderer, draws straight into pixel arrays - for populations too large for matplotlib)
+        :param labelled_fish: raster renderer only, unique ids of the fish to label
+        :param brain_database: if given, the state of every fish and the fish it can see are written to this SQLite
+            file every period (see utils.brains.FishBrainDatabase)
+        :param memory_profile_every: if given, the heap is traced and every this many periods a report of the largest
+            allocations and the sizes of growing structures is added to <save_filename without extension>_memory.txt
+            (see utils.memory.MemoryProfiler). Tracing slows the simulation down
+        :param interpolated_frames: in-between frames drawn between each pair of simulated frames, with fish moved
+            and turned part of the way (see utils.interpolation). fps is multiplied by interpolated_frames + 1, so
+            the video is smoother but plays at the same speed, without simulating any more periods
+        :param trajectory_directory: if given, every period's snapshot is streamed to this directory so that the run
+            can be drawn again without simulating it (see utils.trajectory)
+        """
+        def advance_frame(frame: int) -> OceanSnapshot:
+            # frames are simulated in order, the schedule says which periods come next
+            planned = schedule.next_frame()
+            if planned is None:
+                return None
+            first_tick, periods = planned
+            return self.advance(first_tick, decision_pool=decision_pool, periods=periods, scheduler=scheduler,
+                                moves_per_period=moves_per_period, metrics=metrics, brains=brains, profiler=profiler,
+                                trajectory=trajectory)
+
+        def simulate_frames():
+            for frame in range(frames):
+                snapshot = advance_frame(frame)
+                if snapshot is None:
+                    return
+                yield snapshot
+
+        renderer = make_renderer(self, renderer, labelled_fish=labelled_fish)
+
+        seconds_per_frame = None
+        if render_budget is not None:
+            # in-between frames cost as much to draw as simulated ones
+            seconds_per_frame = renderer.frame_seconds(self.snapshot(0)) * (interpolated_frames + 1)
+        schedule = RenderSchedule(time_periods, render_every=render_every, render_budget=render_budget,
+                                  seconds_per_frame=seconds_per_frame)
+        frames = schedule.frames
+        metadata = dict(artist='Jamie Edgecombe',
+                        comment=f'periods={time_periods} {schedule.describe()} '
+                                f'render_budget={render_budget} interpolated_frames={interpolated_frames}')
+
+        metrics = None
+        if metrics_directory is not None:
+            from utils.metrics import ShoalMetrics
+            metrics = ShoalMetrics(metrics_directory)
+        brains = None
+        if brain_database is not None:
+            from utils.brains import FishBrainDatabase
+            brains = FishBrainDatabase(brain_database)
+        trajectory = None
+        if trajectory_directory is not None:
+            from utils.trajectory import TrajectoryRecorder
+            trajectory = TrajectoryRecorder(trajectory_directory)
+        profiler = None
+        if memory_profile_every is not None:
+            from utils.memory import MemoryProfiler
+            profiler = MemoryProfiler(self, f'{os.path.splitext(save_filename)[0]}_memory.txt',
+                                      every=memory_profile_every, renderer=renderer)
+            profiler.start()
+        scheduler = None
+        if lazy_perception:
+            from utils.scheduler import PerceptionScheduler
+            scheduler = PerceptionScheduler(self)
+        decision_pool = None
+        if parallel_workers > 0:
+            from utils.parallel import ParallelDecisionPool
+            decision_pool = ParallelDecisionPool(self, workers=parallel_workers)
+            decision_pool.start()
+        pipeline = None
+        if pipeline_depth > 0:
+            pipeline = SimulationPipeline(advance_frame, frames=frames, max_queued_frames=pipeline_depth)
+            snapshots = schedule.timed(pipeline)
+        else:
+            # each frame is simulated as the renderer asks for it
+            snapshots = schedule.timed(simulate_frames())
+        # frames is the most there will be, a budget can leave fewer
+        video_frames = frames
+        if interpolated_frames > 0:
+            from utils.interpolation import interpolate_snapshots, interpolated_frame_count
+            snapshots = interpolate_snapshots(snapshots, between=interpolated_frames)
+            video_frames = interpolated_frame_count(frames, interpolated_frames)
+
+        try:
+            if pipeline is not None:
+                pipeline.start()
+            renderer.save(snapshots, frames=video_frames, save_filename=save_filename,
+                          fps=fps * (interpolated_frames + 1), metadata=metadata)
+            schedule.write_frames(f'{os.path.splitext(save_filename)[0]}_frames.txt',
+                                  interpolated_frames=interpolated_frames)
+        finally:
+            if pipeline is not None:
+                pipeline.close()
+            if decision_pool is not None:
+                decision_pool.close()
+            if metrics is not None:
+                metrics.close()
+                if self.shoal_tracker is not None:
+                    self.shoal_tracker.write(os.path.join(metrics_directory, 'shoal_events'))
+            if brains is not None:
+                brains.close()
+            if profiler is not None:
+                profiler.close()
+            if trajectory is not None:
+                trajectory.close()
+            renderer.close()
 
     def _get_axes_limits(self, buffer: float=0.1):
         """
@@ -166,6 +381,22 @@ class OceanEnvironment:
         return x_limit, y_limit
 
 
+def make_renderer(ocean, renderer: str, labelled_fish: tuple=()):
+    """
+    :param ocean: the ocean to be drawn, anything with a boundary, sea_colour and _get_axes_limits
+    :param renderer: 'matplotlib' (utils.render.MatplotlibRenderer) or 'raster' (utils.raster.RasterRenderer)
+    :param labelled_fish: raster renderer only, unique ids of the fish to label
+    """
+    # rendering (and matplotlib) is only loaded when a video is made
+    if renderer == 'matplotlib':
+        from utils.render import MatplotlibRenderer
+        return MatplotlibRenderer(ocean)
+    if renderer == 'raster':
+        from utils.raster import RasterRenderer
+        return RasterRenderer(ocean, labelled_fish=labelled_fish)
+    raise ValueError(f'unknown renderer: {renderer}')
+
+
 class FishMongers:
     def __init__(self):
         self.population = []
@@ -2,50 +2,36 @@ import logging
 import math
 import random
 
-import matplotlib as mpl
-from matplotlib.path import Path
-import matplotlib.pyplot as plt
 import numpy as np
-from scipy import ndimage
 
 from utils.environ import OceanEnvironment, FishMongers
+from utils.kernels import nearest_valid_cell
 from utils.positioning import NearbyWaters
 from utils.spatial_utils import SpatialUtils
+from utils.species import SpeciesProfile
 
 logger = logging.getLogger(__name__)
 
 
 class Fish:
-    def __init__(self, name_options: list, eats_fish: tuple=(), size=1, colour='white', cluster_colour='black',
-                 max_movement_radius=0,
-                 repel_dist=0, align_dist=0, follow_dist=0):
+    __slots__ = ('environment', 'slot', 'unique_id', 'current_colour', 'age', 'name', 'shoal_id', 'position',
+                 'previous_position', 'rotation', 'dist_to_closest_edge', 'sub_env', 'incentive_to_move', 'memory')
+    species = SpeciesProfile(name='fish', marker_vertices=((0., 0.), (0., 0.)))
+
+    def __init__(self, name_options: list):
         """
-        :param eats_fish: the type of fish that this fish can eat
-        :param size: the size of this fish
-        :param colour: colour of fish when not in shoal
-        :param cluster_colour: colour of fish when in shoal
-        :param max_movement_radius: how far this fish can move in a single turn
-        :param repel_dist: the max distance which the focal fish believes is too close to other fish
-        :param align_dist: within this distance (and greater than repel distance), the focal fish will want to
-            align with other fish of the same species
-        :param follow_dist: within this distance (and greater than the align distance), the focal fish will want to
-            get closer to other fish of the same species
+        characteristics shared by every fish of a species (size, distances, colours, marker) live on the class's
+            species profile, each fish only holds its own state
+        :param name_options: names to pick this fish's name from
         """
 
-        # ocean data
-        self.environment = OceanEnvironment(bounding_coordinates=(), minimum_shoal_size=2)
+        # ocean data, set once the fish is placed (see make_it_rain)
+        self.environment = None
+        self.slot = None  # slot in the ocean's Population while alive
 
         # fish characteristics
         self.unique_id = None
-        self.colour = colour
-        self.cluster_colour = cluster_colour
-        self.current_colour = self.colour
-        self.eats_fish = eats_fish  # preys on these fish species
-        self.size = size
-        self.repel_distance = repel_dist  # less than this distance focal fish will swim away to avoid collision
-        self.align_distance = align_dist  # focal fish will seek to align direction with neighbours
-        self.follow_distance = follow_dist  # focal fish will move towards a neighbour
-        self.max_movement_radius = max_movement_radius
+        self.current_colour = self.species.colour
         self.age = 0
         self.name = random.choice(name_options)
         self.shoal_id = None
@@ -65,10 +51,59 @@ class Fish:
         # memory of what has gone before
         self.memory = []
 
+    @property
+    def alive(self) -> bool:
+        """True while the fish is in an ocean"""
+        return self.slot is not None
+
+    @property
+    def colour(self):
+        """colour of fish when not in shoal"""
+        return self.species.colour
+
+    @property
+    def cluster_colour(self):
+        """colour of fish when in shoal"""
+        return self.species.cluster_colour
+
+    @property
+    def eats_fish(self) -> tuple:
+        """the type of fish that this fish can eat"""
+        return self.species.eats_fish
+
+    @property
+    def size(self):
+        return self.species.size
+
+    @property
+    def repel_distance(self):
+        """less than this distance focal fish will swim away to avoid collision"""
+        return self.species.repel_distance
+
+    @property
+    def align_distance(self):
+        """focal fish will seek to align direction with neighbours"""
+        return self.species.align_distance
+
+    @property
+    def follow_distance(self):
+        """focal fish will move towards a neighbour"""
+        return self.species.follow_distance
+
+    @property
+    def max_movement_radius(self):
+        """how far this fish can move in a single turn"""
+        return self.species.max_movement_radius
+
+    @property
+    def custom_marker(self):
+        """marker facing the fish's rotation, shared with every fish of the species facing (about) the same way"""
+        return self.species.marker(self.rotation)
+
     def make_it_rain(self, ocean: OceanEnvironment, graveyard: FishMongers, initial_position: tuple=None,
                      place_attempts: int=3):
         """aim to add to ocean"""
-        self.unique_id = len(ocean.population) + len(graveyard.population)
+        self.unique_id = ocean.population.issue_id()
         self.position = self.set_pos(place_attempts, ocean) if initial_position is None else initial_position
         # previous_position = position initially as there is no previous position
         self.previous_position = self.position
@@ -109,82 +144,123 @@ class Fish:
     def distance_to_boundary(self):
         return SpatialUtils.distance_to_boundary(self.position, self.environment.boundary)
 
-    def swim(self, max_move_attempts: int=30) -> None:
-        def create_move_options(central_coordinate: list, shift_num: int) -> list:
-            """creates four coordinates around a central coordinate - above, below, left, right"""
-            return [[central_coordinate[0], central_coordinate[1] + shift_num],
-                    [central_coordinate[0], central_coordinate[1] - shift_num],
-                    [central_coordinate[0] + shift_num, central_coordinate[1]],
-                    [central_coordinate[0] - shift_num, central_coordinate[1]]]
-
+    def swim(self, max_move_attempts: int=30, sub_env: NearbyWaters=None, verbose: bool=True) -> None:
+        """
+        decide where to move and move there
+        :param max_move_attempts: how far from the preferred move to look for a free coordinate before giving up
+        :param sub_env: up to date knowledge of surroundings, if None it is rebuilt from the ocean
+        :param verbose: if False nothing is logged (and no log messages are built), for fast inner loops
+        """
         # becomes aware of environment
-        self.update_nearby_waters()
+        if sub_env is None:
+            self.update_nearby_waters()
+        else:
+            self.sub_env = sub_env
+        if self.environment.predation and self.eats_fish:
+            eaten = self.feed(self.sub_env.repel_fish)
+            if eaten:
+                self.sub_env.forget(eaten)
         preferred_alignment = None  # unless overwritten alignment to be decided based on movement direction
         # only move if it has somewhere it can go else stay in the same location
-        if len(self.sub_env.available_moves) == 0:
-            logger.debug(f'{self.name} ({self.unique_id}) could not move so just chilled at: {self.position}')
+        # (continuous movement does not enumerate moves, whether it can go anywhere is found when gliding)
+        if self.sub_env.available_moves is not None and len(self.sub_env.available_moves) == 0:
+            if verbose:
+                logger.debug(f'{self.name} ({self.unique_id}) could not move so just chilled at: {self.position}')
             move_description = 'stuck'
             preferred_move = self.position
         # if it can move, find it's preferred move
         elif len(self.sub_env.repel_fish) > 0:
-            repel_fish = self.sub_env.extract_nearby_fish_names(self.sub_env.repel_fish)
             preferred_move = self._move_repel()
             move_description = 'repel'
-            logger.debug(f'{self.name} ({self.unique_id}) panicked and tried to swim away from: {repel_fish}')
+            if verbose:
+                repel_fish = self.sub_env.extract_nearby_fish_names(self.sub_env.repel_fish)
+                logger.debug(f'{self.name} ({self.unique_id}) panicked and tried to swim away from: {repel_fish}')
         elif len(self.sub_env.align_fish) > 0:
-            align_fish = self.sub_env.extract_nearby_fish_names(self.sub_env.align_fish)
             preferred_move, preferred_alignment = self._move_align()
             move_description = 'align'
-            logger.debug(f'{self.name} ({self.unique_id}) wants to align with: {align_fish}')
+            if verbose:
+                align_fish = self.sub_env.extract_nearby_fish_names(self.sub_env.align_fish)
+                logger.debug(f'{self.name} ({self.unique_id}) wants to align with: {align_fish}')
         elif len(self.sub_env.follow_fish) > 0:
-            follow_fish = self.sub_env.extract_nearby_fish_names(self.sub_env.follow_fish)
             preferred_move = self._move_follow()
             move_description = 'follow'
-            logger.debug(f'{self.name} ({self.unique_id}) wants to follow: {follow_fish}')
+            if verbose:
+                follow_fish = self.sub_env.extract_nearby_fish_names(self.sub_env.follow_fish)
+                logger.debug(f'{self.name} ({self.unique_id}) wants to follow: {follow_fish}')
         else:
             preferred_move = self._move_random()
             move_description = 'random'
-            logger.debug(f'{self.name} ({self.unique_id}) could not see other fish so moved randomly')
-
-        # round to integer coordinate
-        preferred_move_rounded = [int(preferred_move[0]), int(preferred_move[1])]
-
-        # try a maximum of n shift attempts
-        # can fish move where it wants to? If it can't try a move nearby
-        for shift_attempt in range(max_move_attempts):
-            move_options = create_move_options(preferred_move_rounded, shift_attempt)
-            # loop through move options randomly choosing each time (thereby keeping element of randomness)
-            move_to_try = random.choice(move_options)
-            move_options.remove(move_to_try)
-            # choose if this move is available
-            avail = self.sub_env.available_moves
-            if move_to_try in self.sub_env.available_moves:
-                movement_direction = SpatialUtils.calc_angle(self.position, move_to_try)
-                rotation = movement_direction if preferred_alignment is None else preferred_alignment
-                self.previous_position = self.position
-                self.position = move_to_try
-                self.age += 1
-                break
+            if verbose:
+                logger.debug(f'{self.name} ({self.unique_id}) could not see other fish so moved randomly')
+
+        new_position = None
+        lookups = 0
+        if self.environment.continuous_movement:
+            if move_description != 'stuck':
+                new_position = self._glide_target(preferred_move)
+        elif move_description != 'stuck':
+            # round to integer coordinate
+            preferred_move_rounded = (int(preferred_move[0]), int(preferred_move[1]))
+
+            # can fish move where it wants to? If it can't, take the nearest available coordinate to it
+            # (ties broken at random, thereby keeping element of randomness)
+            # coordinates closer than this to the preferred move are out of the fish's range
+            out_of_range = SpatialUtils.calc_distance(preferred_move_rounded, self.position) - \
+                self.max_movement_radius
+            new_position, lookups = nearest_valid_cell(preferred_move_rounded,
+                                                       is_valid=self.sub_env.available_move_set.__contains__,
+                                                       max_distance=max_move_attempts, min_distance=out_of_range)
+            if new_position is not None:
+                new_position = [new_position[0], new_position[1]]
+
+        if new_position is not None:
+            movement_direction = SpatialUtils.calc_angle(self.position, new_position)
+            rotation = movement_direction if preferred_alignment is None else preferred_alignment
+            self.previous_position = self.position
+            self.position = new_position
+            self.age += 1
         else:
-            logger.debug(f'{self.name} ({self.unique_id}) could not find anywhere to move so chilled out')
             rotation = self.rotation
             self.previous_position = self.position
-            move_description = 'moves available but stuck'
-            logger.debug('available moves: ')
+            if move_description != 'stuck':
+                move_description = 'moves available but stuck'
+            if verbose:
+                logger.debug(f'{self.name} ({self.unique_id}) could not find anywhere to move so chilled out')
 
         dist = SpatialUtils.calc_distance(self.position, self.previous_position)
 
-        logger.debug(f'{self.name} ({self.unique_id}) move description: \n'
-                     f' primary motivation: {move_description} \n'
-                     f' move choice: ({shift_attempt + 1} / {max_move_attempts}) \n'
-                     f' moved from: {self.previous_position} to {self.position} (distance = {dist}) \n'
-                     f' rotation from: {round(self.rotation, 0)} to {round(rotation, 0)} \n'
-                     f' new shoal id: {self.shoal_id}')
+        if verbose:
+            logger.debug(f'{self.name} ({self.unique_id}) move description: \n'
+                         f' primary motivation: {move_description} \n'
+                         f' coordinates looked up: {lookups} \n'
+                         f' moved from: {self.previous_position} to {self.position} (distance = {dist}) \n'
+                         f' rotation from: {round(self.rotation, 0)} to {round(rotation, 0)} \n'
+                         f' new shoal id: {self.shoal_id}')
         self.create_memory(move_description=move_description, new_rotation=rotation,
                            move_distance=dist)
         self.rotation = self._update_rotation(rotation)
+        if self.sub_env.table is not None:
+            self.sub_env.table.move(self)
 
-    def create_memory(self, move_description, new_rotation, move_distance):
+    def feed(self, nearby_fish: list) -> list:
+        """
+        eat any prey among nearby_fish, which should be the fish in this fish's repel zone
+        :return: the fish eaten
+        """
+        eaten = []
+        for other_fish in nearby_fish:
+            if type(other_fish) in self.eats_fish and other_fish.alive:
+                self.environment.kill(other_fish, cause=f'eaten by {self.name} ({self.unique_id})')
+                eaten.append(other_fish)
+        return eaten
+
+    def create_memory(self, move_description, new_rotation, move_distance, repel_fish: list=None,
+                      align_fish: list=None, follow_fish: list=None, predators_seen: int=None):
+        """
+        record the move just made. Nearby fish and the number of predators in sight default to those of the fish's
+            sub environment, pass them in when the move was decided elsewhere (e.g. by a ParallelDecisionPool
+            worker)
+        """
         memory = {
             'move_descr': move_description,
             'position_pre': self.previous_position,
@@ -194,15 +270,15 @@ class Fish:
             'rotation_post': new_rotation,
             'shoal_id': self.shoal_id,
             'age': self.age,
-            'follow_fish': self.sub_env.follow_fish,
-            'align_fish': self.sub_env.align_fish,
-            'repel_fish': self.sub_env.repel_fish,
+            'predators_seen': self.sub_env.predator_count if predators_seen is None else predators_seen,
+            'follow_fish': self.sub_env.follow_fish if follow_fish is None else follow_fish,
+            'align_fish': self.sub_env.align_fish if align_fish is None else align_fish,
+            'repel_fish': self.sub_env.repel_fish if repel_fish is None else repel_fish,
         }
         self.memory.append(memory)
 
     def _update_rotation(self, target_degrees: float):
-        # """update degrees so that 0 degrees is facing upwards"""
-        self.custom_marker = self.custom_marker.transformed(mpl.transforms.Affine2D().rotate_deg(target_degrees))
+        """rotated markers come from the species profile, so only the angle needs keeping"""
         return target_degrees
 
     def _move_repel(self) -> float:
@@ -211,8 +287,7 @@ class Fish:
             calculate the ideal location for the fish to move based on the above angle and max travel distance
         :return: the optimal location to move to, note that this location may not be available (e.g. occupied)
         """
-        dir_to_fish = np.mean([SpatialUtils.calc_angle(self.position, other_fish.position) for other_fish in
-                               self.sub_env.repel_fish]).item()
+        dir_to_fish = np.mean([self.sub_env.angle_to(other_fish) for other_fish in self.sub_env.repel_fish]).item()
         opposite_dir = dir_to_fish - 180  # move away from close fish
         optimal_move = SpatialUtils.new_position_angle_length(starting_coordinates=self.position, angle=opposite_dir,
                                                               distance=self.max_movement_radius)
@@ -222,8 +297,7 @@ class Fish:
         # if want to align, stay in same location, just change rotation to match that of average rotation of group
         new_rotation = np.mean([x.rotation for x in self.sub_env.align_fish]).item()
 
-        dist_to_closest = np.min([SpatialUtils.calc_distance(self.position, other_fish.position) for other_fish in
-                                  self.sub_env.align_fish])
+        dist_to_closest = np.min([self.sub_env.distance_to(other_fish) for other_fish in self.sub_env.align_fish])
         # aim to move some distance between the repel and align distance from the nearest fish
         # use random choice from 4 intervals in this range
         move_dist = random.choice(
@@ -239,9 +313,8 @@ class Fish:
             follow fish
         :return: the optimal location to move to, note that this location may not be available (e.g. occupied)
         """
-        dir_to_fish = np.mean([SpatialUtils.calc_angle(self.position, other_fish.position) for other_fish in
-                               self.sub_env.follow_fish]).item()
-        dist_to_closest = np.min([SpatialUtils.calc_distance(self.position, other_fish.position) for other_fish in
+        dir_to_fish = np.mean([self.sub_env.angle_to(other_fish) for other_fish in self.sub_env.follow_fish]).item()
+        dist_to_closest = np.min([self.sub_env.distance_to(other_fish) for other_fish in
                                   self.sub_env.follow_fish]).item()
         # aim to move some distance between the repel and align distance from the nearest fish
         # use random choice from 4 intervals in this range
@@ -257,10 +330,56 @@ class Fish:
         aim to move randomly among the moves within the range of the fish
         :return: the optimal location to move to, note that this location may not be available (e.g. occupied)
         """
+        if self.sub_env.available_moves is None:
+            # continuous movement - uniformly random point within range
+            distance = self.max_movement_radius * math.sqrt(random.random())
+            return SpatialUtils.new_position_angle_length(starting_coordinates=self.position,
+                                                          angle=random.uniform(0, 360), distance=distance)
         random_position = random.choice(self.sub_env.available_moves)
 
         return random_position
 
+    def _glide_target(self, preferred_move, edge_clearance: float=0.001):
+        """
+        continuous movement - move as close to the preferred location as possible without a lattice search:
+            limit the move to the fish's range, push the target out of any nearby fish then back inside the coast
+        :param preferred_move: where the fish would like to be
+        :param edge_clearance: how far inside the coastline a fish pushed back from it ends up
+        :return: float coordinates to move to, or None if the fish cannot move
+        """
+        target = self._clamp_to_range(preferred_move)
+        space_necessary = self.size / 2
+        for other_fish in self.sub_env.all_nearby_fish:
+            gap = SpatialUtils.calc_distance(target, other_fish.position)
+            if gap < space_necessary:
+                # push directly away from the other fish, or back towards the start if exactly on top of it
+                angle = SpatialUtils.calc_angle(other_fish.position, target if gap > 0 else self.position)
+                target = SpatialUtils.new_position_angle_length(starting_coordinates=other_fish.position,
+                                                                angle=angle, distance=space_necessary)
+        if not SpatialUtils.poly_contains_point(coordinates=target, polygon=self.environment.boundary,
+                                                method='winding'):
+            target = SpatialUtils.project_inside_polygon(target, self.environment.boundary,
+                                                         clearance=edge_clearance)
+        target = self._clamp_to_range(target)
+
+        # projections can undo each other in tight corners - only move if the final target is valid
+        if not SpatialUtils.poly_contains_point(coordinates=target, polygon=self.environment.boundary,
+                                                method='winding'):
+            return None
+        for other_fish in self.sub_env.all_nearby_fish:
+            if SpatialUtils.calc_distance(target, other_fish.position) < space_necessary:
+                return None
+        return [float(target[0]), float(target[1])]
+
+    def _clamp_to_range(self, coordinates) -> tuple:
+        """shorten a move to the fish's maximum movement radius, keeping its direction"""
+        distance = math.hypot(coordinates[0] - self.position[0], coordinates[1] - self.position[1])
+        if distance <= self.max_movement_radius:
+            return coordinates[0], coordinates[1]
+        scale = self.max_movement_radius / distance
+        return (self.position[0] + (coordinates[0] - self.position[0]) * scale,
+                self.position[1] + (coordinates[1] - self.position[1]) * scale)
+
 
 # class Predator(Fish):
 #     def __init__(self, environment: OceanEnvironment):
@@ -268,10 +387,11 @@ class Fish:
 
 
 class Snapper(Fish):
-    def __init__(self, name_options: list):
-        super().__init__(size=10, max_movement_radius=10, repel_dist=2, colour='#fcba76', cluster_colour='#FF8100',
-                         align_dist=5, follow_dist=30, eats_fish=(), name_options=name_options)
-        verts = [
+    __slots__ = ()
+    species = SpeciesProfile(
+        name='snapper', size=10, max_movement_radius=10, repel_dist=2, colour='#fcba76', cluster_colour='#FF8100',
+        align_dist=5, follow_dist=30, eats_fish=(),
+        marker_vertices=(
             (-5., -4.),  # left, bottom of tail
             (-2., -1.),  # left, top of tail
             (-4., 3.),  # leftmost part of head
@@ -280,24 +400,15 @@ class Snapper(Fish):
             (2., -1.),  # right, top of tail
             (5., -4.),  # right, bottom of tail
             (0., 0.),  # ignored - incl. for close poly arg
-        ]
-
-        codes = [Path.MOVETO,
-                 Path.LINETO,
-                 Path.LINETO,
-                 Path.LINETO,
-                 Path.LINETO,
-                 Path.LINETO,
-                 Path.LINETO,
-                 Path.CLOSEPOLY]
-        self.custom_marker = Path(verts, codes)
+        ))
 
 
 class Shark(Fish):
-    def __init__(self, name_options: list):
-        super().__init__(size=30, max_movement_radius=20, repel_dist=1, colour='#D1D7D7', cluster_colour='#8C9B9B',
-                         align_dist=3, follow_dist=15, eats_fish=(Snapper, ), name_options=name_options)
-        verts = [
+    __slots__ = ()
+    species = SpeciesProfile(
+        name='shark', size=30, max_movement_radius=20, repel_dist=1, colour='#D1D7D7', cluster_colour='#8C9B9B',
+        align_dist=3, follow_dist=15, eats_fish=(Snapper, ),
+        marker_vertices=(
             (-4., -7.),  # left, bottom of tail
             (-1., -1.),  # left, top of tail
             (-3., 3.),  # leftmost part of head
@@ -306,14 +417,4 @@ class Shark(Fish):
             (1., -1.),  # right, top of tail
             (4., -7.),  # right, bottom of tail
             (0., 0.),  # ignored - incl. for close poly arg
-        ]
-
-        codes = [Path.MOVETO,
-                 Path.LINETO,
-                 Path.LINETO,
-                 Path.LINETO,
-                 Path.LINETO,
-                 Path.LINETO,
-                 Path.LINETO,
-                 Path.CLOSEPOLY]
-        self.custom_marker = Path(verts, codes)
+        ))
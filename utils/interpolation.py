@@ -0,0 +1,79 @@
+import logging
+
+import numpy as np
+
+from utils.pipeline import OceanSnapshot
+
+logger = logging.getLogger(__name__)
+
+"""
+in-between frames drawn from consecutive snapshots, so that a video can be smooth without simulating more ticks
+"""
+
+
+def shortest_arc(start, end, fraction: float):
+    """
+    rotation (degrees) fraction of the way from start to end, turning whichever way round is shorter
+    :param start: degrees, a number or array
+    :param end: degrees, same shape as start
+    """
+    turn = (end - start + 180) % 360 - 180
+    return start + turn * fraction
+
+
+def tween(first: OceanSnapshot, second: OceanSnapshot, fraction: float, previous_fraction: float=0,
+          wrap: tuple=None) -> OceanSnapshot:
+    """
+    the ocean fraction of the way from first to second. Fish move in straight lines and turn the short way round,
+        while their colour and shoal are those of first until second is reached. Fish that are not in second (they
+        died in between) stay where they were, fish that are only in second appear with it
+    :param previous_fraction: fraction of the previous frame drawn, each fish's previous_position is where it was
+        then
+    :param wrap: (origin, extent) of a world whose opposite edges are joined, so fish move the short way around it
+    :return: snapshot with a fractional tick
+    """
+    if not first.fish:
+        return OceanSnapshot(tick=round(first.tick + (second.tick - first.tick) * fraction, 2), fish=())
+    after = {fsh.unique_id: fsh for fsh in second.fish}
+    ends = [after.get(fsh.unique_id, fsh) for fsh in first.fish]
+    start = np.array([fsh.position for fsh in first.fish], dtype=float).reshape(-1, 2)
+    step = np.array([fsh.position for fsh in ends], dtype=float).reshape(-1, 2) - start
+    start_rotation = np.array([fsh.rotation for fsh in first.fish], dtype=float)
+    end_rotation = np.array([fsh.rotation for fsh in ends], dtype=float)
+    if wrap is not None:
+        origin, extent = (np.asarray(x, dtype=float) for x in wrap)
+        step -= extent * np.round(step / extent)
+
+    def at(fraction):
+        position = start + step * fraction
+        if wrap is not None:
+            position = origin + np.mod(position - origin, extent)
+        return position.tolist()
+
+    positions, previous_positions = at(fraction), at(previous_fraction)
+    rotations = shortest_arc(start_rotation, end_rotation, fraction).tolist()
+    fish = tuple(fsh._replace(previous_position=tuple(previous), position=tuple(position), rotation=rotation)
+                 for fsh, previous, position, rotation in zip(first.fish, previous_positions, positions, rotations))
+    return OceanSnapshot(tick=round(first.tick + (second.tick - first.tick) * fraction, 2), fish=fish)
+
+
+def interpolate_snapshots(snapshots, between: int, wrap: tuple=None):
+    """
+    yield every snapshot with between in-between frames (see tween) after each but the last, evenly spaced
+    :param snapshots: iterable of OceanSnapshots in tick order, consumed one at a time
+    :param between: in-between frames per pair of snapshots, 0 to yield the snapshots unchanged
+    :param wrap: see tween
+    """
+    previous = None
+    for snapshot in snapshots:
+        if previous is not None:
+            for k in range(1, between + 1):
+                yield tween(previous, snapshot, k / (between + 1), previous_fraction=(k - 1) / (between + 1),
+                            wrap=wrap)
+        yield snapshot
+        previous = snapshot
+
+
+def interpolated_frame_count(frames: int, between: int) -> int:
+    """number of frames interpolate_snapshots yields for frames snapshots"""
+    return frames + max(frames - 1, 0) * between
@@ -0,0 +1,168 @@
+import functools
+import math
+import random
+
+import numpy as np
+
+from utils.spatial_utils import SpatialUtils
+
+"""
+array versions of the decisions made in Fish.swim / NearbyWaters, working on population arrays rather than Fish
+    objects so that they can run outside of the main process
+"""
+
+MOVE_RANDOM = 0
+MOVE_REPEL = 1
+MOVE_ALIGN = 2
+MOVE_FOLLOW = 3
+MOVE_STUCK = 4
+MOVE_DESCRIPTIONS = ('random', 'repel', 'align', 'follow', 'stuck')
+
+NEIGHBOUR_REPEL = 1
+NEIGHBOUR_ALIGN = 2
+NEIGHBOUR_FOLLOW = 3
+
+
+@functools.lru_cache(maxsize=None)
+def disc_offsets(radius: float) -> np.ndarray:
+    """
+    integer offsets (from point 0, 0) within a fish's maximum movement radius, same points as
+        NearbyWaters.find_moves_within_max_range
+    :param radius: maximum movement radius
+    :return: array of shape (k, 2)
+    """
+    search_range = np.arange(start=-radius, stop=radius + 0.001, step=1)
+    xx, yy = np.meshgrid(search_range, search_range, indexing='ij')
+    offsets = np.column_stack([xx.ravel(), yy.ravel()])
+    dist_to_centre = np.round(np.hypot(offsets[:, 0], offsets[:, 1]), 4)
+    offsets = offsets[dist_to_centre <= radius]
+    offsets.setflags(write=False)
+    return offsets
+
+
+def classify_neighbours(focal: int, others: np.ndarray, distances: np.ndarray, size: np.ndarray,
+                        repel: np.ndarray, align: np.ndarray, follow: np.ndarray, species: np.ndarray) -> tuple:
+    """
+    split the fish near a focal fish into repel, align and follow fish, as in NearbyWaters.find_nearby_fish
+    :param focal: index of the focal fish
+    :param others: indices of candidate neighbours (must not include the focal fish)
+    :param distances: distance from the focal fish to each candidate, rounded to 4 d.p.
+    :return: index arrays: repel fish, align fish, follow fish
+    """
+    adjusted = distances - size[focal]
+    same_species = species[others] == species[focal]
+    repel_mask = adjusted <= repel[focal]
+    align_mask = ~repel_mask & same_species & (adjusted <= align[focal])
+    follow_mask = ~repel_mask & ~align_mask & same_species & (adjusted <= follow[focal])
+    return others[repel_mask], others[align_mask], others[follow_mask]
+
+
+def empty_cells(focal: int, position: np.ndarray, size: np.ndarray, radius: np.ndarray, nearby: np.ndarray,
+                boundary: tuple) -> np.ndarray:
+    """
+    lattice points within movement radius of the focal fish that are in the ocean and clear of nearby fish
+    :param nearby: indices of all fish near the focal fish
+    :return: array of shape (k, 2)
+    """
+    cells = disc_offsets(float(radius[focal])) + position[focal]
+    cells = cells[SpatialUtils.poly_contains_points(cells, boundary)]
+    if len(nearby) and len(cells):
+        gaps = np.round(np.hypot(cells[:, None, 0] - position[nearby, 0][None, :],
+                                 cells[:, None, 1] - position[nearby, 1][None, :]), 4)
+        cells = cells[(gaps >= size[focal] / 2).all(axis=1)]
+    return cells
+
+
+def _move_distance(dist_to_closest: float, align_dist: float, repel_dist: float, stop_pad: float,
+                   rng: np.random.Generator) -> float:
+    """random choice from 4 unit intervals between the repel and align distance from the nearest fish"""
+    options = np.arange(dist_to_closest - align_dist, dist_to_closest - repel_dist + stop_pad, step=4)
+    return float(options[rng.integers(len(options))])
+
+
+def _along(start: np.ndarray, angle: float, distance: float) -> tuple:
+    return (start[0] + math.cos(math.radians(angle)) * distance,
+            start[1] + math.sin(math.radians(angle)) * distance)
+
+
+def decide_move(focal: int, position: np.ndarray, rotation: np.ndarray, size: np.ndarray, repel: np.ndarray,
+                align: np.ndarray, radius: np.ndarray, repel_fish: np.ndarray, align_fish: np.ndarray,
+                follow_fish: np.ndarray, boundary: tuple, rng: np.random.Generator) -> tuple:
+    """
+    choose the preferred move of one fish, following the same order of motivations as Fish.swim
+        (repel, then align, then follow, otherwise random)
+    :return: move code, preferred position rounded to an integer coordinate
+    """
+    here = position[focal]
+    if len(repel_fish):
+        deltas = position[repel_fish] - here
+        dir_to_fish = np.mean(np.degrees(np.arctan2(deltas[:, 1], deltas[:, 0])))
+        preferred = _along(here, dir_to_fish - 180, radius[focal])
+        code = MOVE_REPEL
+    elif len(align_fish):
+        new_rotation = np.mean(rotation[align_fish])
+        deltas = position[align_fish] - here
+        dist_to_closest = np.min(np.round(np.hypot(deltas[:, 0], deltas[:, 1]), 4))
+        move_dist = _move_distance(dist_to_closest, align[focal], repel[focal], 1, rng)
+        preferred = _along(here, new_rotation, move_dist)
+        code = MOVE_ALIGN
+    elif len(follow_fish):
+        deltas = position[follow_fish] - here
+        dir_to_fish = np.mean(np.degrees(np.arctan2(deltas[:, 1], deltas[:, 0])))
+        dist_to_closest = np.min(np.round(np.hypot(deltas[:, 0], deltas[:, 1]), 4))
+        move_dist = _move_distance(dist_to_closest, align[focal], repel[focal], 0.0001, rng)
+        preferred = _along(here, dir_to_fish, move_dist)
+        code = MOVE_FOLLOW
+    else:
+        cells = empty_cells(focal, position, size, radius, np.array([], dtype=int), boundary)
+        if len(cells) == 0:
+            return MOVE_STUCK, (here[0], here[1])
+        preferred = cells[rng.integers(len(cells))]
+        code = MOVE_RANDOM
+    return code, (int(preferred[0]), int(preferred[1]))
+
+
+@functools.lru_cache(maxsize=None)
+def ring_offsets(max_distance: int) -> tuple:
+    """
+    integer offsets within max_distance of (0, 0) grouped into rings of equal distance, nearest ring first
+    :return: tuple of (distance, tuple of (x, y) offsets)
+    """
+    span = np.arange(-max_distance, max_distance + 1)
+    xx, yy = np.meshgrid(span, span, indexing='ij')
+    offsets = np.column_stack([xx.ravel(), yy.ravel()])
+    squared = offsets[:, 0] ** 2 + offsets[:, 1] ** 2
+    keep = squared <= max_distance ** 2
+    offsets, squared = offsets[keep], squared[keep]
+    order = np.argsort(squared, kind='stable')
+    offsets, squared = offsets[order], squared[order]
+    rings = []
+    for ring in np.split(offsets, np.flatnonzero(np.diff(squared)) + 1):
+        rings.append((math.sqrt(ring[0, 0] ** 2 + ring[0, 1] ** 2), tuple(map(tuple, ring.tolist()))))
+    return tuple(rings)
+
+
+def nearest_valid_cell(preferred, is_valid, max_distance: int, min_distance: float=0, rng=None) -> tuple:
+    """
+    walk outwards from the preferred cell ring by ring, trying the cells of each ring in random order, and return
+        the first valid one - i.e. the nearest valid cell, with ties broken at random
+    :param preferred: integer coordinate the fish would like to move to
+    :param is_valid: callable(tuple) -> bool, e.g. membership of the fish's available moves
+    :param max_distance: furthest from the preferred cell to look
+    :param min_distance: rings nearer than this are skipped (e.g. they are out of the fish's range)
+    :param rng: object with a shuffle method (random module or random.Random), defaults to the random module
+    :return: (cell or None, number of cells looked up)
+    """
+    rng = random if rng is None else rng
+    lookups = 0
+    for distance, ring in ring_offsets(max_distance):
+        if distance < min_distance:
+            continue
+        ring = list(ring)
+        rng.shuffle(ring)
+        for x, y in ring:
+            cell = (preferred[0] + x, preferred[1] + y)
+            lookups += 1
+            if is_valid(cell):
+                return cell, lookups
+    return None, lookups
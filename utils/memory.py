@@ -0,0 +1,166 @@
+import logging
+import os
+import sys
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+"""
+memory instrumentation for long runs: tracemalloc snapshots every few ticks, which files and lines allocated the
+    most and what has grown since the last snapshot, alongside the count and bytes of the structures that are known
+    to grow - enough to size a machine for a long run from a short one
+"""
+
+# allocations made by the profiler itself or while importing modules are not the simulation's
+_IGNORED = (tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<unknown>'))
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_CONTAINERS = (dict, list, tuple, set, frozenset)
+_SCALARS = (int, float, complex, bool, str, bytes, type(None))
+
+
+def deep_size(objects, seen: set=None) -> int:
+    """
+    bytes taken by objects, following the dicts, lists, tuples and sets inside them. Other objects they hold (fish,
+        NearbyWaters) are left out, those are counted as structures of their own, and anything reached twice is
+        counted once
+    :param objects: iterable of objects
+    :param seen: ids already counted, shared between calls to count an object only once across them
+    """
+    seen = set() if seen is None else seen
+    size = 0
+    stack = list(objects)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or not isinstance(obj, _CONTAINERS + _SCALARS):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, _CONTAINERS):
+            stack.extend(obj)
+    return size
+
+
+def structure_sizes(ocean, renderer=None) -> dict:
+    """
+    measure the things that can build up over a run
+    :param ocean: OceanEnvironment
+    :param renderer: optional renderer, for the number of matplotlib artists on its axes
+    :return: structure -> (count, bytes). The bytes of the fish and artists themselves are not measured here (None),
+        see the traced memory of the files that allocate them in the profiler's report
+    """
+    graveyard = ocean.graveyard.population
+    sub_envs = [fsh.sub_env for fsh in ocean.population if fsh.sub_env is not None]
+    neighbour_lists = [x for sub_env in sub_envs for x in (sub_env.repel_fish, sub_env.align_fish,
+                                                            sub_env.follow_fish)]
+    sizes = {
+        'population': (len(ocean.population), None),
+        'memory records': (sum(len(fsh.memory) for fsh in ocean.population),
+                           deep_size(fsh.memory for fsh in ocean.population)),
+        'graveyard': (len(graveyard), None),
+        # dead fish keep everything they remembered
+        'graveyard memory records': (sum(len(fsh.memory) for fsh in graveyard),
+                                     deep_size(fsh.memory for fsh in graveyard)),
+        'retained NearbyWaters': (len(sub_envs), sum(sys.getsizeof(x) for x in sub_envs)),
+        'neighbour list entries': (sum(len(x) for x in neighbour_lists), deep_size(neighbour_lists)),
+    }
+    if ocean.shoal_tracker is not None:
+        events = ocean.shoal_tracker.events
+        sizes['shoal events'] = (len(events['tick']), deep_size([events]))
+    axis = getattr(renderer, 'ax', None)
+    if axis is not None:
+        sizes['artists'] = (len(axis.get_children()), None)
+    return sizes
+
+
+def traced_by_file(snapshot: tracemalloc.Snapshot) -> dict:
+    """
+    memory still allocated, grouped by the file of this repository that allocated it
+    :return: path relative to the repository -> bytes, everything allocated elsewhere (the standard library,
+        numpy, matplotlib) under 'other'
+    """
+    sizes = {}
+    for stat in snapshot.statistics('filename'):
+        path = stat.traceback[0].filename
+        inside = os.path.isabs(path) and path.startswith(_ROOT + os.sep)
+        name = os.path.relpath(path, _ROOT) if inside else 'other'
+        sizes[name] = sizes.get(name, 0) + stat.size
+    return sizes
+
+
+def _describe(count: int, size: int) -> str:
+    return f'{count}' if size is None else f'{count} ({size / 1024:.1f} KiB)'
+
+
+class MemoryProfiler:
+    def __init__(self, ocean, path: str, every: int=100, top: int=10, frames: int=1, renderer=None):
+        """
+        snapshot the heap with tracemalloc every few ticks and append a report to a text file
+        :param ocean: the OceanEnvironment being simulated
+        :param path: report file, overwritten
+        :param every: ticks between snapshots
+        :param top: allocation sites listed in each report
+        :param frames: call stack depth stored for each allocation. More frames say more about where an allocation
+            came from, but tracing is slower and takes more memory
+        :param renderer: optional renderer, to count its artists
+        """
+        self.ocean = ocean
+        self.path = path
+        self.every = every
+        self.top = top
+        self.frames = frames
+        self.renderer = renderer
+        self.previous = None
+        self.started_tracing = False
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self.started_tracing = True
+        with open(self.path, 'w') as f:
+            f.write(f'memory profile, a snapshot every {self.every} ticks\n')
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def record(self, tick: int):
+        """snapshot the heap if tick is due one, should be called at the end of each tick"""
+        if tick % self.every != 0:
+            return
+        snapshot = tracemalloc.take_snapshot().filter_traces(_IGNORED)
+        current, peak = tracemalloc.get_traced_memory()
+        sizes = structure_sizes(self.ocean, self.renderer)
+
+        lines = [f'\n=== tick {tick}: {current / 2 ** 20:.1f} MiB traced, peak {peak / 2 ** 20:.1f} MiB ===',
+                 'structures: ' + ', '.join(f'{name}={_describe(*x)}' for name, x in sizes.items()),
+                 'traced by file:']
+        for name, size in sorted(traced_by_file(snapshot).items(), key=lambda x: -x[1]):
+            lines.append(f'  {size / 1024:10.1f} KiB  {name}')
+        lines.append(f'top {self.top} allocation sites:')
+        for stat in snapshot.statistics('lineno')[:self.top]:
+            lines.append(f'  {stat.size / 1024:10.1f} KiB {stat.count:8d} blocks  {stat.traceback}')
+        if self.previous is not None:
+            lines.append('largest changes since the last snapshot:')
+            for stat in snapshot.compare_to(self.previous, 'lineno')[:self.top]:
+                lines.append(f'  {stat.size_diff / 1024:+10.1f} KiB {stat.count_diff:+8d} blocks  {stat.traceback}')
+        self.previous = snapshot
+
+        with open(self.path, 'a') as f:
+            f.write('\n'.join(lines) + '\n')
+        counts = {name: count for name, (count, _) in sizes.items()}
+        logger.info(f'tick {tick}: {current / 2 ** 20:.1f} MiB traced (peak {peak / 2 ** 20:.1f} MiB), {counts}')
+
+    def close(self):
+        self.previous = None
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+        logger.info(f'memory profile written to {self.path}')
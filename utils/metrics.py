@@ -0,0 +1,166 @@
+import json
+import logging
+import os
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+logger = logging.getLogger(__name__)
+
+STUCK_MOVES = ('stuck', 'moves available but stuck')
+
+# one row per tick
+TICK_SCHEMA = {
+    'tick': 'int64',
+    'fish_count': 'int64',
+    'shoal_count': 'int64',
+    'fish_in_shoals': 'int64',
+    'largest_shoal': 'int64',
+    'mean_shoal_size': 'float64',
+    'polarisation': 'float64',
+    'mean_nearest_neighbour_distance': 'float64',
+    'stuck_fraction': 'float64',
+}
+
+# one row per shoal per tick
+SHOAL_SCHEMA = {
+    'tick': 'int64',
+    'shoal_id': 'int64',
+    'size': 'int64',
+    'centroid_x': 'float64',
+    'centroid_y': 'float64',
+    'polarisation': 'float64',
+}
+
+
+class ColumnarWriter:
+    def __init__(self, directory: str, schema: dict, batch_size: int=100):
+        """
+        append-only table stored as one raw binary file per column plus a schema.json, so a single column can
+            be read back with np.fromfile (see load_columns) without reading the rest
+        :param directory: where to write the column files, created if needed. Existing columns are appended to
+        :param schema: column name -> numpy dtype string
+        :param batch_size: rows held in memory before being appended to disk
+        """
+        self.directory = directory
+        self.schema = schema
+        self.batch_size = batch_size
+        self.buffer = {column: [] for column in schema}
+        self.rows_buffered = 0
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, 'schema.json'), 'w') as f:
+            json.dump(schema, f, indent=2)
+
+    def append(self, **row_columns):
+        """append one or more rows - each keyword is a column, given as a scalar or a sequence of equal length"""
+        lengths = {np.size(x) for x in row_columns.values()}
+        for column in self.schema:
+            self.buffer[column].append(np.atleast_1d(row_columns[column]))
+        self.rows_buffered += lengths.pop() if lengths else 0
+        if self.rows_buffered >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows_buffered == 0:
+            return
+        for column, dtype in self.schema.items():
+            values = np.concatenate(self.buffer[column]).astype(dtype)
+            with open(os.path.join(self.directory, f'{column}.bin'), 'ab') as f:
+                values.tofile(f)
+            self.buffer[column] = []
+        self.rows_buffered = 0
+
+    def close(self):
+        self.flush()
+
+
+def load_columns(directory: str, columns: list=None) -> dict:
+    """
+    read a table written by ColumnarWriter
+    :param columns: columns to read, defaults to all
+    :return: column name -> numpy array
+    """
+    with open(os.path.join(directory, 'schema.json')) as f:
+        schema = json.load(f)
+    columns = schema if columns is None else columns
+    return {column: np.fromfile(os.path.join(directory, f'{column}.bin'), dtype=schema[column])
+            for column in columns}
+
+
+def polarisation(rotations: np.ndarray) -> float:
+    """length of the mean heading vector - 1 when all fish face the same way, near 0 when facing every way"""
+    if len(rotations) == 0:
+        return np.nan
+    radians = np.radians(rotations)
+    return float(np.hypot(np.mean(np.cos(radians)), np.mean(np.sin(radians))))
+
+
+class ShoalMetrics:
+    def __init__(self, directory: str, batch_size: int=100):
+        """
+        summarises the population after each tick's shoal clustering and streams the results to disk
+            ticks are written to <directory>/ticks and individual shoals to <directory>/shoals
+        :param directory: where to write the metrics
+        :param batch_size: ticks held in memory before being written
+        """
+        self.directory = directory
+        self.ticks = ColumnarWriter(os.path.join(directory, 'ticks'), TICK_SCHEMA, batch_size=batch_size)
+        self.shoals = ColumnarWriter(os.path.join(directory, 'shoals'), SHOAL_SCHEMA, batch_size=batch_size)
+
+    def record(self, tick: int, population: list):
+        """
+        measure the population as it is now, should be called after the shoals have been assigned
+        :param tick: period being recorded
+        :param population: fish in the ocean
+        """
+        positions = np.array([fsh.position for fsh in population], dtype=float).reshape(-1, 2)
+        rotations = np.array([fsh.rotation for fsh in population], dtype=float)
+        shoal_ids = np.array([-1 if fsh.shoal_id is None else fsh.shoal_id for fsh in population], dtype=np.int64)
+        stuck = np.array([bool(fsh.memory) and fsh.memory[-1]['move_descr'] in STUCK_MOVES for fsh in population],
+                         dtype=bool)
+        self.record_arrays(tick, positions=positions, rotations=rotations, shoal_ids=shoal_ids, stuck=stuck)
+
+    def record_arrays(self, tick: int, positions: np.ndarray, rotations: np.ndarray, shoal_ids: np.ndarray,
+                      stuck: np.ndarray):
+        """
+        same as record, for models that already hold their fish as arrays (e.g. utils.boids.BoidsOcean)
+        :param positions: shape (n, 2)
+        :param rotations: degrees
+        :param shoal_ids: -1 for fish not in a shoal
+        :param stuck: True for fish that could not move
+        """
+        fish_count = len(positions)
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        rotations = np.asarray(rotations, dtype=float)
+        shoal_ids = np.asarray(shoal_ids, dtype=np.int64)
+        stuck = np.asarray(stuck, dtype=bool)
+
+        in_shoal = shoal_ids >= 0
+        labels, member_index, sizes = np.unique(shoal_ids[in_shoal], return_inverse=True, return_counts=True)
+        # per shoal sums in one pass each, rather than looping over shoals
+        centroids = np.column_stack([np.bincount(member_index, weights=positions[in_shoal, 0]),
+                                     np.bincount(member_index, weights=positions[in_shoal, 1])]) / \
+            np.maximum(sizes, 1)[:, None]
+        radians = np.radians(rotations[in_shoal])
+        shoal_polarisation = np.hypot(np.bincount(member_index, weights=np.cos(radians)),
+                                      np.bincount(member_index, weights=np.sin(radians))) / np.maximum(sizes, 1)
+
+        if fish_count > 1:
+            distances, _ = cKDTree(positions).query(positions, k=2)
+            mean_nn = float(np.mean(distances[:, 1]))
+        else:
+            mean_nn = np.nan
+
+        self.ticks.append(tick=tick, fish_count=fish_count, shoal_count=len(labels),
+                          fish_in_shoals=int(in_shoal.sum()), largest_shoal=int(sizes.max()) if len(sizes) else 0,
+                          mean_shoal_size=float(sizes.mean()) if len(sizes) else 0.0,
+                          polarisation=polarisation(rotations), mean_nearest_neighbour_distance=mean_nn,
+                          stuck_fraction=float(stuck.mean()) if fish_count else 0.0)
+        if len(labels):
+            self.shoals.append(tick=np.full(len(labels), tick), shoal_id=labels, size=sizes,
+                               centroid_x=centroids[:, 0], centroid_y=centroids[:, 1],
+                               polarisation=shoal_polarisation)
+
+    def close(self):
+        self.ticks.close()
+        self.shoals.close()
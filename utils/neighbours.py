@@ -0,0 +1,142 @@
+import logging
+import math
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from utils.spatial_utils import SpatialUtils
+
+logger = logging.getLogger(__name__)
+
+
+class NeighbourTable:
+    def __init__(self, population: list, reach: float=None):
+        """
+        every pair of fish within reach of each other, with the distance and angle from each fish to the other,
+            built once per tick so that perception, decisions, predator counts and clustering don't each repeat the
+            same trigonometry. Each pair is found and measured once and stored for both fish.
+        as fish swim one after another, call move() after each fish moves so that later fish see it where it is
+        :param population: fish in the ocean, in swimming order - indexed as at construction for the whole tick
+        :param reach: furthest distance worth keeping, defaults to the furthest any fish can see
+        """
+        population = list(population)
+        self.population = population
+        self.slot = {fsh.unique_id: i for i, fsh in enumerate(population)}
+        self.reach = reach if reach is not None else max(
+            (max(fsh.follow_distance, fsh.repel_distance) + fsh.size for fsh in population), default=0)
+        # fish move at most this far in a tick, so the tree built at the start of the tick stays useful
+        self.slack = max((fsh.max_movement_radius for fsh in population), default=0)
+        self.positions = np.array([fsh.position for fsh in population], dtype=float).reshape(-1, 2)
+
+        # which species eat which, so predator counts come out of the same pass as the neighbour classes
+        species = sorted({type(fsh) for fsh in population}, key=lambda x: x.__name__)
+        self.species_code = {x: code for code, x in enumerate(species)}
+        representative = {type(fsh): fsh for fsh in population}
+        self.eats = np.array([[prey in representative[predator].eats_fish for prey in species]
+                              for predator in species], dtype=bool).reshape(len(species), -1)
+        self.codes = [self.species_code[type(fsh)] for fsh in population]
+
+        self.rows = [{} for _ in population]
+        self.alive = np.ones(len(population), dtype=bool)
+        self.tree = cKDTree(self.positions) if len(population) else None
+        if self.tree is not None:
+            pairs = self.tree.query_pairs(self.reach, output_type='ndarray')
+            self._add_pairs(pairs[:, 0], pairs[:, 1])
+
+    def _add_pairs(self, first: np.ndarray, second: np.ndarray):
+        deltas = self.positions[second] - self.positions[first]
+        distances = np.sqrt(deltas[:, 0] ** 2 + deltas[:, 1] ** 2)
+        # subtract rather than negate for the way back - negating 0 gives -0 and atan2 then gives -180, not 180
+        back_deltas = self.positions[first] - self.positions[second]
+        for i, j, dist, (dx, dy), (back_dx, back_dy) in zip(first.tolist(), second.tolist(), distances.tolist(),
+                                                             deltas.tolist(), back_deltas.tolist()):
+            # rounded and converted the same way as SpatialUtils.calc_distance / calc_angle - math.atan2 rather than
+            # numpy's, which can differ from it in the last bit
+            dist = round(dist, 4)
+            if dist <= self.reach:
+                self.rows[i][j] = (dist, math.degrees(math.atan2(dy, dx)))
+                self.rows[j][i] = (dist, math.degrees(math.atan2(back_dy, back_dx)))
+
+    def move(self, fish):
+        """update the pairs of a fish that has just moved"""
+        i = self.slot[fish.unique_id]
+        for j in self.rows[i]:
+            del self.rows[j][i]
+        self.rows[i] = {}
+        self.positions[i] = fish.position
+        candidates = self.tree.query_ball_point(self.positions[i], r=self.reach + self.slack)
+        others = np.array([j for j in candidates if j != i and self.alive[j]], dtype=int)
+        self._add_pairs(np.full(len(others), i, dtype=int), others)
+
+    def remove(self, fish):
+        """forget a fish that has died, its index is not reused within the tick"""
+        i = self.slot.pop(fish.unique_id)
+        for j in self.rows[i]:
+            del self.rows[j][i]
+        self.rows[i] = {}
+        self.alive[i] = False
+
+    def relation(self, fish, other_fish) -> tuple:
+        """(distance, angle) from fish to other_fish, or None if they are out of reach of each other"""
+        i = self.slot.get(fish.unique_id)
+        return None if i is None else self.rows[i].get(self.slot.get(other_fish.unique_id))
+
+    def classify(self, fish) -> tuple:
+        """
+        split the fish near fish into repel, align and follow fish, exactly as NearbyWaters.find_nearby_fish does,
+            and count the predators among them
+        :return: repel fish, align fish, follow fish, predator count
+        """
+        i = self.slot[fish.unique_id]
+        code = self.codes[i]
+        repel_fish = []
+        align_fish = []
+        follow_fish = []
+        predator_count = 0
+        for j in sorted(self.rows[i]):
+            distance_between_fish = self.rows[i][j][0] - fish.size
+            same_species = self.codes[j] == code
+            if distance_between_fish <= fish.repel_distance:
+                repel_fish.append(self.population[j])
+            elif fish.align_distance >= distance_between_fish > fish.repel_distance and same_species:
+                align_fish.append(self.population[j])
+            elif fish.follow_distance >= distance_between_fish > fish.align_distance and same_species:
+                follow_fish.append(self.population[j])
+            else:
+                continue
+            if self.eats[self.codes[j], code]:
+                predator_count += 1
+        return repel_fish, align_fish, follow_fish, predator_count
+
+    def within(self, index: int, eps: float) -> list:
+        """indices of the fish within eps of the fish at index (including itself), in population order"""
+        return sorted([index] + [j for j, (dist, _) in self.rows[index].items() if dist <= eps])
+
+
+class NearestNeighbours:
+    def __init__(self, population: list, k: int, candidates: int=None):
+        """
+        k nearest neighbour search for topological perception, so that a fish reacts to a fixed number of
+            neighbours however densely packed its shoal is
+        the tree is built once per tick from where the fish start the tick. As fish swim one after another, the
+            candidates nearest at the start of the tick are re-ranked by where they are now
+        :param population: fish in the ocean
+        :param k: number of neighbours each fish reacts to
+        :param candidates: number of fish taken from the tree before re-ranking, defaults to 2k
+        """
+        self.population = list(population)
+        self.k = k
+        self.candidates = candidates if candidates is not None else 2 * k
+        positions = np.array([fsh.position for fsh in self.population], dtype=float).reshape(-1, 2)
+        self.tree = cKDTree(positions) if len(self.population) else None
+
+    def nearest(self, fish) -> list:
+        """up to k living fish nearest to fish, nearest first"""
+        if self.tree is None:
+            return []
+        count = min(self.candidates + 1, len(self.population))  # + 1 as fish finds itself
+        _, indices = self.tree.query(fish.position, k=count)
+        others = [self.population[j] for j in np.atleast_1d(indices).tolist()]
+        others = [x for x in others if x is not fish and x.alive]
+        others.sort(key=lambda x: SpatialUtils.calc_distance(fish.position, x.position))
+        return others[:self.k]
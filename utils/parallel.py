@@ -0,0 +1,356 @@
+import logging
+import math
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import random
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from utils import kernels
+from utils.spatial_utils import SpatialUtils
+
+logger = logging.getLogger(__name__)
+
+
+class SharedPopulation:
+    # field name: (columns, dtype) - columns of 0 means a flat array
+    FIELDS = {
+        'position': (2, np.float64),
+        'rotation': (0, np.float64),
+        'size': (0, np.float64),
+        'repel': (0, np.float64),
+        'align': (0, np.float64),
+        'follow': (0, np.float64),
+        'radius': (0, np.float64),
+        'species': (0, np.int32),
+        'preferred': (2, np.float64),
+        'move_code': (0, np.int8),
+        'neighbour_count': (0, np.int32),
+        'predators': (0, np.int32),  # fish in sight that eat the fish's species
+    }
+
+    def __init__(self, capacity: int, max_recorded_neighbours: int=16, names: dict=None):
+        """
+        population state held in shared memory blocks so that worker processes can read it without pickling
+        :param capacity: maximum number of fish that can be held
+        :param max_recorded_neighbours: number of neighbours per fish written back for the fish's memory
+        :param names: shared memory block names to attach to, if None new blocks are created
+        """
+        self.capacity = capacity
+        self.max_recorded_neighbours = max_recorded_neighbours
+        self.owner = names is None
+        shapes = self._shapes()
+        self.blocks = {}
+        self.arrays = {}
+        for field, (shape, dtype) in shapes.items():
+            if self.owner:
+                nbytes = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+                block = shared_memory.SharedMemory(create=True, size=nbytes)
+            else:
+                block = shared_memory.SharedMemory(name=names[field])
+            self.blocks[field] = block
+            self.arrays[field] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+    def _shapes(self) -> dict:
+        shapes = {}
+        for field, (columns, dtype) in self.FIELDS.items():
+            shapes[field] = ((self.capacity, columns) if columns else (self.capacity, ), dtype)
+        # neighbour ids and their class (repel / align / follow) for the fish's memory
+        shapes['neighbour_ids'] = ((self.capacity, self.max_recorded_neighbours), np.int32)
+        shapes['neighbour_class'] = ((self.capacity, self.max_recorded_neighbours), np.int8)
+        return shapes
+
+    @property
+    def names(self) -> dict:
+        return {field: block.name for field, block in self.blocks.items()}
+
+    def __getitem__(self, field: str) -> np.ndarray:
+        return self.arrays[field]
+
+    def load(self, population: list, species_codes: dict):
+        """copy the state of each fish into the shared arrays"""
+        for i, fsh in enumerate(population):
+            self['position'][i] = fsh.position
+            self['rotation'][i] = fsh.rotation
+            self['size'][i] = fsh.size
+            self['repel'][i] = fsh.repel_distance
+            self['align'][i] = fsh.align_distance
+            self['follow'][i] = fsh.follow_distance
+            self['radius'][i] = fsh.max_movement_radius
+            self['species'][i] = species_codes[type(fsh)]
+
+    def close(self):
+        self.arrays = {}
+        for block in self.blocks.values():
+            block.close()
+            if self.owner:
+                block.unlink()
+        self.blocks = {}
+
+
+# state held by each worker process, set once by _attach_worker
+_worker = {}
+
+
+def _attach_worker(names: dict, capacity: int, max_recorded_neighbours: int, boundary: tuple, eats: np.ndarray,
+                   topological_neighbours: int=None):
+    """
+    pool initializer - attach to the shared population once per worker rather than once per tick
+    :param eats: eats[a, b] is True if species code a eats species code b
+    """
+    _worker['population'] = SharedPopulation(capacity, max_recorded_neighbours, names=names)
+    _worker['boundary'] = boundary
+    _worker['eats'] = eats
+    _worker['topological_neighbours'] = topological_neighbours
+
+
+def _decide_slice(start: int, stop: int, population_size: int, seed: tuple) -> int:
+    """
+    compute preferred moves for fish [start, stop) and write them back into shared memory
+    :return: number of fish decided
+    """
+    shared = _worker['population']
+    boundary = _worker['boundary']
+    rng = np.random.default_rng(seed + (start, ))
+    position = shared['position'][:population_size]
+    size = shared['size'][:population_size]
+    follow = shared['follow'][:population_size]
+    tree = cKDTree(position)
+    reach = follow[start:stop] + size[start:stop]
+    nearest = _worker['topological_neighbours']
+    if nearest is None:
+        candidates = tree.query_ball_point(position[start:stop], r=reach)
+    else:
+        # k nearest other fish (the first hit is the fish itself), nearest first, of those that are in sight
+        distances, indices = tree.query(position[start:stop], k=min(nearest + 1, population_size))
+        distances, indices = distances.reshape(stop - start, -1), indices.reshape(stop - start, -1)
+        candidates = [row[row_distances <= row_reach].tolist()
+                      for row, row_distances, row_reach in zip(indices, distances, reach)]
+    for focal, others in zip(range(start, stop), candidates):
+        others = np.array([x for x in others if x != focal], dtype=int)
+        dists = np.round(np.hypot(*(position[others] - position[focal]).T), 4) if len(others) else np.empty(0)
+        repel_fish, align_fish, follow_fish = kernels.classify_neighbours(
+            focal, others, dists, size, shared['repel'], shared['align'], follow, shared['species'])
+        code, preferred = kernels.decide_move(
+            focal, position, shared['rotation'], size, shared['repel'], shared['align'], shared['radius'],
+            repel_fish, align_fish, follow_fish, boundary, rng)
+        shared['move_code'][focal] = code
+        shared['preferred'][focal] = preferred
+        # as NearbyWaters.count_predators, the neighbours that eat this fish
+        nearby = np.concatenate([repel_fish, align_fish, follow_fish]).astype(int)
+        shared['predators'][focal] = int(_worker['eats'][shared['species'][nearby], shared['species'][focal]].sum())
+
+        # record as many neighbours as there is room for
+        recorded = [(x, kernels.NEIGHBOUR_REPEL) for x in repel_fish] + \
+                   [(x, kernels.NEIGHBOUR_ALIGN) for x in align_fish] + \
+                   [(x, kernels.NEIGHBOUR_FOLLOW) for x in follow_fish]
+        shared['neighbour_count'][focal] = len(recorded)
+        recorded = recorded[:shared.max_recorded_neighbours]
+        shared['neighbour_ids'][focal, :len(recorded)] = [x for x, _ in recorded]
+        shared['neighbour_class'][focal, :len(recorded)] = [y for _, y in recorded]
+    return stop - start
+
+
+class OccupancyGrid:
+    def __init__(self, positions: list, cell_size: float):
+        """
+        bucket fish positions into square cells so that 'is anyone too close to this coordinate' only looks at
+            the fish in neighbouring cells
+        :param positions: current position of each fish, indexed as the population
+        :param cell_size: should be at least the largest clearance that will be asked for
+        """
+        self.cell_size = max(cell_size, 1)
+        self.positions = [tuple(x) for x in positions]
+        self.cells = {}
+        for i, pos in enumerate(self.positions):
+            self.cells.setdefault(self._cell(pos), set()).add(i)
+
+    def _cell(self, coordinates) -> tuple:
+        return math.floor(coordinates[0] / self.cell_size), math.floor(coordinates[1] / self.cell_size)
+
+    def is_clear(self, coordinates, clearance: float, ignore: int) -> bool:
+        """True if no fish (other than ignore) is closer than clearance to coordinates"""
+        cx, cy = self._cell(coordinates)
+        reach = math.ceil(clearance / self.cell_size)
+        for dx in range(-reach, reach + 1):
+            for dy in range(-reach, reach + 1):
+                for i in self.cells.get((cx + dx, cy + dy), ()):
+                    if i != ignore and SpatialUtils.calc_distance(coordinates, self.positions[i]) < clearance:
+                        return False
+        return True
+
+    def remove(self, index: int):
+        self.cells[self._cell(self.positions[index])].discard(index)
+
+    def move(self, index: int, coordinates):
+        self.cells[self._cell(self.positions[index])].discard(index)
+        self.positions[index] = tuple(coordinates)
+        self.cells.setdefault(self._cell(coordinates), set()).add(index)
+
+
+class ParallelDecisionPool:
+    def __init__(self, ocean, workers: int=None, max_move_attempts: int=30, max_recorded_neighbours: int=16):
+        """
+        persistent pool of worker processes that decide where each fish would like to move, in parallel, from
+            population arrays held in shared memory. The main process then resolves conflicting moves and applies
+            them to the fish objects. Use as a context manager so that workers and shared memory are cleaned up.
+
+        differences from the sequential Fish.swim loop:
+            * every fish decides from the same snapshot of the ocean rather than seeing the fish that moved before it
+            * available moves are only enumerated for fish that want to move randomly, a fish whose preferred move
+                cannot be placed is recorded as 'moves available but stuck' rather than 'stuck'
+            * moves are always placed on the integer lattice, the ocean's continuous_movement setting is not used
+            * with the ocean's topological_neighbours set, the k nearest fish are found from the same snapshot
+            * every fish decides its own move, quiet shoals are not aggregated
+            * fish are placed in order of the predators they saw when deciding, which is also their
+                incentive_to_move. No NearbyWaters is built, so each fish's sub_env is cleared - what it saw is in
+                its memory
+        :param ocean: the OceanEnvironment whose population will swim
+        :param workers: number of worker processes, defaults to the number of cpus
+        :param max_move_attempts: as in Fish.swim, how far from the preferred move to look for a free coordinate
+        :param max_recorded_neighbours: number of neighbours recorded in each fish's memory per tick
+        """
+        self.ocean = ocean
+        self.workers = workers or mp.cpu_count()
+        self.max_move_attempts = max_move_attempts
+        self.max_recorded_neighbours = max_recorded_neighbours
+        # fixed at start so that seeding python's random module makes parallel runs reproducible
+        self.seed = random.getrandbits(32)
+        self.tick = 0
+        self.shared = None
+        self.pool = None
+        self.species_codes = {}
+        self.eats = np.zeros((0, 0), dtype=bool)
+        self._examples = {}
+        self._add_species(self.ocean.population)
+
+    def _add_species(self, population) -> bool:
+        """
+        give every new kind of fish in population a species code
+        :return: True if there were any, the workers then need the new eats matrix
+        """
+        # eats_fish is set on the fish's profile, so one fish of each kind is kept to ask
+        examples = {type(x): x for x in population}
+        new = sorted(set(examples) - set(self.species_codes), key=lambda x: x.__name__)
+        for kind in new:
+            self.species_codes[kind] = len(self.species_codes)
+            self._examples[kind] = examples[kind]
+        if new:
+            species = sorted(self.species_codes, key=self.species_codes.get)
+            # eats[a, b] is True if species a eats species b
+            self.eats = np.array([[prey in self._examples[predator].eats_fish for prey in species]
+                                  for predator in species], dtype=bool).reshape(len(species), len(species))
+        return bool(new)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def start(self):
+        self.shared = SharedPopulation(capacity=max(len(self.ocean.population), 1),
+                                       max_recorded_neighbours=self.max_recorded_neighbours)
+        self.pool = mp.Pool(processes=self.workers, initializer=_attach_worker,
+                            initargs=(self.shared.names, self.shared.capacity, self.max_recorded_neighbours,
+                                      self.ocean.boundary, self.eats, self.ocean.topological_neighbours))
+        logger.info(f'started {self.workers} decision workers for {self.shared.capacity} fish')
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        if self.shared is not None:
+            self.shared.close()
+            self.shared = None
+
+    def _slices(self, population_size: int) -> list:
+        chunk = math.ceil(population_size / self.workers)
+        seed = (self.seed, self.tick)
+        return [(start, min(start + chunk, population_size), population_size, seed)
+                for start in range(0, population_size, chunk)]
+
+    def step(self):
+        """one tick: parallel decision phase followed by the sequential conflict resolution pass"""
+        population = list(self.ocean.population)
+        new_species = self._add_species(population)
+        if len(population) > self.shared.capacity or new_species:
+            # ocean has grown, or has a new kind of fish, since the pool started - reallocate
+            self.close()
+            self.start()
+        self.shared.load(population, self.species_codes)
+        self.pool.starmap(_decide_slice, self._slices(len(population)))
+        self._resolve_and_apply(population)
+        self.tick += 1
+
+    def _resolve_and_apply(self, population: list):
+        """
+        place fish in order of the predators they saw (ties broken by population order) so that the outcome depends
+            only on the decisions and the tick seed. With predation, predators eat the prey they saw in their repel
+            zone once they have been placed
+        :param population: the fish in the order their decisions were loaded into shared memory
+        """
+        shared = self.shared
+        rng = random.Random(f"{self.seed}-{self.tick}")
+        clearance = max(x.size for x in population) / 2
+        occupancy = OccupancyGrid([x.position for x in population], cell_size=clearance)
+        predators = shared['predators'][:len(population)].tolist()
+        order = sorted(range(len(population)), key=lambda i: -predators[i])
+        index_of = {fsh.unique_id: i for i, fsh in enumerate(population)}
+
+        for i in order:
+            fsh = population[i]
+            if not fsh.alive:  # eaten earlier in the tick
+                continue
+            fsh.incentive_to_move = predators[i]
+            # the fish's last NearbyWaters is out of date, and no new one is built
+            fsh.sub_env = None
+            code = int(shared['move_code'][i])
+            move_description = kernels.MOVE_DESCRIPTIONS[code]
+            new_position = None
+            if code != kernels.MOVE_STUCK:
+                preferred = [int(shared['preferred'][i, 0]), int(shared['preferred'][i, 1])]
+                new_position = self._place(i, fsh, preferred, occupancy, rng)
+                if new_position is None:
+                    move_description = 'moves available but stuck'
+
+            fsh.previous_position = fsh.position
+            if new_position is None:
+                rotation = fsh.rotation
+            else:
+                rotation = SpatialUtils.calc_angle(fsh.position, new_position)
+                fsh.position = new_position
+                fsh.age += 1
+                occupancy.move(i, new_position)
+
+            count = min(int(shared['neighbour_count'][i]), shared.max_recorded_neighbours)
+            nearby = {kernels.NEIGHBOUR_REPEL: [], kernels.NEIGHBOUR_ALIGN: [], kernels.NEIGHBOUR_FOLLOW: []}
+            for other, relation in zip(shared['neighbour_ids'][i, :count], shared['neighbour_class'][i, :count]):
+                nearby[int(relation)].append(population[other])
+            dist = SpatialUtils.calc_distance(fsh.position, fsh.previous_position)
+            fsh.create_memory(move_description=move_description, new_rotation=rotation, move_distance=dist,
+                              predators_seen=predators[i], repel_fish=nearby[kernels.NEIGHBOUR_REPEL],
+                              align_fish=nearby[kernels.NEIGHBOUR_ALIGN],
+                              follow_fish=nearby[kernels.NEIGHBOUR_FOLLOW])
+            fsh.rotation = fsh._update_rotation(rotation)
+            if self.ocean.predation and fsh.eats_fish:
+                for prey in fsh.feed(nearby[kernels.NEIGHBOUR_REPEL]):
+                    occupancy.remove(index_of[prey.unique_id])
+
+    def _place(self, index: int, fsh, preferred: list, occupancy: OccupancyGrid, rng: random.Random):
+        """
+        nearest coordinate to the preferred one that is in range, in the ocean and clear of other fish
+        :return: the coordinate moved to, or None if nowhere could be found
+        """
+        def is_valid(cell: tuple) -> bool:
+            return SpatialUtils.calc_distance(cell, fsh.position) <= fsh.max_movement_radius \
+                and occupancy.is_clear(cell, fsh.size / 2, ignore=index) \
+                and SpatialUtils.poly_contains_point(coordinates=cell, polygon=self.ocean.boundary, method='winding')
+
+        out_of_range = SpatialUtils.calc_distance(preferred, fsh.position) - fsh.max_movement_radius
+        cell, _ = kernels.nearest_valid_cell(preferred, is_valid, max_distance=self.max_move_attempts,
+                                             min_distance=out_of_range, rng=rng)
+        return None if cell is None else [cell[0], cell[1]]
@@ -0,0 +1,192 @@
+import logging
+import math
+import queue
+import threading
+import time
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# immutable copies of everything the renderer needs, so that the simulation can carry on moving fish while
+# earlier ticks are drawn. species is the fish's (shared, immutable) SpeciesProfile, for its marker
+FishSnapshot = namedtuple('FishSnapshot', ['unique_id', 'name', 'previous_position', 'position', 'rotation',
+                                           'size', 'colour', 'species', 'shoal_id'])
+OceanSnapshot = namedtuple('OceanSnapshot', ['tick', 'fish'])
+
+
+class RenderSchedule:
+    def __init__(self, time_periods: int, render_every: int=1, render_budget: float=None,
+                 seconds_per_frame: float=None):
+        """
+        which periods become frames of the video, handed out in order by next_frame. Without a budget every
+            render_every-th period is drawn. With one, render_every starts from seconds_per_frame (an estimate made
+            before anything is drawn) and is measured again as the frames are drawn (see timed): whenever the frames
+            drawn so far say that the rest would overrun what is left of the budget, the periods not yet simulated
+            are drawn further apart. render_every is only ever widened, so frames is the most the video will have
+        :param time_periods: number of periods to simulate
+        :param render_every: periods per frame, when there is no budget
+        :param render_budget: target wall clock seconds for rendering the video
+        :param seconds_per_frame: estimated cost of drawing a frame, required with a budget
+        """
+        self.time_periods = time_periods
+        self.render_budget = render_budget
+        if render_budget is not None:
+            affordable_frames = max(int(render_budget / seconds_per_frame), 1)
+            render_every = max(math.ceil(time_periods / affordable_frames), 1)
+            logger.info(f'rendering estimated at {seconds_per_frame:.3f}s per frame, {affordable_frames} frames fit '
+                        f'in {render_budget}s so rendering every {render_every} periods to start with')
+        self.render_every = render_every
+        self.frames = math.ceil(time_periods / render_every)
+        self.next_tick = 0
+        self.ticks = []  # period shown by each frame handed out, in order
+        self.frames_drawn = 0
+        self.render_seconds = 0.0
+        # frames are planned on the simulation thread when pipelined, and measured on the renderer's
+        self._lock = threading.Lock()
+
+    def next_frame(self) -> tuple:
+        """
+        :return: (first period, number of periods) of the next frame, each frame shows the last period it covers.
+            None once every period has been handed out
+        """
+        with self._lock:
+            if self.next_tick >= self.time_periods:
+                return None
+            first_tick = self.next_tick
+            periods = min(self.render_every, self.time_periods - first_tick)
+            self.next_tick += periods
+            self.ticks.append(self.next_tick - 1)
+            return first_tick, periods
+
+    def frame_ticks(self):
+        """yield the period shown by each frame, for a run that is already simulated"""
+        frame = self.next_frame()
+        while frame is not None:
+            yield frame[0] + frame[1] - 1
+            frame = self.next_frame()
+
+    def describe(self) -> str:
+        """
+        render_every and frames for a video's metadata, which is written before any frame is drawn. With a budget
+            they are only where rendering starts from, the frames drawn are recorded by write_frames
+        """
+        if self.render_budget is None:
+            return f'render_every={self.render_every} frames={self.frames}'
+        return f'render_every>={self.render_every} frames<={self.frames}'
+
+    def write_frames(self, path: str, interpolated_frames: int=0):
+        """
+        write the period shown by each frame handed out, one per line after a header of the final render_every and
+            frame counts - with a budget these are only known once the video is drawn
+        :param interpolated_frames: in-between frames drawn between each pair of simulated frames
+        """
+        frames = len(self.ticks)
+        video_frames = frames + max(frames - 1, 0) * interpolated_frames
+        with open(path, 'w') as f:
+            f.write(f'# periods={self.time_periods} render_every={self.render_every} render_budget={self.render_budget} '
+                    f'frames={frames} video_frames={video_frames}\n')
+            f.writelines(f'{tick}\n' for tick in self.ticks)
+        logger.info(f'{frames} frames drawn, the last rendering every {self.render_every} periods, '
+                    f'frame periods written to {path}')
+
+    def drawn(self, seconds: float):
+        """record the wall clock cost of drawing a frame, widening render_every if rendering has fallen behind"""
+        with self._lock:
+            self.frames_drawn += 1
+            self.render_seconds += seconds
+            if self.render_budget is None:
+                return
+            seconds_per_frame = self.render_seconds / self.frames_drawn
+            affordable_frames = max(int((self.render_budget - self.render_seconds) / seconds_per_frame), 1)
+            render_every = max(math.ceil((self.time_periods - self.next_tick) / affordable_frames), 1)
+            if render_every > self.render_every:
+                logger.info(f'rendering is taking {seconds_per_frame:.3f}s per frame, rendering every {render_every} '
+                            f'periods from period {self.next_tick} to stay within {self.render_budget}s')
+                self.render_every = render_every
+
+    def timed(self, snapshots):
+        """
+        yield snapshots, timing what the renderer does with each before it asks for the next (see drawn). When
+            in-between frames are drawn from these snapshots, that includes drawing them
+        """
+        for snapshot in snapshots:
+            start = time.perf_counter()
+            yield snapshot
+            self.drawn(time.perf_counter() - start)
+
+
+class SimulationPipeline:
+    _DONE = object()
+
+    def __init__(self, advance, frames: int, max_queued_frames: int=8):
+        """
+        runs the simulation ahead of the renderer on a background thread, handing over snapshots through a bounded
+            queue. When the queue is full the simulation waits (backpressure), so at most max_queued_frames
+            snapshots are held in memory at once
+        :param advance: callable(frame) advancing the simulation to the next frame and returning an OceanSnapshot,
+            or None once there is nothing left to simulate
+        :param frames: largest number of frames to produce
+        :param max_queued_frames: size of the queue between simulation and renderer
+        """
+        self.advance = advance
+        self.frame_count = frames
+        self.frames = queue.Queue(maxsize=max_queued_frames)
+        self._stop = threading.Event()
+        self._error = None
+        self._thread = threading.Thread(target=self._simulate, name='simulation', daemon=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def start(self):
+        self._thread.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """stop the simulation thread, e.g. if the renderer fails part way through"""
+        self._stop.set()
+        # free a slot in case the simulation is blocked on a full queue
+        try:
+            while True:
+                self.frames.get_nowait()
+        except queue.Empty:
+            pass
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self.frames.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _simulate(self):
+        try:
+            for frame in range(self.frame_count):
+                if self._stop.is_set():
+                    return
+                snapshot = self.advance(frame)
+                if snapshot is None:
+                    break
+                if not self._put(snapshot):
+                    return
+        except BaseException as e:
+            logger.exception('simulation thread failed')
+            self._error = e
+        self._put(self._DONE)
+
+    def __iter__(self):
+        """yield snapshots in tick order as they become available"""
+        while True:
+            item = self.frames.get()
+            if item is self._DONE:
+                break
+            yield item
+        if self._error is not None:
+            raise self._error
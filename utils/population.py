@@ -0,0 +1,106 @@
+import logging
+
+import numpy as np
+
+from utils.spatial_utils import SpatialUtils
+
+logger = logging.getLogger(__name__)
+
+
+class Population:
+    def __init__(self, capacity: int=64):
+        """
+        the fish living in an ocean, held in stable slots. A fish keeps its slot (fish.slot) for as long as it is
+            alive, slots of dead fish go on a free list and are reused by the next fish added, so adding, removing
+            and issuing ids are all constant time and removing a fish never shifts the others
+        iterates over the living fish in slot order, so can be used wherever a list of fish was. Slots can be
+            rearranged (see reorder), so fish should be looked up by unique id (see get) rather than remembered by slot
+        :param capacity: initial number of slots in the alive mask, grown (doubled) as needed
+        """
+        self.slots = []  # fish in each slot, None for a free slot
+        self.alive = np.zeros(capacity, dtype=bool)  # True for occupied slots, for vectorised consumers
+        self.free = []
+        self.slot_by_id = {}  # unique id -> slot of each living fish
+        self.count = 0
+        self.next_id = 0
+
+    def issue_id(self) -> int:
+        """new unique id, never reused even once the fish it was issued to has died"""
+        unique_id = self.next_id
+        self.next_id += 1
+        return unique_id
+
+    def append(self, fish) -> int:
+        """add fish to a free slot (or a new one if there are none free), and return the slot"""
+        if self.free:
+            slot = self.free.pop()
+            self.slots[slot] = fish
+        else:
+            slot = len(self.slots)
+            self.slots.append(fish)
+            if slot >= len(self.alive):
+                self.alive = np.concatenate([self.alive, np.zeros(len(self.alive) or 1, dtype=bool)])
+        self.alive[slot] = True
+        fish.slot = slot
+        self.slot_by_id[fish.unique_id] = slot
+        self.count += 1
+        return slot
+
+    def remove(self, fish):
+        """free the slot of fish"""
+        if fish not in self:
+            raise ValueError(f'{fish.name} ({fish.unique_id}) is not in this population')
+        self.slots[fish.slot] = None
+        self.alive[fish.slot] = False
+        self.free.append(fish.slot)
+        del self.slot_by_id[fish.unique_id]
+        fish.slot = None
+        self.count -= 1
+
+    def get(self, unique_id: int):
+        """the living fish with unique_id, None if there is none"""
+        slot = self.slot_by_id.get(unique_id)
+        return None if slot is None else self.slots[slot]
+
+    def reorder(self, fish: list):
+        """
+        move the living fish into slots 0, 1, 2... in the given order, leaving no free slots between them
+        :param fish: every living fish, each once
+        """
+        fish = list(fish)
+        if len(fish) != self.count or any(fsh not in self for fsh in fish) or len({id(x) for x in fish}) != len(fish):
+            raise ValueError('reorder needs every fish in the population exactly once')
+        self.slots = fish
+        self.alive[:] = False
+        self.alive[:len(fish)] = True
+        self.free = []
+        for slot, fsh in enumerate(fish):
+            fsh.slot = slot
+        self.slot_by_id = {fsh.unique_id: fsh.slot for fsh in fish}
+
+    def reorder_spatially(self, origin=None, extent=None):
+        """
+        reorder the fish along a Z-order curve of their positions (see SpatialUtils.morton_order), so that fish
+            close together in the ocean are mostly close together in slot order, and so in every array built by
+            iterating over the population
+        :param origin: lower left corner of the ocean, defaults to that of the fish
+        :param extent: width and height of the ocean, defaults to that of the fish
+        """
+        fish = list(self)
+        order = SpatialUtils.morton_order([fsh.position for fsh in fish], origin=origin, extent=extent)
+        self.reorder([fish[k] for k in order])
+
+    def __contains__(self, fish) -> bool:
+        return fish.slot is not None and fish.slot < len(self.slots) and self.slots[fish.slot] is fish
+
+    def __iter__(self):
+        return (fsh for fsh in self.slots if fsh is not None)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __bool__(self) -> bool:
+        return self.count > 0
+
+    def __repr__(self):
+        return f'Population({self.count} fish in {len(self.slots)} slots)'
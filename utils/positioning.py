@@ -3,27 +3,64 @@ import logging
 import numpy as np
 
 from utils.environ import OceanEnvironment
+from utils.kernels import disc_offsets
 from utils.spatial_utils import SpatialUtils
 
 logger = logging.getLogger(__name__)
 
 
 class NearbyWaters:
-    def __init__(self, fish, ocean: OceanEnvironment):
+    def __init__(self, fish, ocean: OceanEnvironment, nearby_fish: tuple=None):
         """
         this class assesses the relevant environment around a fish i.e. the environment that will affect its movement
             this should be evaluated for each fish for each move
         :param fish:
         :param ocean:
+        :param nearby_fish: (repel fish, align fish, follow fish) if already known to be up to date (e.g. from a
+            PerceptionScheduler), skips searching the ocean for them
         """
         self.fish = fish
         self.ocean = ocean
+        # shared per tick NeighbourTable, if the ocean keeps one
+        self.table = ocean.neighbour_table
 
-        self.repel_fish, self.align_fish, self.follow_fish = self.find_nearby_fish()
+        predator_count = None
+        if nearby_fish is not None:
+            self.repel_fish, self.align_fish, self.follow_fish = (list(x) for x in nearby_fish)
+        elif self.table is not None and ocean.nearest_neighbours is None:
+            self.repel_fish, self.align_fish, self.follow_fish, predator_count = self.table.classify(fish)
+        else:
+            self.repel_fish, self.align_fish, self.follow_fish = self.find_nearby_fish()
         self.all_nearby_fish = self.repel_fish + self.align_fish + self.follow_fish
-        self.predator_count = self.count_predators()
+        self.predator_count = self.count_predators() if predator_count is None else predator_count
+
+        # continuous movement glides to its preferred move, so there is no lattice of moves to enumerate
+        self.available_moves = None if ocean.continuous_movement else self.update_available_moves()
+        # for constant time 'is this move available' lookups
+        self.available_move_set = set() if self.available_moves is None else \
+            {(x[0], x[1]) for x in self.available_moves}
+
+    def distance_to(self, other_fish) -> float:
+        """distance from the focal fish to other_fish, read from the neighbour table if there is one"""
+        relation = self.table.relation(self.fish, other_fish) if self.table is not None else None
+        if relation is None:
+            return SpatialUtils.calc_distance(self.fish.position, other_fish.position)
+        return relation[0]
 
-        self.available_moves = self.update_available_moves()
+    def angle_to(self, other_fish) -> float:
+        """direction from the focal fish to other_fish, read from the neighbour table if there is one"""
+        relation = self.table.relation(self.fish, other_fish) if self.table is not None else None
+        if relation is None:
+            return SpatialUtils.calc_angle(self.fish.position, other_fish.position)
+        return relation[1]
+
+    def forget(self, fish_list: list):
+        """stop reacting to fish that are no longer in the ocean (e.g. eaten)"""
+        gone = {fsh.unique_id for fsh in fish_list}
+        self.repel_fish = [x for x in self.repel_fish if x.unique_id not in gone]
+        self.align_fish = [x for x in self.align_fish if x.unique_id not in gone]
+        self.follow_fish = [x for x in self.follow_fish if x.unique_id not in gone]
+        self.all_nearby_fish = self.repel_fish + self.align_fish + self.follow_fish
 
     def count_predators(self):
         """return number of predators of that fish type within a fish's 'follow range'"""
@@ -39,9 +76,13 @@ class NearbyWaters:
                 boundary
         """
         # find coordinates within range of fish
-        pos = self.fish.position
         coords_within_radius = self.find_moves_within_max_range()
-        environ_coordinates = self.find_coordinates_within_sub_environment(coords_within_radius, self.ocean.boundary)
+        # the distance to the closest edge is a lower bound, so if it is beyond reach every move is in the ocean
+        if SpatialUtils.distance_to_boundary(self.fish.position, self.ocean.boundary) > self.fish.max_movement_radius:
+            environ_coordinates = coords_within_radius
+        else:
+            environ_coordinates = self.find_coordinates_within_sub_environment(coords_within_radius,
+                                                                               self.ocean.boundary)
         empty_coordinates = self.find_empty_coordinates(all_coordinates=environ_coordinates,
                                                         nearby_fish=self.all_nearby_fish)
         return empty_coordinates
@@ -55,17 +96,9 @@ class NearbyWaters:
             then compares whether coordinate generated is within the circle_radius
         :return: list of coordinates within a circle within radius = circle_radius
         """
-        coords_within_radius = []
-        # create a range to search, normalised based on how far fish can move to stop range getting enormous
-        search_range = np.arange(start=-self.fish.max_movement_radius, stop=self.fish.max_movement_radius + 0.001,
-                                 step=1)
-        for x_increment in search_range:
-            for y_increment in search_range:
-                test_coord = [x_increment, y_increment]
-                dist_to_centre = SpatialUtils.calc_distance(test_coord, [0, 0])
-                if dist_to_centre <= self.fish.max_movement_radius:
-                    adj_coord = [test_coord[0] + self.fish.position[0], test_coord[1] + self.fish.position[1]]
-                    coords_within_radius.append(adj_coord)
+        # the offsets only depend on the radius, so are built once per radius and shared between fish
+        offsets = disc_offsets(float(self.fish.max_movement_radius))
+        coords_within_radius = (offsets + [self.fish.position[0], self.fish.position[1]]).tolist()
         return coords_within_radius
 
     @staticmethod
@@ -92,12 +125,15 @@ class NearbyWaters:
         if len(nearby_fish) == 0:  # if no fish nearby
             updated_coordinate_list = all_coordinates
         else:
+            space_necessary = self.fish.size / 2
+            # only fish that are close enough to crowd a coordinate within range need to be checked
+            reach = self.fish.max_movement_radius + space_necessary
+            nearby_fish = [fsh for fsh in nearby_fish if self.distance_to(fsh) <= reach]
             updated_coordinate_list = []
             for coord in all_coordinates:
-                for fsh in nearby_fish:
-                    space_necessary = self.fish.size / 2
-                    if SpatialUtils.calc_distance(coord, fsh.position) >= space_necessary:
-                        updated_coordinate_list.append(coord)
+                # a coordinate is only empty if it is clear of every nearby fish
+                if all(SpatialUtils.calc_distance(coord, fsh.position) >= space_necessary for fsh in nearby_fish):
+                    updated_coordinate_list.append(coord)
         return updated_coordinate_list
 
     def find_nearby_fish(self) -> tuple:
@@ -130,7 +166,10 @@ class NearbyWaters:
         """
         find other fish in their current positions
             remove current fish and dead fish from list of fish being considered
+            with topological perception only the ocean's k nearest fish are considered
         """
+        if self.ocean.nearest_neighbours is not None:
+            return self.ocean.nearest_neighbours.nearest(self.fish)
         other_fish = []
         for fish in self.ocean.population:
             if fish.unique_id != self.fish.unique_id:
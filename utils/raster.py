@@ -0,0 +1,195 @@
+import logging
+import math
+import subprocess
+import time
+
+import numpy as np
+
+from utils.spatial_utils import SpatialUtils
+
+logger = logging.getLogger(__name__)
+
+"""
+draws OceanSnapshots straight into RGB arrays and pipes them to ffmpeg, without matplotlib. The coastline is drawn
+    once, after that each frame costs a copy of the background plus one array write per fish sprite, so very large
+    populations can still be made into videos
+"""
+
+
+def hex_to_rgb(colour: str) -> tuple:
+    """'#rrggbb' (or any other matplotlib colour, which loads matplotlib) as a tuple of 0-255 ints"""
+    if colour.startswith('#') and len(colour) == 7:
+        return tuple(int(colour[i:i + 2], 16) for i in (1, 3, 5))
+    from matplotlib.colors import to_rgb
+    return tuple(int(round(x * 255)) for x in to_rgb(colour))
+
+
+def rasterise_polygon(polygon, xs: np.ndarray, ys: np.ndarray, chunk_size: int=50000) -> np.ndarray:
+    """
+    which pixel centres lie inside polygon
+    :param polygon: closed polygon, first coordinate repeated at the end
+    :param xs: x coordinate of each pixel column
+    :param ys: y coordinate of each pixel row
+    :param chunk_size: pixels tested at once, bounds the memory of the vectorised winding test
+    :return: boolean array of shape (len(ys), len(xs))
+    """
+    xx, yy = np.meshgrid(xs, ys)
+    points = np.column_stack([xx.ravel(), yy.ravel()])
+    inside = np.zeros(len(points), dtype=bool)
+    for start in range(0, len(points), chunk_size):
+        inside[start:start + chunk_size] = SpatialUtils.poly_contains_points(points[start:start + chunk_size],
+                                                                            polygon)
+    return inside.reshape(len(ys), len(xs))
+
+
+class RasterRenderer:
+    def __init__(self, ocean, width: int=900, labelled_fish: tuple=(), show_tick: bool=True,
+                 background: str='#ffffff', ffmpeg_path: str='ffmpeg'):
+        """
+        :param ocean: the OceanEnvironment being drawn, for its coastline and axes limits
+        :param width: frame width in pixels, the height follows from the shape of the ocean
+        :param labelled_fish: unique ids of the fish to label with their names - labels are drawn with PIL so keep
+            this to a handful of fish
+        :param show_tick: if True the period is written in the corner of each frame
+        :param background: colour outside the ocean
+        :param ffmpeg_path: ffmpeg executable the frames are piped to
+        """
+        self.ocean = ocean
+        self.labelled_fish = set(labelled_fish)
+        self.show_tick = show_tick
+        self.ffmpeg_path = ffmpeg_path
+
+        x_limit, y_limit = ocean._get_axes_limits()
+        self.scale = width / (x_limit[1] - x_limit[0])  # pixels per unit of ocean
+        # encoders want even dimensions
+        self.width = width - width % 2
+        height = int(math.ceil((y_limit[1] - y_limit[0]) * self.scale))
+        self.height = height + height % 2
+        self.x_min = x_limit[0]
+        self.y_max = y_limit[1]
+
+        # the coastline is drawn once, every frame starts from a copy of it
+        self.background = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        self.background[:] = hex_to_rgb(background)
+        xs = self.x_min + (np.arange(self.width) + 0.5) / self.scale
+        ys = self.y_max - (np.arange(self.height) + 0.5) / self.scale
+        sea = np.array(hex_to_rgb(ocean.sea_colour), dtype=float)
+        # same look as the matplotlib renderer's 30% opaque sea
+        tint = np.round(0.3 * sea + 0.7 * self.background[0, 0]).astype(np.uint8)
+        self.background[rasterise_polygon(ocean.boundary, xs, ys)] = tint
+        self.frame = self.background.copy()
+
+        self.sprites = {}  # (species, rotation bin) -> (row offsets, column offsets)
+        self.colours = {}
+
+    def _sprite(self, species, rotation_bin: int) -> tuple:
+        """pixel offsets from a fish's centre covered by its marker, rasterised the first time they are needed"""
+        key = (species, rotation_bin)
+        if key not in self.sprites:
+            outline = np.array(species.marker_vertices[:-1], dtype=float)  # last vertex only closes the path
+            # fit the marker to the fish's size, as the matplotlib renderer fits it to the marker size
+            outline *= species.size / 2 / max(np.abs(outline).max(), 1e-9)
+            angle = math.radians(rotation_bin * 360 / species.rotation_bins - 90)  # marker is drawn facing +y
+            rotate = np.array([[math.cos(angle), math.sin(angle)], [-math.sin(angle), math.cos(angle)]])
+            outline = outline @ rotate
+            polygon = np.vstack([outline, outline[:1]])
+            reach = int(math.ceil(species.size / 2 * self.scale)) + 1
+            offsets = np.arange(-reach, reach + 1)
+            # pixel rows count downwards, y upwards
+            inside = rasterise_polygon(polygon, (offsets + 0.5) / self.scale, -(offsets + 0.5) / self.scale)
+            rows, columns = np.nonzero(inside)
+            if len(rows) == 0:  # smaller than a pixel - still show the fish
+                rows, columns = np.array([reach]), np.array([reach])
+            self.sprites[key] = (rows - reach, columns - reach)
+        return self.sprites[key]
+
+    def _rgb(self, colour: str) -> tuple:
+        if colour not in self.colours:
+            self.colours[colour] = hex_to_rgb(colour)
+        return self.colours[colour]
+
+    def draw(self, snapshot) -> np.ndarray:
+        """
+        draw snapshot into the frame buffer
+        :return: the frame buffer, shape (height, width, 3), overwritten by the next draw
+        """
+        frame = self.frame
+        np.copyto(frame, self.background)
+        if not snapshot.fish:
+            return frame
+
+        positions = np.array([fsh.position for fsh in snapshot.fish], dtype=float)
+        rows = np.floor((self.y_max - positions[:, 1]) * self.scale).astype(np.int64)
+        columns = np.floor((positions[:, 0] - self.x_min) * self.scale).astype(np.int64)
+        colours = np.array([self._rgb(fsh.colour) for fsh in snapshot.fish], dtype=np.uint8)
+        groups = {}
+        for i, fsh in enumerate(snapshot.fish):
+            groups.setdefault((fsh.species, fsh.species.rotation_bin(fsh.rotation)), []).append(i)
+
+        # one vectorised write per sprite shape, covering every fish drawn with it
+        for key, members in groups.items():
+            sprite_rows, sprite_columns = self._sprite(*key)
+            members = np.array(members)
+            pixel_rows = rows[members][:, None] + sprite_rows[None, :]
+            pixel_columns = columns[members][:, None] + sprite_columns[None, :]
+            on_frame = (pixel_rows >= 0) & (pixel_rows < self.height) & \
+                (pixel_columns >= 0) & (pixel_columns < self.width)
+            fish_colours = np.broadcast_to(colours[members][:, None, :], pixel_rows.shape + (3, ))
+            frame[pixel_rows[on_frame], pixel_columns[on_frame]] = fish_colours[on_frame]
+
+        labels = [(fsh.name, columns[i], rows[i]) for i, fsh in enumerate(snapshot.fish)
+                  if fsh.unique_id in self.labelled_fish]
+        if self.show_tick:
+            labels.append((f'time {snapshot.tick}', 5, 5))
+        if labels:
+            self._write(frame, labels)
+        return frame
+
+    @staticmethod
+    def _write(frame: np.ndarray, labels: list):
+        """write (text, column, row) labels onto frame in place"""
+        from PIL import Image, ImageDraw
+        image = Image.fromarray(frame)
+        pen = ImageDraw.Draw(image)
+        for text, column, row in labels:
+            pen.text((int(column), int(row)), text, fill=(0, 0, 0))
+        frame[:] = np.asarray(image)
+
+    def frame_seconds(self, snapshot, repeats: int=3) -> float:
+        """
+        estimate the wall clock cost of rendering one frame
+        :return: seconds per frame
+        """
+        start = time.perf_counter()
+        for _ in range(repeats):
+            self.draw(snapshot).tobytes()
+        return (time.perf_counter() - start) / repeats
+
+    def save(self, snapshots, frames: int, save_filename: str, fps: int=5, metadata: dict=None):
+        """
+        draw each snapshot and pipe the raw frame straight to ffmpeg
+        :param snapshots: iterable of OceanSnapshots, consumed one frame at a time
+        :param frames: number of snapshots, only used for logging
+        """
+        command = [self.ffmpeg_path, '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+                   '-s', f'{self.width}x{self.height}', '-r', str(fps), '-i', '-']
+        for key, value in (metadata or {}).items():
+            command += ['-metadata', f'{key}={value}']
+        command += ['-pix_fmt', 'yuv420p', save_filename]
+        logger.info(f'rendering {frames} frames of {self.width}x{self.height} to {save_filename}')
+
+        encoder = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            for snapshot in snapshots:
+                encoder.stdin.write(self.draw(snapshot).data)
+        except BrokenPipeError:
+            pass  # ffmpeg failed, its error is reported below
+        finally:
+            encoder.stdin.close()
+            error = encoder.stderr.read()
+            encoder.wait()
+        if encoder.returncode != 0:
+            raise subprocess.CalledProcessError(encoder.returncode, command, stderr=error)
+
+    def close(self):
+        pass
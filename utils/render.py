@@ -0,0 +1,101 @@
+import io
+import logging
+import os
+import time
+
+import matplotlib.animation as animation
+from matplotlib.collections import PatchCollection
+from matplotlib.lines import Line2D
+from matplotlib.patches import Polygon
+import matplotlib.pyplot as plt
+from matplotlib.text import Text
+
+logger = logging.getLogger(__name__)
+
+"""
+drawing the ocean with matplotlib - only imported once a video is requested (see OceanEnvironment.passage_of_time)
+    so that the simulation itself runs without a display or the plotting stack
+"""
+
+
+class MatplotlibRenderer:
+    def __init__(self, ocean, figsize: tuple=(9, 7), labels: bool=True):
+        """
+        draws OceanSnapshots of ocean onto a matplotlib figure and saves them as a video
+        :param ocean: the OceanEnvironment being drawn, for its coastline and axes limits
+        :param figsize: figure size in inches
+        :param labels: if True each fish is labelled with its name
+        """
+        self.ocean = ocean
+        self.labels = labels
+        self.fig, self.ax = plt.subplots(figsize=figsize)
+        self._add_ocean(self.ax)
+        self.ax.set_yticks([])
+        self.ax.set_xticks([])
+
+    def _add_ocean(self, axis):
+        """
+        add ocean perimeter as patch
+        :param axis: chart axis to add to
+        :return: nothing
+        """
+
+        patches = []
+        poly = Polygon(self.ocean.boundary, closed=True)
+        patches.append(poly)
+        p = PatchCollection(patches, alpha=0.3, facecolors=self.ocean.sea_colour)
+        axis.add_collection(p)
+
+        x_limit, y_limit = self.ocean._get_axes_limits()
+
+        axis.set_xlim(x_limit)
+        axis.set_ylim(y_limit)
+
+    def draw(self, snapshot):
+        ax = self.ax
+        ax.set_title(f'time {snapshot.tick}')
+        # remove previous fish - could change this by using set_colour argument
+        for x in ax.get_children():
+            if type(x) == Line2D or type(x) == Text:
+                # try and except is necessary to avoid removing crucial Text objects
+                try:
+                    x.remove()
+                except NotImplementedError:
+                    continue
+        for fsh in snapshot.fish:
+            ln = Line2D([fsh.previous_position[0], fsh.position[0]], [fsh.previous_position[1], fsh.position[1]],
+                        marker=fsh.species.marker(fsh.rotation), markersize=fsh.size,  c=fsh.colour,
+                        linestyle='none', markevery=[1])
+
+            if self.labels:
+                ax.text(fsh.position[0], fsh.position[1], f'{fsh.name}', fontsize=8)
+            # ax.text(fsh.position[0], fsh.position[1], f'{fsh.name} ({fsh.unique_id})', fontsize=6)
+            ax.add_line(ln)
+
+    def frame_seconds(self, snapshot, repeats: int=3) -> float:
+        """
+        estimate the wall clock cost of rendering one frame by drawing snapshot the same way the movie writer does
+        :return: seconds per frame
+        """
+        start = time.perf_counter()
+        for _ in range(repeats):
+            self.draw(snapshot)
+            self.fig.savefig(io.BytesIO(), format='rgba', dpi=self.fig.dpi)
+        return (time.perf_counter() - start) / repeats
+
+    def save(self, snapshots, frames: int, save_filename: str, fps: int=5, metadata: dict=None):
+        """
+        draw each snapshot as a frame of a video
+        :param snapshots: iterable of OceanSnapshots, consumed one frame at a time
+        :param frames: number of snapshots
+        """
+        ff_writer = animation.writers['ffmpeg'](fps=fps, metadata=metadata)
+        # to update speed on animation need to play with interval and fps
+        # init_func stops matplotlib drawing a frame just for the initial figure, and without repeat / frame caching
+        # matplotlib consumes each snapshot exactly once, as it is produced
+        ani = animation.FuncAnimation(self.fig, self.draw, frames=iter(snapshots), init_func=lambda: [],
+                                      interval=50, save_count=frames, cache_frame_data=False, repeat=False)
+        ani.save(os.path.join(save_filename), writer=ff_writer)
+
+    def close(self):
+        plt.close(self.fig)
@@ -0,0 +1,139 @@
+import logging
+
+import numpy as np
+
+from utils.positioning import NearbyWaters
+from utils.spatial_utils import SpatialUtils
+
+logger = logging.getLogger(__name__)
+
+
+class _CachedPerception:
+    __slots__ = ('margin', 'drift_at_build', 'own_drift')
+
+    def __init__(self, margin: float, drift_at_build: float):
+        self.margin = margin  # how much closer any fish can get before the fish could notice it
+        self.drift_at_build = drift_at_build
+        self.own_drift = 0
+
+
+class PerceptionScheduler:
+    def __init__(self, ocean):
+        """
+        decides which fish need to rebuild their NearbyWaters each tick and in which order fish swim
+
+        a fish that could see no other fish keeps that perception until it, or any other fish, could have moved far
+            enough to come into view. Rather than tracking every fish, the ocean keeps a running total of the
+            furthest any single fish moved in each tick (drift) - no fish can have moved further than that since a
+            perception was built. Fish with neighbours always rebuild, as any move changes the distances they act on
+
+        swim order is highest incentive to move first (number of predators nearby, see NearbyWaters.count_predators).
+            Fish are kept in buckets keyed by incentive, a fish only moves bucket when its incentive changes
+        :param ocean: the OceanEnvironment whose population will swim
+        """
+        self.ocean = ocean
+        self.cache = {}
+        self.buckets = {}
+        self.incentive = {}
+        self.drift = 0  # summed over completed ticks
+        self.tick_drift = 0  # furthest single move in the current tick
+        self.rebuilt = 0
+        self.reused = 0
+        for fsh in ocean.population:
+            self._set_incentive(fsh, fsh.incentive_to_move)
+
+    def _set_incentive(self, fish, incentive: int):
+        previous = self.incentive.get(fish.unique_id)
+        if previous == incentive:
+            return
+        if previous is not None:
+            del self.buckets[previous][fish.unique_id]
+            if not self.buckets[previous]:
+                del self.buckets[previous]
+        self.buckets.setdefault(incentive, {})[fish.unique_id] = fish
+        self.incentive[fish.unique_id] = incentive
+        fish.incentive_to_move = incentive
+
+    def order(self) -> list:
+        """population in the order it should swim this tick"""
+        if len(self.incentive) != len(self.ocean.population):
+            for fsh in self.ocean.population:
+                if fsh.unique_id not in self.incentive:
+                    self._set_incentive(fsh, fsh.incentive_to_move)
+            for incentive, bucket in list(self.buckets.items()):
+                for unique_id in [x for x, fsh in bucket.items() if not fsh.alive]:
+                    self.forget(bucket[unique_id])
+        ordered = []
+        for incentive in sorted(self.buckets, reverse=True):
+            ordered.extend(self.buckets[incentive].values())
+        return ordered
+
+    def forget(self, fish):
+        """stop scheduling a fish that has left the ocean"""
+        incentive = self.incentive.pop(fish.unique_id, None)
+        if incentive is not None:
+            del self.buckets[incentive][fish.unique_id]
+            if not self.buckets[incentive]:
+                del self.buckets[incentive]
+        self.cache.pop(fish.unique_id, None)
+
+    def _margin(self, fish) -> float:
+        """distance any fish would need to cover to come into view of fish"""
+        others = [x for x in self.ocean.population if x.unique_id != fish.unique_id]
+        if not others:
+            return np.inf
+        positions = np.array([x.position for x in others], dtype=float)
+        distances = np.hypot(positions[:, 0] - fish.position[0], positions[:, 1] - fish.position[1]) - fish.size
+        same_species = np.array([type(x) == type(fish) for x in others])
+        sight = np.where(same_species, max(fish.repel_distance, fish.follow_distance), fish.repel_distance)
+        return float(np.min(distances - sight))
+
+    def perceive(self, fish) -> NearbyWaters:
+        """up to date NearbyWaters for fish, reusing what it saw last time if nothing can have come into view"""
+        cached = self.cache.get(fish.unique_id)
+        drift = self.drift + self.tick_drift - cached.drift_at_build if cached is not None else 0
+        if cached is not None and cached.own_drift + drift < cached.margin:
+            self.reused += 1
+            return NearbyWaters(fish=fish, ocean=self.ocean, nearby_fish=((), (), ()))
+
+        self.rebuilt += 1
+        sub_env = NearbyWaters(fish=fish, ocean=self.ocean)
+        if sub_env.all_nearby_fish:
+            self.cache.pop(fish.unique_id, None)
+        else:
+            # moves already made in this tick are in the positions used for the margin, so only count from the
+            # start of the tick - conservative but never too late to notice another fish
+            self.cache[fish.unique_id] = _CachedPerception(margin=self._margin(fish), drift_at_build=self.drift)
+        self._set_incentive(fish, sub_env.predator_count)
+        return sub_env
+
+    def moved(self, fish):
+        """record that fish has just swum"""
+        distance = SpatialUtils.calc_distance(fish.position, fish.previous_position)
+        self.tick_drift = max(self.tick_drift, distance)
+        cached = self.cache.get(fish.unique_id)
+        if cached is not None:
+            cached.own_drift += distance
+
+    def end_tick(self):
+        self.drift += self.tick_drift
+        self.tick_drift = 0
+        logger.debug(f'perception rebuilt for {self.rebuilt} fish, reused for {self.reused}')
+        self.rebuilt = 0
+        self.reused = 0
+
+    def swim(self, verbose: bool=True, skip: set=frozenset()):
+        """
+        move every fish once
+        :param skip: unique ids of fish that have already moved this tick (e.g. as part of an aggregate shoal)
+        """
+        for fsh in self.order():
+            if not fsh.alive:  # eaten earlier in the tick
+                self.forget(fsh)
+                continue
+            if fsh.unique_id in skip:
+                self.moved(fsh)
+                continue
+            fsh.swim(sub_env=self.perceive(fsh), verbose=verbose)
+            self.moved(fsh)
+        self.end_tick()
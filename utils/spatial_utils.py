@@ -2,6 +2,8 @@ import logging
 import math
 import sys
 
+import numpy as np
+
 
 logger = logging.getLogger(__name__)
 
@@ -93,6 +95,27 @@ class SpatialUtils:
 
         return False if number == 0 else True
 
+    @staticmethod
+    def poly_contains_points(points, polygon: tuple) -> np.ndarray:
+        """
+        vectorised winding number test for many points at once, gives the same answer as poly_contains_point with
+            method='winding' for each point
+        :param points: array-like of shape (n, 2)
+        :param polygon: closed polygon, first coordinate repeated at the end
+        :return: boolean array of length n, True where the point is inside the polygon
+        """
+        pts = np.asarray(points, dtype=float).reshape(-1, 2)
+        poly = np.asarray(polygon, dtype=float)
+        px = pts[:, 0][:, None]
+        py = pts[:, 1][:, None]
+        v1x, v1y = poly[:-1, 0][None, :], poly[:-1, 1][None, :]
+        v2x, v2y = poly[1:, 0][None, :], poly[1:, 1][None, :]
+        left = (v2x - v1x) * (py - v1y) - (px - v1x) * (v2y - v1y)
+        upward = (v1y <= py) & (v2y > py) & (left > 0)
+        downward = (v1y > py) & (v2y <= py) & (left < 0)
+        winding_number = upward.sum(axis=1) - downward.sum(axis=1)
+        return winding_number != 0
+
     @staticmethod
     def extract_bounding_box(bounding_coordinates) -> tuple:
         # create initial values to be overwritten
@@ -136,6 +159,67 @@ class SpatialUtils:
             distances_to_edge.append(numerator / denominator)
         return round(min(distances_to_edge), 3)
 
+    @staticmethod
+    def signed_area(polygon: tuple) -> float:
+        """shoelace formula, positive if the polygon is listed counterclockwise"""
+        area = 0
+        for vertex1, vertex2 in zip(polygon[:-1], polygon[1:]):
+            area += vertex1[0] * vertex2[1] - vertex2[0] * vertex1[1]
+        return area / 2
+
+    @staticmethod
+    def closest_point_on_boundary(coordinates, polygon: tuple) -> tuple:
+        """
+        nearest point to coordinates on any edge of the polygon (unlike distance_to_boundary, which measures to
+            the infinite lines through the edges)
+        :return: closest point, index of the edge it lies on
+        """
+        best_point = None
+        best_edge = None
+        best_dist = math.inf
+        for i in range(len(polygon) - 1):
+            vertex1 = polygon[i]
+            vertex2 = polygon[i + 1]
+            edge_x = vertex2[0] - vertex1[0]
+            edge_y = vertex2[1] - vertex1[1]
+            edge_length_sq = edge_x ** 2 + edge_y ** 2
+            if edge_length_sq == 0:
+                continue
+            # how far along the edge the perpendicular from coordinates lands, kept within the edge
+            along = ((coordinates[0] - vertex1[0]) * edge_x + (coordinates[1] - vertex1[1]) * edge_y) / edge_length_sq
+            along = min(max(along, 0), 1)
+            point = (vertex1[0] + along * edge_x, vertex1[1] + along * edge_y)
+            dist = (point[0] - coordinates[0]) ** 2 + (point[1] - coordinates[1]) ** 2
+            if dist < best_dist:
+                best_point, best_edge, best_dist = point, i, dist
+        return best_point, best_edge
+
+    @staticmethod
+    def project_inside_polygon(coordinates, polygon: tuple, clearance: float=0.001) -> tuple:
+        """
+        move a point outside of the polygon to just inside the nearest part of its boundary
+        :param clearance: distance inside the boundary to place the point
+        :return: projected coordinates, not guaranteed to be inside at sharp reflex corners
+        """
+        point, edge = SpatialUtils.closest_point_on_boundary(coordinates, polygon)
+        # inward normal is to the left of each edge for a counterclockwise polygon, to the right otherwise
+        orientation = 1 if SpatialUtils.signed_area(polygon) > 0 else -1
+        candidates = []
+        # at a vertex the neighbouring edge may give the better normal
+        for i in (edge, edge - 1 if edge > 0 else len(polygon) - 2, (edge + 1) % (len(polygon) - 1)):
+            vertex1 = polygon[i]
+            vertex2 = polygon[i + 1]
+            length = math.hypot(vertex2[0] - vertex1[0], vertex2[1] - vertex1[1])
+            if length == 0:
+                continue
+            normal = (-(vertex2[1] - vertex1[1]) / length * orientation,
+                      (vertex2[0] - vertex1[0]) / length * orientation)
+            candidate = (point[0] + normal[0] * clearance, point[1] + normal[1] * clearance)
+            if SpatialUtils.poly_contains_point(coordinates=candidate, polygon=polygon, method='winding'):
+                return candidate
+            candidates.append(candidate)
+        return candidates[0] if candidates else point
+
     @staticmethod
     def calc_distance(coordinates1: list, coordinates2: list) -> float:
         """
@@ -164,6 +248,42 @@ class SpatialUtils:
         # add cosine to x and sine to y to give new coord
         return starting_coordinates[0] + cosin_ang, starting_coordinates[1] + sin_ang
 
+    @staticmethod
+    def morton_codes(points, origin=None, extent=None, bits: int=16) -> np.ndarray:
+        """
+        position of each point along a Z-order (Morton) curve: the points are snapped to a 2**bits square grid
+            and the bits of their x and y cells interleaved, so points close together in space mostly have codes
+            close together
+        :param points: array-like of shape (n, 2)
+        :param origin: lower left corner of the grid, defaults to the smallest x and y of the points
+        :param extent: width and height of the grid, defaults to just covering the points
+        :param bits: bits per axis, at most 32
+        :return: uint64 array of length n
+        """
+        pts = np.asarray(points, dtype=float).reshape(-1, 2)
+        if len(pts) == 0:
+            return np.empty(0, dtype=np.uint64)
+        origin = pts.min(axis=0) if origin is None else np.asarray(origin, dtype=float)
+        extent = np.ptp(pts, axis=0) if extent is None else np.asarray(extent, dtype=float)
+        cells = 2 ** bits
+        scaled = (pts - origin) / np.where(extent > 0, extent, 1) * cells
+        cell = np.clip(np.floor(scaled), 0, cells - 1).astype(np.uint64)
+
+        def spread(values):
+            # move bit k of each value to bit 2k ('part by one'), five shift and mask rounds for 32 bits
+            values = values & np.uint64(0xFFFFFFFF)
+            for shift, mask in ((16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F),
+                                (2, 0x3333333333333333), (1, 0x5555555555555555)):
+                values = (values | (values << np.uint64(shift))) & np.uint64(mask)
+            return values
+
+        return spread(cell[:, 0]) | (spread(cell[:, 1]) << np.uint64(1))
+
+    @staticmethod
+    def morton_order(points, origin=None, extent=None) -> np.ndarray:
+        """indices that sort points along a Z-order curve (see morton_codes), ties kept in their given order"""
+        return np.argsort(SpatialUtils.morton_codes(points, origin=origin, extent=extent), kind='stable')
+
     # @staticmethod
     # def generate_circle_boundary(starting_coords: tuple, radius: int, increments: int=360) -> tuple:
     #     """
@@ -0,0 +1,69 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SpeciesProfile:
+    __slots__ = ('name', 'size', 'colour', 'cluster_colour', 'max_movement_radius', 'repel_distance',
+                 'align_distance', 'follow_distance', 'eats_fish', 'marker_vertices', 'rotation_bins', '_markers')
+
+    def __init__(self, name: str, marker_vertices: tuple, eats_fish: tuple=(), size=1, colour='white',
+                 cluster_colour='black', max_movement_radius=0, repel_dist=0, align_dist=0, follow_dist=0,
+                 rotation_bins: int=72):
+        """
+        everything that is the same for every fish of a species, shared by all of them rather than copied onto each
+        :param name: species name
+        :param marker_vertices: outline of the fish facing upwards (head towards +y), drawn as a closed polygon
+        :param eats_fish: the type of fish that this species can eat
+        :param size: the size of this species
+        :param colour: colour of fish when not in shoal
+        :param cluster_colour: colour of fish when in shoal
+        :param max_movement_radius: how far this species can move in a single turn
+        :param repel_dist: the max distance which the focal fish believes is too close to other fish
+        :param align_dist: within this distance (and greater than repel distance), the focal fish will want to
+            align with other fish of the same species
+        :param follow_dist: within this distance (and greater than the align distance), the focal fish will want to
+            get closer to other fish of the same species
+        :param rotation_bins: number of rotated markers kept, i.e. markers are drawn to the nearest 360 / bins degrees
+        """
+        self.name = name
+        self.size = size
+        self.colour = colour
+        self.cluster_colour = cluster_colour
+        self.max_movement_radius = max_movement_radius
+        self.repel_distance = repel_dist
+        self.align_distance = align_dist
+        self.follow_distance = follow_dist
+        self.eats_fish = tuple(eats_fish)
+        self.marker_vertices = tuple(tuple(x) for x in marker_vertices)
+        self.rotation_bins = rotation_bins
+        self._markers = None  # rotated markers, built the first time one is drawn
+
+    def __setattr__(self, key, value):
+        if key != '_markers' and hasattr(self, key):
+            raise AttributeError(f'species profile {self.name} is shared by every fish, {key} cannot be changed')
+        super().__setattr__(key, value)
+
+    def __repr__(self):
+        return f'SpeciesProfile({self.name})'
+
+    def _build_markers(self) -> tuple:
+        # markers are only needed to draw, so matplotlib is only imported once a fish is drawn
+        from matplotlib.path import Path
+        from matplotlib.transforms import Affine2D
+
+        codes = [Path.MOVETO] + [Path.LINETO] * (len(self.marker_vertices) - 2) + [Path.CLOSEPOLY]
+        upright = Path(self.marker_vertices, codes)
+        step = 360 / self.rotation_bins
+        # rotation 0 faces along +x, the marker is drawn facing +y
+        return tuple(upright.transformed(Affine2D().rotate_deg(i * step - 90)) for i in range(self.rotation_bins))
+
+    def rotation_bin(self, rotation: float) -> int:
+        """index of the marker bin nearest to rotation degrees"""
+        return int(round(rotation * self.rotation_bins / 360)) % self.rotation_bins
+
+    def marker(self, rotation: float):
+        """matplotlib Path of a fish of this species facing rotation degrees, to the nearest bin"""
+        if self._markers is None:
+            self._markers = self._build_markers()
+        return self._markers[self.rotation_bin(rotation)]
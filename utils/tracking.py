@@ -0,0 +1,137 @@
+import logging
+from collections import Counter, namedtuple
+
+import numpy as np
+
+from utils.metrics import ColumnarWriter
+
+logger = logging.getLogger(__name__)
+
+"""
+DBSCAN numbers shoals afresh every tick, so a shoal's label says nothing about which shoal it was last tick.
+    ShoalTracker matches each tick's clusters to the previous tick's shoals by the fish they share, keeps stable
+    shoal ids and logs when shoals are born, die, split and merge
+"""
+
+BIRTH, DEATH, SPLIT, MERGE = 0, 1, 2, 3
+EVENT_NAMES = ('birth', 'death', 'split', 'merge')
+
+# one row per event. other_id is the shoal split from (split) or merged into (merge), -1 for births and deaths.
+# size is the size of the shoal when it was born / split off, or when last seen for deaths and merges
+EVENT_SCHEMA = {
+    'tick': 'int64',
+    'event': 'int8',
+    'shoal_id': 'int64',
+    'other_id': 'int64',
+    'size': 'int64',
+}
+
+# when a shoal started and ended, and how. ended, fate and successor are None while the shoal is alive
+ShoalLifetime = namedtuple('ShoalLifetime', ['shoal_id', 'started', 'origin', 'parent', 'ended', 'fate',
+                                             'successor'])
+
+
+class ShoalTracker:
+    def __init__(self):
+        """
+        gives each shoal a stable id for as long as it exists. Each tick's clusters are matched to the previous
+            tick's shoals by counting the fish each pair has in common (only pairs sharing at least one fish are
+            counted, so this is O(number of fish)):
+            a cluster and a shoal that are each other's largest overlap are the same shoal, and the cluster keeps
+                the shoal's id
+            any other cluster is new - split from its largest overlap if it has one, otherwise born
+            any other shoal has ended - merged into the cluster that took most of its fish, or died if none did
+        """
+        self.previous = {}  # unique id of each fish in a shoal last tick -> its stable shoal id
+        self.sizes = Counter()  # stable shoal id -> members last tick
+        self.next_id = 1  # same numbering as DBSCAN, 1 upwards with -1 for fish not in a shoal
+        self.tick = -1
+        self.events = {column: [] for column in EVENT_SCHEMA}
+
+    def _log(self, event: int, shoal_id: int, other_id: int=-1, size: int=0):
+        for column, value in zip(EVENT_SCHEMA, (self.tick, event, shoal_id, other_id, size)):
+            self.events[column].append(value)
+
+    def _new_id(self) -> int:
+        shoal_id = self.next_id
+        self.next_id += 1
+        return shoal_id
+
+    def update(self, unique_ids: list, labels: list, tick: int=None) -> list:
+        """
+        match this tick's clusters to the previous tick's shoals
+        :param unique_ids: unique id of each fish
+        :param labels: cluster label of each fish, as returned by DBSCAN (-1 for fish not in a shoal)
+        :param tick: the tick being clustered, defaults to one after the last
+        :return: stable shoal id of each fish, -1 for fish not in a shoal
+        """
+        self.tick = self.tick + 1 if tick is None else tick
+        sizes = Counter()
+        overlap = Counter()  # (previous shoal id, cluster label) -> fish in both
+        for unique_id, label in zip(unique_ids, labels):
+            if label == -1:
+                continue
+            sizes[label] += 1
+            previous = self.previous.get(unique_id)
+            if previous is not None:
+                overlap[(previous, label)] += 1
+
+        # largest overlap each way, ties go to the lower id so that matching does not depend on dict order
+        parent = {}
+        child = {}
+        for (shoal_id, label), shared in overlap.items():
+            if (shared, -shoal_id) > parent.get(label, (0, 0)):
+                parent[label] = (shared, -shoal_id)
+            if (shared, -label) > child.get(shoal_id, (0, 0)):
+                child[shoal_id] = (shared, -label)
+        parent = {label: -x[1] for label, x in parent.items()}
+        child = {shoal_id: -x[1] for shoal_id, x in child.items()}
+
+        stable = {}
+        for label in sorted(sizes):
+            shoal_id = parent.get(label)
+            if shoal_id is not None and child[shoal_id] == label:
+                stable[label] = shoal_id
+            elif shoal_id is not None:
+                stable[label] = self._new_id()
+                self._log(SPLIT, stable[label], other_id=shoal_id, size=sizes[label])
+            else:
+                stable[label] = self._new_id()
+                self._log(BIRTH, stable[label], size=sizes[label])
+        for shoal_id in sorted(self.sizes):
+            label = child.get(shoal_id)
+            if label is None:
+                self._log(DEATH, shoal_id, size=self.sizes[shoal_id])
+            elif stable[label] != shoal_id:
+                self._log(MERGE, shoal_id, other_id=stable[label], size=self.sizes[shoal_id])
+
+        shoal_ids = [-1 if label == -1 else stable[label] for label in labels]
+        self.previous = {unique_id: shoal_id for unique_id, shoal_id in zip(unique_ids, shoal_ids) if shoal_id != -1}
+        self.sizes = Counter({stable[label]: size for label, size in sizes.items()})
+        return shoal_ids
+
+    def write(self, directory: str):
+        """write the event log as columns (see utils.metrics.load_columns to read it back)"""
+        writer = ColumnarWriter(directory, EVENT_SCHEMA)
+        writer.append(**{column: np.array(values, dtype=EVENT_SCHEMA[column])
+                         for column, values in self.events.items()})
+        writer.close()
+        logger.info(f'{len(self.events["tick"])} shoal events written to {directory}')
+
+
+def shoal_lifetimes(events: dict) -> dict:
+    """
+    one pass over an event log (ShoalTracker.events, or as read back with load_columns)
+    :return: shoal id -> ShoalLifetime, for every shoal that started within the log
+    """
+    lifetimes = {}
+    for tick, event, shoal_id, other_id in zip(*(np.asarray(events[x]).tolist()
+                                                 for x in ('tick', 'event', 'shoal_id', 'other_id'))):
+        if event in (BIRTH, SPLIT):
+            lifetimes[shoal_id] = ShoalLifetime(shoal_id=shoal_id, started=tick, origin=EVENT_NAMES[event],
+                                                parent=other_id if event == SPLIT else None, ended=None, fate=None,
+                                                successor=None)
+        elif shoal_id in lifetimes:
+            lifetimes[shoal_id] = lifetimes[shoal_id]._replace(ended=tick, fate=EVENT_NAMES[event],
+                                                               successor=other_id if event == MERGE else None)
+    return lifetimes
@@ -0,0 +1,142 @@
+import json
+import logging
+import os
+
+import numpy as np
+
+from utils.metrics import ColumnarWriter, load_columns
+from utils.pipeline import FishSnapshot, OceanSnapshot, RenderSchedule
+
+logger = logging.getLogger(__name__)
+
+"""
+the whole run as columns - every fish's snapshot each period - so that it can be drawn again (at another frame rate,
+    with another renderer) without simulating it again
+"""
+
+# one row per fish per period, fish in the order they were drawn
+TRAJECTORY_SCHEMA = {
+    'tick': 'int64',
+    'unique_id': 'int64',
+    'species': 'int16',  # index into the species names in fish.json
+    'previous_x': 'float64',
+    'previous_y': 'float64',
+    'x': 'float64',
+    'y': 'float64',
+    'rotation': 'float64',
+    'shoal_id': 'int64',  # -1 when not in a shoal
+}
+
+
+class TrajectoryRecorder:
+    def __init__(self, directory: str, batch_size: int=10000):
+        """
+        streams snapshots to <directory> as columns (see utils.metrics.ColumnarWriter), with the fish names and
+            species in <directory>/fish.json
+        :param batch_size: fish rows held in memory before being written
+        """
+        self.directory = directory
+        self.writer = ColumnarWriter(directory, TRAJECTORY_SCHEMA, batch_size=batch_size)
+        self.species = []  # species name of each code
+        self.names = {}
+
+    def record(self, snapshot: OceanSnapshot):
+        fish = snapshot.fish
+        for fsh in fish:
+            if fsh.species.name not in self.species:
+                self.species.append(fsh.species.name)
+            self.names.setdefault(fsh.unique_id, fsh.name)
+        previous = np.array([fsh.previous_position for fsh in fish], dtype=float).reshape(-1, 2)
+        position = np.array([fsh.position for fsh in fish], dtype=float).reshape(-1, 2)
+        self.writer.append(tick=np.full(len(fish), snapshot.tick), unique_id=[fsh.unique_id for fsh in fish],
+                           species=[self.species.index(fsh.species.name) for fsh in fish],
+                           previous_x=previous[:, 0], previous_y=previous[:, 1], x=position[:, 0], y=position[:, 1],
+                           rotation=[fsh.rotation for fsh in fish],
+                           shoal_id=[-1 if fsh.shoal_id is None else fsh.shoal_id for fsh in fish])
+
+    def close(self):
+        self.writer.close()
+        with open(os.path.join(self.directory, 'fish.json'), 'w') as f:
+            json.dump({'species': self.species, 'names': {str(k): v for k, v in self.names.items()}}, f)
+
+
+def load_trajectory(directory: str, species: list, ticks: list=None):
+    """
+    read back a trajectory written by TrajectoryRecorder
+    :param species: SpeciesProfiles of the fish in the run, matched by name
+    :param ticks: iterable of ticks to yield, in order and read one at a time - defaults to every recorded tick
+    :return: generator of OceanSnapshots in tick order, identical to those recorded
+    """
+    with open(os.path.join(directory, 'fish.json')) as f:
+        fish = json.load(f)
+    by_name = {x.name: x for x in species}
+    missing = set(fish['species']) - set(by_name)
+    if missing:
+        raise ValueError(f'no species profile given for {sorted(missing)}')
+    profiles = [by_name[x] for x in fish['species']]
+    names = {int(k): v for k, v in fish['names'].items()}
+
+    columns = load_columns(directory)
+    recorded, starts = np.unique(columns['tick'], return_index=True)
+    ends = np.append(starts[1:], len(columns['tick']))
+    wanted = recorded if ticks is None else ticks
+    for tick in wanted:
+        k = int(np.searchsorted(recorded, tick))
+        if k == len(recorded) or recorded[k] != tick:
+            raise KeyError(f'tick {tick} is not in the trajectory at {directory}')
+        rows = slice(starts[k], ends[k])
+        snapshot_fish = []
+        for unique_id, code, previous_x, previous_y, x, y, rotation, shoal_id in zip(
+                *(columns[x][rows].tolist() for x in ('unique_id', 'species', 'previous_x', 'previous_y', 'x', 'y',
+                                                      'rotation', 'shoal_id'))):
+            profile = profiles[code]
+            in_shoal = shoal_id != -1
+            snapshot_fish.append(FishSnapshot(
+                unique_id=unique_id, name=names[unique_id], previous_position=(previous_x, previous_y),
+                position=(x, y), rotation=rotation, size=profile.size,
+                colour=profile.cluster_colour if in_shoal else profile.colour, species=profile,
+                shoal_id=shoal_id if in_shoal else None))
+        yield OceanSnapshot(tick=int(tick), fish=tuple(snapshot_fish))
+
+
+def render_trajectory(ocean, directory: str, species: list, save_filename: str, render_every: int=1,
+                      render_budget: float=None, fps: int=5, renderer: str='matplotlib', labelled_fish: tuple=(),
+                      interpolated_frames: int=0):
+    """
+    draw a recorded run, choosing frames the same way as OceanEnvironment.passage_of_time (see there for the
+        parameters) so that the video is the one the run itself would have drawn - except with a render budget,
+        where the frames drawn depend on how long drawing them takes
+    :param ocean: an ocean with the run's coastline, it does not need any fish
+    :param species: SpeciesProfiles of the fish in the run
+    """
+    from utils.environ import make_renderer
+
+    ticks = np.unique(load_columns(directory, columns=['tick'])['tick'])
+    time_periods = int(ticks[-1]) + 1 if len(ticks) else 0
+    renderer = make_renderer(ocean, renderer, labelled_fish=labelled_fish)
+    try:
+        seconds_per_frame = None
+        if render_budget is not None and time_periods:
+            first = next(load_trajectory(directory, species, ticks=[0]))
+            seconds_per_frame = renderer.frame_seconds(first) * (interpolated_frames + 1)
+        schedule = RenderSchedule(time_periods, render_every=render_every,
+                                  render_budget=render_budget if time_periods else None,
+                                  seconds_per_frame=seconds_per_frame)
+        frames = schedule.frames
+        snapshots = schedule.timed(load_trajectory(directory, species, ticks=schedule.frame_ticks()))
+        video_frames = frames
+        if interpolated_frames > 0:
+            from utils.interpolation import interpolate_snapshots, interpolated_frame_count
+            wrap = (ocean.origin, ocean.extent) if getattr(ocean, 'toroidal', False) else None
+            snapshots = interpolate_snapshots(snapshots, between=interpolated_frames, wrap=wrap)
+            video_frames = interpolated_frame_count(frames, interpolated_frames)
+        metadata = dict(artist='Jamie Edgecombe',
+                        comment=f'periods={time_periods} {schedule.describe()} '
+                                f'render_budget={render_budget} interpolated_frames={interpolated_frames}')
+        renderer.save(snapshots, frames=video_frames, save_filename=save_filename,
+                      fps=fps * (interpolated_frames + 1), metadata=metadata)
+        schedule.write_frames(f'{os.path.splitext(save_filename)[0]}_frames.txt',
+                              interpolated_frames=interpolated_frames)
+    finally:
+        renderer.close()
+    logger.info(f'{save_filename} drawn from the trajectory at {directory}')